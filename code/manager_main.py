@@ -8,15 +8,26 @@ checks requirements and supervises all internal components of the NuvlaEdge
 Arguments:
 
 """
+import asyncio
 import logging
 import os
 import signal
 import sys
-import time
+import threading
 from argparse import ArgumentParser
 
 import system_manager.Requirements as MinReq
+import system_manager.common.Metrics as metrics
+from system_manager.AsyncSupervise import AsyncSupervise
 from system_manager.common import utils
+from system_manager.common.ApiAccounting import RoundReport, accounting
+from system_manager.common.AsyncDocker import AsyncDockerClient
+from system_manager.common.Backpressure import backpressure
+from system_manager.common.ContainerRuntime import NodeInfoSnapshot, docker_pool_size
+from system_manager.common.EventMonitor import DockerEventMonitor
+from system_manager.common.RateLimiter import mutation_limiter
+from system_manager.common.Scheduler import Scheduler
+from system_manager.common.StatusServer import StatusBoard, start_status_server
 from system_manager.Supervise import Supervise
 
 __copyright__ = "Copyright (C) 2021 SixSq"
@@ -24,6 +35,34 @@ __email__ = "support@sixsq.com"
 
 log = logging.getLogger(__name__)
 self_sup = Supervise()
+scheduler = Scheduler(on_job_finished=lambda job: metrics.check_duration.observe(job.last_duration, check=job.name))
+status_board = StatusBoard()
+
+# default schedule of the supervision checks, as (interval in seconds, jitter in seconds, priority)
+# when several checks are due at the same time, the ones with the highest priority run first
+default_schedule = {
+    'classification': (15, 1, 90),
+    'healer': (5, 0.5, 70),
+    'connectivity': (15, 1, 60),
+    'data-gateway': (15, 1, 50),
+    'data-gateway-load': (30, 3, 30),
+    # cheap, since the certificates are only parsed again when they change
+    'certificates': (60, 5, 20),
+    'requirements': (300, 30, 10),
+}
+# checks that only make sense when the orchestrator is Docker
+docker_only_checks = ['healer', 'connectivity', 'data-gateway', 'data-gateway-load']
+# checks that, when due at the same time as others, must wait for them to finish
+# the network checks rely on the node classification, and both of them (re)connect containers to the DG network
+check_dependencies = {
+    'connectivity': ['classification'],
+    'data-gateway': ['classification', 'connectivity'],
+    'data-gateway-load': ['data-gateway'],
+}
+
+# operational status reported by each check, on its last run
+check_results = {}
+check_results_lock = threading.Lock()
 
 
 def log_threads_stackstraces():
@@ -48,6 +87,11 @@ def signal_usr1(signum, frame):
     log_threads_stackstraces()
 
 
+def signal_hup(signum, frame):
+    log.info('Received SIGHUP. Running all checks now')
+    scheduler.wake()
+
+
 class GracefulShutdown:
 
     def __init__(self):
@@ -65,20 +109,23 @@ on_stop = GracefulShutdown()
 
 def requirements_check(sw_rq: MinReq.SoftwareRequirements,
                        system_rq: MinReq.SystemRequirements,
-                       operational_status: list):
+                       operational_status: list,
+                       node_info: NodeInfoSnapshot = None):
     """
     Checks if the NuvlaEdge requirements are met
 
     :param sw_rq: instance of MinReq.SoftwareRequirements
     :param system_rq: instance of MinReq.SystemRequirements
     :param operational_status: list of tuples (status, status_notes)
+    :param node_info: node info snapshot of the current cycle
 
     :return:
     """
+    info = node_info.get() if node_info else None
     sw_rq.not_met = []
     system_rq.not_met = []
-    meet_sw_rq = sw_rq.check_sw_requirements()
-    meet_hw_rq = system_rq.check_all_hw_requirements()
+    meet_sw_rq = sw_rq.check_sw_requirements(info)
+    meet_hw_rq = system_rq.check_all_hw_requirements(info)
     if not meet_sw_rq or not meet_hw_rq:
         not_met = sw_rq.not_met + system_rq.not_met
         not_met_msg = "\n\t* " + "\n\t* ".join(not_met) if not_met else ''
@@ -88,7 +135,7 @@ def requirements_check(sw_rq: MinReq.SoftwareRequirements,
         op_status = utils.status_operational if MinReq.SKIP_MINIMUM_REQUIREMENTS else utils.status_degraded
         operational_status.append((op_status, err_msg))
 
-    operational_status += sw_rq.check_sw_optional_requirements()
+    operational_status += sw_rq.check_sw_optional_requirements(info)
 
     if not utils.status_file_exists():
         utils.set_operational_status(utils.status_operational)
@@ -103,6 +150,144 @@ def requirements_check(sw_rq: MinReq.SoftwareRequirements,
             log.info("Directory " + peripherals + " already exists")
 
 
+def certificates_check():
+    """ Rotates the NuvlaEdge certificates if they are about to expire """
+    if self_sup.is_cert_rotation_needed():
+        log.info("Rotating NuvlaEdge certificates...")
+        self_sup.request_rotate_certificates()
+
+    metrics.certificate_days_left.clear()
+    for file, days_left in self_sup.cert_inventory.days_left().items():
+        metrics.certificate_days_left.set(days_left, file=file)
+
+
+def docker_healer_check():
+    """ Refreshes the list of NuvlaEdge containers and heals the broken ones """
+    try:
+        self_sup.list_nuvlaedge_containers()
+    except RuntimeError:
+        return
+
+    self_sup.docker_container_healer()
+
+
+def run_check(name: str, check):
+    """
+    Runs a supervision check and keeps the operational status it reported, until its next run
+
+    :param name: name of the check
+    :param check: function to be called, which reports its status in self_sup.operational_status
+    """
+    if backpressure.skips(name):
+        # keep the result of its last run
+        log.debug(f'Skipping check {name}: the container runtime is overloaded')
+        return
+
+    self_sup.operational_status = []
+    try:
+        check()
+    finally:
+        store_check_result(name, self_sup.operational_status)
+
+
+def store_check_result(name: str, operational_status: list):
+    """
+    Keeps the operational status reported by a check, until its next run
+
+    :param name: name of the check
+    :param operational_status: list of tuples (status, status_notes)
+    """
+    with check_results_lock:
+        check_results[name] = list(operational_status)
+
+
+def report_operational_status():
+    """ Aggregates the operational status reported by all the checks, and writes it to the shared volume """
+    with check_results_lock:
+        results = dict(check_results)
+    operational_status = [status for check_statuses in results.values() for status in check_statuses]
+    log.debug(f'Operational status checks: {operational_status}')
+
+    statuses = [s[0] for s in operational_status]
+    status_notes = [s[-1] for s in operational_status]
+
+    if utils.status_degraded in statuses:
+        status = utils.status_degraded
+    elif all([x == utils.status_operational for x in statuses]) or not operational_status:
+        status = utils.status_operational
+    else:
+        status = utils.status_unknown
+
+    previous_status = status_board.snapshot()['status']
+    if previous_status and previous_status != status:
+        log.info(f'Operational status changed from {previous_status} to {status}')
+        metrics.status_transitions.inc(from_status=previous_status, to_status=status)
+    for s in [utils.status_operational, utils.status_degraded, utils.status_unknown]:
+        metrics.operational_status.set(1 if s == status else 0, status=s)
+
+    utils.set_operational_status(status, status_notes)
+    status_board.publish(status, status_notes, results)
+
+
+def apply_backpressure(api_calls: RoundReport, ping_ms: float = None) -> None:
+    """ Stretches (or restores) the intervals of the checks according to the latency of the container runtime, and
+    reports the backpressure in the operational status
+
+    :param api_calls: API calls made during the round
+    :param ping_ms: if set, latency of a ping to the container runtime
+    """
+    backpressure.observe_round(api_calls, ping_ms)
+    scheduler.stretch = backpressure.stretch
+    store_check_result('backpressure', backpressure.status_notes())
+
+
+def end_of_round(probe: bool = True) -> RoundReport:
+    """ Reports the operational status once a round of checks is done, together with the API calls it took
+
+    :param probe: whether to ping the container runtime, to measure its latency
+    :return: API calls made during the round
+    """
+    # before closing the round, so that the ping is accounted in it rather than in the next one
+    ping_ms = backpressure.probe() if probe else None
+    api_calls = accounting.end_round()
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f'Round of checks: {api_calls.dump()}')
+
+    apply_backpressure(api_calls, ping_ms)
+    report_operational_status()
+    return api_calls
+
+
+def start_docker_event_monitor() -> DockerEventMonitor:
+    """
+    Starts consuming the Docker events stream in the background, so that the healer and the network checks are woken
+    up as soon as a NuvlaEdge container dies or loses its network, instead of waiting for their next run
+
+    :return: the running DockerEventMonitor
+    """
+    try:
+        project_name = self_sup.get_project_name()
+    except RuntimeError:
+        project_name = utils.compose_project_name
+
+    components = self_sup.container_runtime.components
+
+    def on_change(event: dict):
+        components.handle_event(event)
+        scheduler.wake(*docker_only_checks)
+
+    def on_resync():
+        # containers might have been recreated while we were not watching
+        components.invalidate()
+        scheduler.wake()
+
+    monitor = DockerEventMonitor(self_sup.container_runtime, project_name,
+                                 on_change=on_change,
+                                 on_resync=on_resync)
+    monitor.start()
+    return monitor
+
+
 def argument_parser():
     parser = ArgumentParser(description="NuvlaEdge System Manager")
     parser.add_argument('-l', '--log-level', dest='log_level',
@@ -111,69 +296,240 @@ def argument_parser():
     parser.add_argument('-d', '--debug', dest='log_level',
                         action='store_const', const='DEBUG',
                         help='Set log level to debug')
+    parser.add_argument('--schedule', dest='schedule', action='append', default=[],
+                        metavar='CHECK=INTERVAL[:JITTER[:PRIORITY]]',
+                        help=f'Schedule of a supervision check, in seconds. Can be repeated, or comma-separated. '
+                             f'Checks: {", ".join(default_schedule)}')
+    parser.add_argument('--workers', dest='workers', type=int, default=1,
+                        help='Number of supervision checks to run concurrently. 1 runs them one after the other')
+    parser.add_argument('--check-timeout', dest='check_timeout', type=float, default=60,
+                        help='Seconds after which a check running concurrently is not waited for anymore')
+    parser.add_argument('--status-api', dest='status_api', metavar='SOCKET_PATH|[HOST:]PORT',
+                        help='Serve the operational status as JSON on a UNIX socket (absolute path) or on a port')
+    parser.add_argument('--metrics-port', dest='metrics_port', metavar='[HOST:]PORT',
+                        help='Serve Prometheus metrics on this port, at /metrics. HOST defaults to 127.0.0.1')
+    parser.add_argument('--engine', dest='engine', choices=['threads', 'async'], default='threads',
+                        help='Supervision engine. "async" runs the checks on a single asyncio event loop (Docker only)')
+    parser.add_argument('--healer-mode', dest='healer_mode', choices=['sequential', 'waves'], default='sequential',
+                        help='How to heal several broken containers. "waves" heals them in parallel, in the order '
+                             'given by their Docker Compose dependencies, and restarts them right away')
+    parser.add_argument('--dg-reconcile', dest='dg_reconcile', choices=['per-cycle', 'converge'], default='per-cycle',
+                        help='How to bring up the Data Gateway. "converge" waits for each new resource (network, '
+                             'Data Gateway) to be ready and moves on to the next one, instead of waiting for the next '
+                             'cycle')
+    parser.add_argument('--dg-placement', dest='dg_placement', choices=['manager', 'node'], default='manager',
+                        help='Where to run the Data Gateway in Swarm mode. "node" runs one on every node, on a network '
+                             'of that node, so that each node\'s containers talk to their own Data Gateway')
     return parser
 
 
+def parse_schedule(specs: list) -> dict:
+    """
+    Overrides the default schedule of the supervision checks
+
+    :param specs: list of CHECK=INTERVAL[:JITTER[:PRIORITY]], possibly comma-separated
+    :return: schedule, as a dict of check name to (interval, jitter, priority)
+    """
+    schedule = dict(default_schedule)
+    for spec in specs:
+        for item in filter(None, spec.split(',')):
+            name, _, timing = item.strip().partition('=')
+            if name not in schedule:
+                raise ValueError(f'Unknown check "{name}" in schedule. Must be one of {", ".join(schedule)}')
+
+            values = timing.split(':')
+            defaults = schedule[name]
+            interval = float(values[0])
+            jitter = float(values[1]) if len(values) > 1 and values[1] else defaults[1]
+            priority = int(values[2]) if len(values) > 2 and values[2] else defaults[2]
+            if interval <= 0 or jitter < 0:
+                raise ValueError(f'Invalid schedule for check "{name}": {timing}')
+
+            schedule[name] = (interval, jitter, priority)
+
+    return schedule
+
+
 def configure_root_logger(log_level_name):
     logging.basicConfig(level=logging.getLevelName(log_level_name))
 
 
-def main():
+def run_async_engine(node_info: NodeInfoSnapshot, max_connections: int):
+    """
+    Runs the supervision checks forever, on an asyncio event loop
+
+    :param node_info: node info snapshot, refreshed at every round of checks
+    :param max_connections: maximum number of concurrent requests to the Docker socket
+    """
+    client = AsyncDockerClient(self_sup.docker_socket_file, max_connections=max_connections,
+                               accounting=accounting, limiter=mutation_limiter)
+    engine = AsyncSupervise(self_sup, scheduler, client,
+                            store_result=store_check_result,
+                            # pinging would block the event loop. The latency of the round's calls is enough
+                            report=lambda: end_of_round(probe=False),
+                            on_round=node_info.invalidate,
+                            wake_on_event=docker_only_checks,
+                            healer_mode=self_sup.healer_mode)
+    asyncio.run(engine.run())
+
+
+def main(schedule: dict = None, workers: int = 1, check_timeout: float = None, engine: str = 'threads',
+         status_api: str = None, metrics_port: str = None, rounds: int = None, healer_mode: str = 'sequential',
+         dg_reconcile: str = 'per-cycle', dg_placement: str = 'manager'):
+    """
+    Runs the supervision checks forever, or for a number of rounds
+
+    :param schedule: schedule of the checks, as returned by parse_schedule
+    :param workers: number of checks to run concurrently
+    :param check_timeout: seconds after which a check running concurrently is not waited for anymore
+    :param engine: "threads" or "async"
+    :param status_api: if set, address where to serve the operational status (see start_status_server)
+    :param metrics_port: if set, [HOST:]PORT where to serve the Prometheus metrics (see start_metrics_server)
+    :param rounds: if set, number of rounds of checks after which to return (threads engine only). Meant for
+    benchmarks and tests
+    :param healer_mode: "sequential" or "waves" (see Supervise.heal_in_waves)
+    :param dg_reconcile: "per-cycle" or "converge" (see Supervise.manage_docker_data_gateway)
+    :param dg_placement: "manager" or "node" (see Supervise.manage_node_data_gateway)
+    """
+    scheduler.workers = max(1, workers)
+    self_sup.healer_mode = healer_mode
+    self_sup.dg_reconcile = dg_reconcile
+    self_sup.dg_placement = dg_placement
     system_requirements = MinReq.SystemRequirements()
     software_requirements = MinReq.SoftwareRequirements()
+    node_info = NodeInfoSnapshot(self_sup.container_runtime)
+    is_docker = self_sup.container_runtime.orchestrator != 'kubernetes'
 
-    while True:
-        self_sup.operational_status = []
-        requirements_check(software_requirements, system_requirements, self_sup.operational_status)
-
+    checks = {
         # refresh this node's status, to capture any changes in the COE/Cluster configuration
-        self_sup.classify_this_node()
+        'classification': lambda: self_sup.classify_this_node(node_info),
+        'requirements': lambda: requirements_check(software_requirements, system_requirements,
+                                                   self_sup.operational_status, node_info),
+        'certificates': certificates_check,
+        # in k8s there are no switched from uncluster - cluster, so there's no need for connectivity check
+        'connectivity': self_sup.check_nuvlaedge_docker_connectivity,
+        # the Data Gateway comes out of the box for k8s installations
+        'data-gateway': self_sup.manage_docker_data_gateway,
+        # load of the Data Gateway broker, from its $SYS topics
+        'data-gateway-load': self_sup.check_data_gateway_load,
+        # in k8s everything runs as part of a Dep (restart policies are in place), so there's nothing to fix
+        'healer': docker_healer_check,
+    }
+
+    for name, (interval, jitter, priority) in (schedule or default_schedule).items():
+        if name in docker_only_checks and not is_docker:
+            continue
+
+        scheduler.add_job(name, lambda n=name: run_check(n, checks[n]), interval, jitter, priority,
+                          depends_on=check_dependencies.get(name, ()), timeout=check_timeout)
+
+    if is_docker:
+        backpressure.ping = self_sup.container_runtime.client.ping
+        # the async engine runs every docker-py check in a thread of its own
+        concurrent_checks = len(scheduler.jobs) if engine == 'async' else scheduler.workers
+        pool_size = docker_pool_size(concurrent_checks, self_sup.healer_workers)
+        self_sup.container_runtime.set_max_pool_size(pool_size)
+
+    if status_api:
+        start_status_server(status_board, status_api)
+
+    if metrics_port:
+        metrics.start_metrics_server(metrics_port)
+
+    if engine == 'async':
+        if is_docker:
+            return run_async_engine(node_info, pool_size)
+        log.warning('The async engine is only available with Docker. Falling back to the threads engine')
+
+    if is_docker:
+        start_docker_event_monitor()
+
+    while rounds is None or rounds > 0:
+        # fetch the node info at most once per round of checks, and share it with all of them
+        node_info.invalidate()
+
+        if scheduler.run_pending():
+            end_of_round()
+            if rounds is not None:
+                rounds -= 1
+                if not rounds:
+                    return
+
+        # sleep until the next check is due, unless woken up by a signal or a Docker event
+        scheduler.wait()
+
+
+if __name__ == '__main__':
+    signal.signal(signal.SIGUSR1, signal_usr1)
+    signal.signal(signal.SIGHUP, signal_hup)
 
-        # certificate rotation check
-        if self_sup.is_cert_rotation_needed():
-            log.info("Rotating NuvlaEdge certificates...")
-            self_sup.request_rotate_certificates()
+    ne_log_level = os.environ.get('NUVLAEDGE_LOG_LEVEL')
+    if ne_log_level:
+        sys.argv += ['-l', ne_log_level]
 
-        if self_sup.container_runtime.orchestrator != 'kubernetes':
-            # in k8s there are no switched from uncluster - cluster, so there's no need for connectivity check
-            self_sup.check_nuvlaedge_docker_connectivity()
+    ne_schedule = os.environ.get('NUVLAEDGE_SM_SCHEDULE')
+    if ne_schedule:
+        sys.argv += ['--schedule', ne_schedule]
 
-            # the Data Gateway comes out of the box for k8s installations
-            self_sup.manage_docker_data_gateway()
+    ne_workers = os.environ.get('NUVLAEDGE_SM_WORKERS')
+    if ne_workers:
+        sys.argv += ['--workers', ne_workers]
 
-            # in k8s everything runs as part of a Dep (restart policies are in place), so there's nothing to fix
-            self_sup.docker_container_healer()
+    ne_check_timeout = os.environ.get('NUVLAEDGE_SM_CHECK_TIMEOUT')
+    if ne_check_timeout:
+        sys.argv += ['--check-timeout', ne_check_timeout]
 
-        log.debug(f'Operational status checks: {self_sup.operational_status}')
+    ne_engine = os.environ.get('NUVLAEDGE_SM_ENGINE')
+    if ne_engine:
+        sys.argv += ['--engine', ne_engine]
 
-        statuses = [s[0] for s in self_sup.operational_status]
-        status_notes = [s[-1] for s in self_sup.operational_status]
+    ne_healer_mode = os.environ.get('NUVLAEDGE_SM_HEALER_MODE')
+    if ne_healer_mode:
+        sys.argv += ['--healer-mode', ne_healer_mode]
 
-        if utils.status_degraded in statuses:
-            utils.set_operational_status(utils.status_degraded, status_notes)
-        elif all([x == utils.status_operational for x in statuses]) or not self_sup.operational_status:
-            utils.set_operational_status(utils.status_operational, status_notes)
-        else:
-            utils.set_operational_status(utils.status_unknown, status_notes)
+    ne_dg_reconcile = os.environ.get('NUVLAEDGE_SM_DG_RECONCILE')
+    if ne_dg_reconcile:
+        sys.argv += ['--dg-reconcile', ne_dg_reconcile]
 
-        time.sleep(15)
+    ne_dg_placement = os.environ.get('NUVLAEDGE_SM_DG_PLACEMENT')
+    if ne_dg_placement:
+        sys.argv += ['--dg-placement', ne_dg_placement]
 
+    ne_status_api = os.environ.get('NUVLAEDGE_SM_STATUS_API')
+    if ne_status_api:
+        sys.argv += ['--status-api', ne_status_api]
 
-if __name__ == '__main__':
-    signal.signal(signal.SIGUSR1, signal_usr1)
-    
-    ne_log_level = os.environ.get('NUVLAEDGE_LOG_LEVEL')
-    if ne_log_level:
-        sys.argv += ['-l', ne_log_level]
+    ne_metrics_port = os.environ.get('NUVLAEDGE_SM_METRICS_PORT')
+    if ne_metrics_port:
+        sys.argv += ['--metrics-port', ne_metrics_port]
 
     agent_parser = argument_parser()
     log_level_name = 'INFO'
+    checks_schedule = default_schedule
+    checks_workers = 1
+    checks_timeout = 60
+    checks_engine = 'threads'
+    healer_mode = 'sequential'
+    dg_reconcile = 'per-cycle'
+    dg_placement = 'manager'
+    status_api_address = None
+    metrics_port = None
     try:
         args = agent_parser.parse_args()
         log_level_name = args.log_level
+        checks_schedule = parse_schedule(args.schedule)
+        checks_workers = args.workers
+        checks_timeout = args.check_timeout
+        checks_engine = args.engine
+        healer_mode = args.healer_mode
+        dg_reconcile = args.dg_reconcile
+        dg_placement = args.dg_placement
+        status_api_address = args.status_api
+        metrics_port = args.metrics_port
     except BaseException as e:
         log.error(f'Error while parsing argument: {e}')
     configure_root_logger(log_level_name)
 
-    main()
+    main(checks_schedule, checks_workers, checks_timeout, checks_engine, status_api_address, metrics_port,
+         healer_mode=healer_mode, dg_reconcile=dg_reconcile, dg_placement=dg_placement)
 
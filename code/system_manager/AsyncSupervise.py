@@ -0,0 +1,338 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+
+""" Asynchronous supervision engine
+
+Drives the supervision checks from a single asyncio event loop. The Docker events stream, the healing of the NuvlaEdge
+containers (including their delayed restarts) and the status writes are native tasks on the loop, talking to the
+Docker socket through AsyncDockerClient. The remaining checks still rely on docker-py, so they are run one at a time
+in a single worker thread
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import system_manager.common.Metrics as metrics
+from system_manager.common import utils
+from system_manager.common.AsyncDocker import AsyncDockerClient, AsyncDockerError, AsyncDockerNotFound
+from system_manager.common.EventMonitor import DockerEventFilter
+from system_manager.common.RateLimiter import mutation_limiter
+from system_manager.common.RestartScheduler import CrashLoopBreaker, restart_waves
+from system_manager.common.Scheduler import Job, Scheduler
+from system_manager.Supervise import Supervise, container_priority, crash_loop_note, exit_code_from_status, \
+    uptime_from_state
+
+
+class AsyncSupervise:
+    """ Runs the jobs of a Scheduler on an asyncio event loop, with a native implementation of the container healer """
+
+    restart_delay = 30
+
+    def __init__(self, supervise: Supervise, scheduler: Scheduler, client: AsyncDockerClient,
+                 store_result: Callable[[str, list], None],
+                 report: Callable[[], None],
+                 on_round: Callable[[], None] = None,
+                 wake_on_event: List[str] = (),
+                 reconnect_interval: float = 5,
+                 healer_mode: str = 'sequential'):
+        """ Constructs the engine
+
+        :param supervise: Supervise object, used by the checks that are not natively asynchronous
+        :param scheduler: scheduler holding the jobs, their intervals and dependencies
+        :param client: asynchronous Docker client
+        :param store_result: called with the check name and the operational status reported by a native check
+        :param report: writes the aggregated operational status
+        :param on_round: called every time a batch of due jobs is started
+        :param wake_on_event: jobs to wake up when a relevant Docker event is received
+        :param reconnect_interval: seconds to wait before reconnecting to the Docker events stream
+        :param healer_mode: "sequential" or "waves" (see Supervise.heal_in_waves)
+        """
+        self.log = logging.getLogger(__name__)
+        self.supervise = supervise
+        self.scheduler = scheduler
+        self.client = client
+        self.store_result = store_result
+        self.report = report
+        self.on_round = on_round
+        self.wake_on_event = list(wake_on_event)
+        self.reconnect_interval = reconnect_interval
+        self.healer_mode = healer_mode
+        self.native_checks = {'healer': self.heal}
+        self.project_name = utils.compose_project_name
+        self.restarting: Dict[str, asyncio.Task] = {}
+        self.restart_notes: Dict[str, tuple] = {}
+        self.crash_loops = CrashLoopBreaker()
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.events_received = 0
+        self.reconnections = 0
+        self._executor = None
+        self.loop = None
+        self._wakeup = None
+        self._report = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """ Threads running the checks that are not natively asynchronous, one per check: a job is never started again
+        while it runs, so a check stuck past its timeout does not hold up the others """
+        if self._executor is None:
+            workers = len([name for name in self.scheduler.jobs if name not in self.native_checks])
+            self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='docker-py')
+        return self._executor
+
+    async def resolve_project_name(self) -> str:
+        try:
+            return await self.loop.run_in_executor(self.executor, self.supervise.get_project_name)
+        except RuntimeError:
+            return utils.compose_project_name
+
+    async def heal(self) -> list:
+        """ Asynchronous version of Supervise.docker_container_healer: lists all the containers of the NuvlaEdge
+        with a single call and heals the broken ones concurrently
+
+        :return: operational status, as a list of (status, notes)
+        """
+        filters = {'label': [f'com.docker.compose.project={self.project_name}']}
+        summaries = await self.client.containers(filters=filters, all=True)
+
+        names = {summary_name(s) for s in summaries}
+        for name in (set(self.restarting) | set(self.restart_notes)) - names:
+            # the container is gone, together with its scheduled restart
+            self.cancel_restart(name)
+        self.crash_loops.retain(names)
+
+        for s in summaries:
+            state = s.get('State', '').lower()
+            if state == 'running':
+                self.crash_loops.record_running(summary_name(s))
+            if state in ['running', 'restarting', 'paused']:
+                # back up, e.g. thanks to its restart policy or an operator: nothing left to heal nor to report
+                self.cancel_restart(summary_name(s))
+
+        broken = [s for s in summaries if s.get('State', '').lower() in ['created', 'exited']]
+        if self.healer_mode == 'waves' and len(broken) > 1:
+            for wave in restart_waves(broken, lambda s: s.get('Labels'), summary_name, priority=['agent']):
+                await asyncio.gather(*[self.heal_container(s, immediately=True) for s in wave])
+        else:
+            await asyncio.gather(*[self.heal_container(s) for s in broken])
+
+        crash_loops = [crash_loop_note(name, self.crash_loops) for name in sorted(names)
+                       if self.crash_loops.is_open(name)]
+        return list(self.restart_notes.values()) + crash_loops
+
+    def cancel_restart(self, name: str) -> None:
+        """ Cancels the pending restart of a container, and drops the notes about its last restart """
+        restart = self.restarting.pop(name, None)
+        if restart is not None and not restart.done():
+            restart.cancel()
+        self.restart_notes.pop(name, None)
+
+    async def heal_container(self, summary: dict, immediately: bool = False) -> None:
+        """ Heals a container, given its summary
+
+        :param summary: container summary, in "created" or "exited" state
+        :param immediately: restart it now instead of after a delay, unless it crashed before
+        """
+        name = summary_name(summary)
+        container_id = summary.get('Id')
+
+        if summary.get('State', '').lower() == 'created':
+            try:
+                with mutation_limiter.priority(container_priority(name)):
+                    await self.client.start(container_id)
+            except AsyncDockerError as e:
+                self.log.error(f'Cannot resume container {name}. Reason: {str(e)}')
+            return
+
+        # exited: if the exit code is 0, then it exited gracefully...thus it is not broken
+        if exit_code_from_status(summary.get('Status', '')) == 0:
+            return
+
+        try:
+            attrs = await self.client.inspect_container(container_id)
+        except AsyncDockerNotFound:
+            self.log.debug(f'Container {name} no longer exists. Nothing to heal')
+            return
+
+        state = attrs.get('State', {})
+        exit_code = state.get('ExitCode', 0)
+        if exit_code <= 0 or state.get('Restarting', False):
+            return
+
+        if attrs.get('HostConfig', {}).get('RestartPolicy', {}).get('Name', 'no').lower() in ['no']:
+            return
+
+        restart = self.restarting.get(name)
+        if restart is not None and not restart.done():
+            return
+
+        # space out the restarts of a container that keeps crashing, and give up if it crashes too often
+        if self.crash_loops.record_crash(name, state.get('FinishedAt'), uptime_from_state(state)):
+            metrics.crash_loops.inc(container=name)
+        if self.crash_loops.is_open(name):
+            return
+
+        if immediately and self.crash_loops.failures(name) <= 1:
+            self.log.warning(f'Container {name} down (code {exit_code}). Restarting it now')
+            await self.restart_container(name, container_id)
+            return
+
+        delay = self.crash_loops.delay(name, self.restart_delay)
+        self.log.warning(f'Container {name} down (code {exit_code}). Scheduling restart in {delay:.0f} seconds')
+        metrics.restarts_scheduled.inc(container=name)
+        self.restarting[name] = self.loop.create_task(self.restart_container(name, container_id, delay))
+
+    async def restart_container(self, name: str, container_id: str, delay: float = 0) -> None:
+        """ Asynchronous version of Supervise.restart_container. The outcome is reported by the next healer run """
+        await asyncio.sleep(delay)
+        with mutation_limiter.priority(container_priority(name)):
+            try:
+                await self.client.restart(container_id)
+                self.log.info(f'Successfully restarted container {name}')
+                metrics.restarts_performed.inc(container=name, result='success')
+                self.restart_notes.pop(name, None)
+                return
+            except AsyncDockerError as e:
+                self.log.error(f'Failed to heal container {name}. Reason: {str(e)}')
+                metrics.restarts_performed.inc(container=name, result='failure')
+                self.restart_notes[name] = (utils.status_degraded, f'Container {name} is down')
+                network_issue = isinstance(e, AsyncDockerNotFound) or any(w in str(e) for w in ['network', 'not found'])
+
+            if network_issue:
+                self.log.warning(f'Trying to reset network config for {name}')
+                try:
+                    await self.client.disconnect_container_from_network(container_id, utils.nuvlaedge_shared_net)
+                except AsyncDockerError as e2:
+                    err_msg = f'Malfunctioning network for {name}: {str(e2)}'
+                    self.log.error(f'Cannot recover {name}. {err_msg}')
+                    self.restart_notes[name] = (utils.status_degraded, err_msg)
+
+    async def consume_events(self) -> None:
+        """ Consumes the Docker events stream forever, reconnecting (and asking for a full resync) when it breaks """
+        event_filter = DockerEventFilter(self.project_name)
+        components = self.supervise.container_runtime.components
+        resync = False
+        while True:
+            try:
+                if resync:
+                    self.reconnections += 1
+                    self.log.info('Reconnecting to the Docker events stream. Requesting full resync')
+                    components.invalidate()
+                    self.scheduler.wake()
+
+                async for event in self.client.events(event_filter.filters):
+                    if not event_filter.is_relevant(event):
+                        continue
+                    self.events_received += 1
+                    metrics.docker_events.inc(type=event.get('Type'), action=event.get('Action'))
+                    components.handle_event(event)
+                    self.scheduler.wake(*self.wake_on_event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log.warning(f'Lost connection to the Docker events stream: {str(e)}')
+
+            resync = True
+            await asyncio.sleep(self.reconnect_interval)
+
+    async def write_status(self) -> None:
+        """ Writes the operational status whenever a check finishes, coalescing the checks that finish together """
+        while True:
+            await self._report.wait()
+            self._report.clear()
+            try:
+                self.report()
+            except Exception as e:
+                self.log.error(f'Failed to write the operational status: {str(e)}')
+
+    async def run_job(self, job: Job, dependencies: List[asyncio.Task]) -> None:
+        """ Runs a job, once the jobs it depends on (and that started in the same batch) have finished
+
+        :param job: job, already flagged as started
+        :param dependencies: tasks to wait for
+        """
+        finish = True
+        try:
+            if dependencies:
+                await asyncio.wait(dependencies)
+
+            if job.name in self.native_checks:
+                self.store_result(job.name, await asyncio.wait_for(self.native_checks[job.name](), job.timeout))
+            else:
+                future = self.loop.run_in_executor(self.executor, job.func)
+                done, _ = await asyncio.wait([future], timeout=job.timeout)
+                if not done:
+                    job.timeouts += 1
+                    self.log.warning(f'Check {job.name} did not finish within {job.timeout} seconds. '
+                                     f'Not waiting for it')
+                    # the jobs depending on it go on. This one is finished, and can run again, once it returns
+                    finish = False
+                    future.add_done_callback(lambda f: self.finish_job(job, f))
+                    return
+                future.result()
+        except asyncio.TimeoutError:
+            job.timeouts += 1
+            self.log.warning(f'Check {job.name} did not finish within {job.timeout} seconds')
+        except Exception as e:
+            self.log.exception(f'Check {job.name} failed: {str(e)}')
+        finally:
+            if finish:
+                self.finish_job(job)
+
+    def finish_job(self, job: Job, future: asyncio.Future = None) -> None:
+        """ Accounts for a finished job, and writes the operational status
+
+        :param job: finished job
+        :param future: if set, future of a job that ran past its timeout, whose failure is still to be logged
+        """
+        if future is not None and not future.cancelled() and future.exception():
+            self.log.error(f'Check {job.name} failed: {str(future.exception())}')
+        self.scheduler.job_finished(job)
+        self._report.set()
+        self._wakeup.set()
+
+    def start_due_jobs(self) -> List[str]:
+        """ Starts a task for every job that is due, by priority
+
+        :return: names of the started jobs
+        """
+        due = self.scheduler.due_jobs()
+        if due and self.on_round:
+            self.on_round()
+
+        started = {}
+        for job in due:
+            self.scheduler.job_started(job)
+            dependencies = [started[d] for d in job.depends_on if d in started]
+            started[job.name] = self.tasks[job.name] = self.loop.create_task(self.run_job(job, dependencies))
+
+        return list(started)
+
+    async def run(self) -> None:
+        """ Runs the checks forever """
+        self.loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._report = asyncio.Event()
+        self.scheduler.add_wake_listener(lambda: self.loop.call_soon_threadsafe(self._wakeup.set))
+
+        self.project_name = await self.resolve_project_name()
+        background = [self.loop.create_task(self.consume_events()),
+                      self.loop.create_task(self.write_status())]
+        try:
+            while True:
+                self._wakeup.clear()
+                self.start_due_jobs()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.scheduler.time_until_next())
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in background + list(self.restarting.values()):
+                task.cancel()
+            self.executor.shutdown(wait=False)
+
+
+def summary_name(summary: dict) -> str:
+    names = summary.get('Names') or ['']
+    return names[0].lstrip('/')
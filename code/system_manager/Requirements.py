@@ -58,14 +58,15 @@ class SystemRequirements(Containers):
         else:
             return True
 
-    def check_ram_requirements(self) -> bool:
+    def check_ram_requirements(self, node_info=None) -> bool:
         """ Check the device for the RAM requirements according to the
          recommended ones
 
+         :param node_info: optional node info, as reported by the container runtime
          :returns True if there's enough RAM, False otherwise
          """
 
-        total_ram = round(self.container_runtime.get_ram_capacity(), 2)
+        total_ram = round(self.container_runtime.get_ram_capacity(node_info), 2)
 
         if total_ram < self.minimum_requirements["ram"]:
             msg = f'Your device only provides {total_ram} MBs of memory. ' \
@@ -94,13 +95,14 @@ class SystemRequirements(Containers):
         else:
             return True
 
-    def check_all_hw_requirements(self) -> bool:
+    def check_all_hw_requirements(self, node_info=None) -> bool:
         """ Runs all checks
 
+        :param node_info: optional node info, as reported by the container runtime
         :returns True if all checks pass, False otherwise
         """
         meets_cpu_req = self.check_cpu_requirements()
-        meets_ram_req = self.check_ram_requirements()
+        meets_ram_req = self.check_ram_requirements(node_info)
         meets_disk_req = self.check_disk_requirements()
 
         return meets_disk_req and meets_ram_req and meets_cpu_req
@@ -122,9 +124,12 @@ class SoftwareRequirements(Containers):
         self.not_met = []
         super().__init__(self.log)
 
-    def check_sw_requirements(self):
-        """ Checks all the SW requirements """
-        if not self.container_runtime.is_version_compatible():
+    def check_sw_requirements(self, node_info=None):
+        """ Checks all the SW requirements
+
+        :param node_info: optional node info, as reported by the container runtime
+        """
+        if not self.container_runtime.is_version_compatible(node_info):
             msg = f'The COE ({self.container_runtime.orchestrator}) version installed ' \
                   f'in your system ({self.container_runtime.get_version()}) is too old. ' \
                   f'Need version {self.container_runtime.minimum_version} or higher.'
@@ -135,10 +140,11 @@ class SoftwareRequirements(Containers):
 
         return True
 
-    def check_sw_optional_requirements(self):
+    def check_sw_optional_requirements(self, node_info=None):
         msgs = []
 
-        if self.container_runtime.orchestrator == 'docker' and not self.container_runtime.is_coe_enabled():
+        if self.container_runtime.orchestrator == 'docker' and \
+                not self.container_runtime.is_coe_enabled(node_info=node_info):
             msgs.append((utils.status_operational, 'Docker Swarm mode is not enabled.'))
 
         return msgs
@@ -6,15 +6,26 @@
 import json
 import logging
 import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from threading import Timer
-from typing import Union
+from threading import local
+from typing import Callable, Union
 
 import docker
-import OpenSSL
 
+import system_manager.common.Metrics as metrics
 from system_manager.common import utils
-from system_manager.common.ContainerRuntime import Containers
+from system_manager.common.BrokerLoad import BrokerLoadMonitor
+from system_manager.common.Backpressure import backpressure
+from system_manager.common.CertificateInventory import CertificateInventory
+from system_manager.common.ComponentRegistry import ComponentRegistry
+from system_manager.common.ContainerRuntime import Containers, NodeInfoSnapshot
+from system_manager.common.DataGatewayProbe import DataGatewayProbe, PROBE_FAILED, PROBE_OK, PROBE_UNREACHABLE
+from system_manager.common.RateLimiter import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, mutation_limiter, \
+    prioritized
+from system_manager.common.RestartScheduler import CrashLoopBreaker, DelayedRestartScheduler, restart_waves
 
 
 class ClusterNodeCannotManageDG(Exception):
@@ -25,6 +36,102 @@ class BreakDGManagementCycle(Exception):
     pass
 
 
+def exit_code_from_status(status: str) -> Union[int, None]:
+    """
+    Parses the exit code from the Status of a container summary (e.g. "Exited (137) 5 minutes ago")
+
+    :param status: human readable status of the container
+    :return: exit code, or None if it cannot be inferred
+    """
+    match = re.search(r'Exited \((-?\d+)\)', status or '')
+    return int(match.group(1)) if match else None
+
+
+def get_exit_code_from_summary(container) -> Union[int, None]:
+    """
+    Parses the exit code of a container built from a container summary
+
+    :param container: Docker Container object, built from a container summary
+    :return: exit code, or None if it cannot be inferred
+    """
+    return exit_code_from_status(container.attrs.get('Status', ''))
+
+
+def uptime_from_state(state: dict) -> Union[float, None]:
+    """
+    Seconds a container ran before it exited, from its State (as returned by an inspection)
+
+    :param state: State of the container
+    :return: seconds between StartedAt and FinishedAt, or None if they cannot be parsed
+    """
+    try:
+        # e.g. 2023-04-26T09:28:31.546345784Z. Sub-second precision is not needed
+        started, finished = [datetime.strptime(state[k][:19], '%Y-%m-%dT%H:%M:%S') for k in ['StartedAt', 'FinishedAt']]
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    return (finished - started).total_seconds()
+
+
+def crash_loop_note(name: str, breaker: CrashLoopBreaker) -> tuple:
+    return (utils.status_degraded,
+            f'Container {name} is crash looping ({breaker.failures(name)} crashes in the last '
+            f'{breaker.window:.0f} seconds). Not restarting it anymore')
+
+
+def wait_until(condition: Callable[[], object], timeout: float, interval: float = 0.25, max_interval: float = 2):
+    """
+    Polls a condition until it holds or until the deadline, doubling the interval between polls
+
+    :param condition: function without arguments
+    :param timeout: seconds after which to give up
+    :param interval: seconds before the first poll after the initial one
+    :param max_interval: maximum seconds between polls
+    :return: the last value returned by the condition
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        value = condition()
+        remaining = deadline - time.monotonic()
+        if value or remaining <= 0:
+            return value
+
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
+
+
+def data_gateway_command(max_wait: float = 10, poll_interval: float = 0.25) -> str:
+    """
+    Command of the DG. Starts mosquitto as soon as the container has a network interface and a configuration, instead
+    of after a fixed delay
+
+    :param max_wait: seconds after which mosquitto is started anyway
+    :param poll_interval: seconds between two checks
+    :return: shell command
+    """
+    polls = max(1, int(max_wait / poll_interval))
+    return "sh -c '" \
+           f"for i in $(seq {polls}); do " \
+           "ls /sys/class/net | grep -qvx lo && " \
+           "{ [ -f /mosquitto-no-auth.conf ] || [ -f /mosquitto/config/mosquitto.conf ]; } && break; " \
+           f"sleep {poll_interval}; done; " \
+           "cp /mosquitto-no-auth.conf /mosquitto/config/mosquitto.conf 2>/dev/null; " \
+           "exec /usr/sbin/mosquitto -c /mosquitto/config/mosquitto.conf'"
+
+
+def container_priority(name: str) -> int:
+    """
+    Priority class of the mutating calls on a container: the agent and the data gateway go first
+
+    :param name: container name
+    :return: PRIORITY_HIGH or PRIORITY_NORMAL
+    """
+    name = str(name)
+    if name == utils.data_gateway_name or name.startswith(f'{utils.compose_project_name}-agent'):
+        return PRIORITY_HIGH
+    return PRIORITY_NORMAL
+
+
 def cluster_workers_cannot_manage(func):
     def wrapper(self, *args):
         if self.is_cluster_enabled and not self.i_am_manager:
@@ -40,6 +147,17 @@ class Supervise(Containers):
     graceful shutdowns
     """
 
+    # seconds to wait before restarting a container that exited unexpectedly
+    restart_delay = 30
+    # containers healed in parallel, within a wave, when the healer runs in "waves" mode
+    healer_workers = 4
+    # seconds to wait for a Data Gateway resource to be ready, once created, when reconciling in "converge" mode
+    dg_ready_timeout = 30
+    # seconds to wait for the DG to answer an MQTT connection, and then to route the probe message back
+    dg_probe_timeout = 2
+    # consecutive failed probes after which the DG is restarted
+    dg_max_probe_failures = 3
+
     def __init__(self):
         """ Constructs the Supervise object """
 
@@ -53,20 +171,55 @@ class Supervise(Containers):
                                             os.getenv('NUVLABOX_DATA_GATEWAY_IMAGE',
                                                       'eclipse-mosquitto:2.0.15-openssl'))
         self.data_gateway_object = None
-        self.data_gateway_name = os.getenv('NUVLAEDGE_DATA_GATEWAY_NAME',
-                                           os.getenv('NUVLABOX_DATA_GATEWAY_NAME',
-                                                     'data-gateway'))
+        self.data_gateway_name = utils.data_gateway_name
         self.i_am_manager = self.is_cluster_enabled = self.node = None
+        self._local = local()
         self.operational_status = []
         self.agent_dg_failed_connection = 0
         self.lost_quorum_hint = 'possible that too few managers are online'
         self.nuvlaedge_containers = []
-        self.nuvlaedge_containers_restarting = {}
+        self.restart_scheduler = DelayedRestartScheduler(self.run_scheduled_restart,
+                                                         on_change=metrics.restarts_pending.set)
+        self.crash_loops = CrashLoopBreaker()
+        # "sequential" heals the broken containers one by one. "waves" heals them in parallel, by dependency order
+        self.healer_mode = 'sequential'
+        # "per-cycle" creates one Data Gateway resource per cycle. "converge" waits for it and moves on to the next one
+        self.dg_reconcile = 'per-cycle'
+        # in Swarm mode, "manager" runs one Data Gateway service on a manager node. "node" runs a Data Gateway container
+        # on every node, only reachable by the containers of that node
+        self.dg_placement = 'manager'
+        # whether the Data Gateway left behind by the other placement was looked for (once per run)
+        self.dg_placement_cleaned = False
+        # when the first Data Gateway resource was created, until the Data Gateway is ready
+        self.dg_bringup_started = None
+        self.data_gateway_ready = os.path.exists(utils.data_gateway_ready_flag)
+        self.dg_probe = DataGatewayProbe(self.data_gateway_name, utils.data_gateway_port, self.dg_probe_timeout)
+        self.dg_load = BrokerLoadMonitor(self.data_gateway_name, utils.data_gateway_port, self.dg_probe_timeout)
+        self.cert_inventory = CertificateInventory()
+
+    @property
+    def operational_status(self) -> list:
+        """ Operational status (list of (status, notes) tuples) reported by the check running in the current thread,
+        so that checks running concurrently do not mix up their reports
+        """
+        if not hasattr(self._local, 'operational_status'):
+            self._local.operational_status = []
+        return self._local.operational_status
+
+    @operational_status.setter
+    def operational_status(self, value: list):
+        self._local.operational_status = value
+
+    def classify_this_node(self, node_info: NodeInfoSnapshot = None):
+        """ Finds whether this node is part of a cluster, and if so, whether it is a manager
+
+        :param node_info: node info snapshot of the current cycle. If not provided, node info is fetched directly
+        """
+        info = node_info.get() if node_info else None
 
-    def classify_this_node(self):
         # is it running in cluster mode?
-        node_id = self.container_runtime.get_node_id()
-        is_cluster_enabled = self.container_runtime.is_coe_enabled(check_local_node_state=True)
+        node_id = self.container_runtime.get_node_id(info)
+        is_cluster_enabled = self.container_runtime.is_coe_enabled(check_local_node_state=True, node_info=info)
 
         if not node_id or not is_cluster_enabled:
             self.i_am_manager = self.is_cluster_enabled = False
@@ -75,44 +228,28 @@ class Supervise(Containers):
         # if it got here, there cluster is active
         self.is_cluster_enabled = True
 
-        managers = self.container_runtime.get_cluster_managers()
+        managers = self.container_runtime.get_cluster_managers(info)
         self.i_am_manager = True if node_id in managers else False
 
-        if self.i_am_manager:
+        if self.i_am_manager and not backpressure.skips('node-label'):
             _update_label_success, err = self.container_runtime.set_nuvlaedge_node_label(node_id)
             if err:
                 self.operational_status.append((utils.status_degraded, err))
 
     def is_cert_rotation_needed(self):
-        """ Checks whether the API certs are about to expire """
+        """ Checks whether the API certs are about to expire. Refreshes the certificate inventory either way """
 
-        # certificates to be checked for expiration dates:
-        check_expiry_date_on = ["ca.pem", "server-cert.pem", "cert.pem"]
+        expiring = self.cert_inventory.expiring()
 
         # if the TLS sync file does not exist, then the compute-api is going to generate the certs by itself, by default
         if not os.path.isfile(utils.tls_sync_file):
             return False
 
-        for file in check_expiry_date_on:
-            file_path = f"{utils.data_volume}/{file}"
-
-            if os.path.isfile(file_path):
-                with open(file_path) as fp:
-                    content = fp.read()
-
-                cert_obj = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, content.encode())
-
-                end_date = cert_obj.get_notAfter().decode()
-                formatted_end_date = datetime(int(end_date[0:4]),
-                                              int(end_date[4:6]),
-                                              int(end_date[6:8]))
-
-                days_left = formatted_end_date - datetime.now()
-                # if expiring in less than d days, rotate all
-                d = 5
-                if days_left.days < d:
-                    self.log.warning(f"{file_path} is expiring in less than {d} days. Requesting rotation of all certs")
-                    return True
+        # if expiring in less than 5 days, rotate all
+        if expiring:
+            self.log.warning(f"{utils.data_volume}/{expiring[0]} is expiring in less than "
+                             f"{self.cert_inventory.rotation_threshold_days} days. Requesting rotation of all certs")
+            return True
 
         return False
 
@@ -131,6 +268,7 @@ class Supervise(Containers):
             self.container_runtime.restart_credentials_manager()
 
     @cluster_workers_cannot_manage
+    @prioritized(PRIORITY_HIGH)
     def launch_data_gateway(self, name: str) -> bool:
         """
         Starts the DG services/containers, depending on the mode
@@ -147,10 +285,9 @@ class Supervise(Containers):
             "nuvlaedge.deployment": "production",
             "nuvlaedge.data-gateway": "True"
         }
+        self.set_data_gateway_ready(False)
         try:
-            cmd = "sh -c 'sleep 10; " \
-                  "cp /mosquitto-no-auth.conf /mosquitto/config/mosquitto.conf 2>/dev/null; " \
-                  "exec /usr/sbin/mosquitto -c /mosquitto/config/mosquitto.conf'"
+            cmd = data_gateway_command()
             if self.is_cluster_enabled and self.i_am_manager:
                 self.container_runtime.client.services.create(self.data_gateway_image,
                                                               name=name,
@@ -177,6 +314,7 @@ class Supervise(Containers):
                                                              network=utils.nuvlaedge_shared_net,
                                                              command=cmd
                                                              )
+            return True
         except docker.errors.APIError as e:
             try:
                 if '409' in str(e):
@@ -247,40 +385,51 @@ class Supervise(Containers):
         if not data_gateway_networks:
             # network doesn't exist, so let's create it as well
             try:
-                self.setup_docker_network(utils.nuvlaedge_shared_net)
-                raise BreakDGManagementCycle
+                created = self.setup_docker_network(utils.nuvlaedge_shared_net)
             except ClusterNodeCannotManageDG:
                 # this node can't setup networks
                 # However, the network might already exist, we simply don't see it. Try to connect agent to it anyway
                 return None
-        else:
-            # make sure the network driver makes sense, to avoid having a bridge network on a Swarm node
-            dg_network = data_gateway_networks[0]
-            if self.is_cluster_enabled:
+
+            if created:
+                self.start_data_gateway_bringup()
+            if not created or self.dg_reconcile != 'converge':
+                raise BreakDGManagementCycle
+
+            data_gateway_networks = wait_until(lambda: self.find_docker_network([utils.nuvlaedge_shared_net]),
+                                               self.dg_ready_timeout)
+            if not data_gateway_networks:
+                self.log.warning(f'Data Gateway network {utils.nuvlaedge_shared_net} not ready after '
+                                 f'{self.dg_ready_timeout} seconds')
+                raise BreakDGManagementCycle
+
+        # make sure the network driver makes sense, to avoid having a bridge network on a Swarm node
+        dg_network = data_gateway_networks[0]
+        if self.is_cluster_enabled:
+            # if swarm is enabled, a container-based data-gateway doesn't make sense
+            bridge_nets = list(filter(lambda o: o.attrs.get('Driver', '') == 'bridge', data_gateway_networks))
+            for leftover_bridge_net in bridge_nets:
+                leftover_bridge_net.reload()
+                self.destroy_docker_network(leftover_bridge_net)
                 # if swarm is enabled, a container-based data-gateway doesn't make sense
-                bridge_nets = list(filter(lambda o: o.attrs.get('Driver', '') == 'bridge', data_gateway_networks))
-                for leftover_bridge_net in bridge_nets:
-                    leftover_bridge_net.reload()
-                    self.destroy_docker_network(leftover_bridge_net)
-                    # if swarm is enabled, a container-based data-gateway doesn't make sense
+                try:
+                    self.container_runtime.client.containers.get(self.data_gateway_name)
+                except docker.errors.NotFound:
+                    pass
+                else:
                     try:
-                        self.container_runtime.client.containers.get(self.data_gateway_name)
-                    except docker.errors.NotFound:
-                        pass
-                    else:
-                        try:
-                            self.container_runtime.client.api.remove_container(self.data_gateway_name, force=True)
-                        except Exception as e:
-                            self.log.error(f'Could not remove old {self.data_gateway_name} container: {str(e)}')
+                        self.container_runtime.client.api.remove_container(self.data_gateway_name, force=True)
+                    except Exception as e:
+                        self.log.error(f'Could not remove old {self.data_gateway_name} container: {str(e)}')
 
-                running_nets = list(set(data_gateway_networks) - set(bridge_nets))
-                # is there an overlay network as well? if not, reset cycle cause network needs to be recreated
-                if not running_nets:
-                    return None
+            running_nets = list(set(data_gateway_networks) - set(bridge_nets))
+            # is there an overlay network as well? if not, reset cycle cause network needs to be recreated
+            if not running_nets:
+                return None
 
-                dg_network = running_nets[0]
+            dg_network = running_nets[0]
 
-            return dg_network
+        return dg_network
 
     def manage_docker_data_gateway_object(self, data_gateway_network: docker.models.networks.Network) -> None:
         """
@@ -310,28 +459,38 @@ class Supervise(Containers):
                     if not launched_dg:
                         self.operational_status.append((utils.status_degraded, 'Unable to launch Data Gateway'))
 
+                if launched_dg:
+                    self.start_data_gateway_bringup()
+                if launched_dg and self.dg_reconcile == 'converge':
+                    if wait_until(self.data_gateway_is_running, self.dg_ready_timeout):
+                        return
+                    self.log.warning(f'Data Gateway not running after {self.dg_ready_timeout} seconds')
+
                 # NOTE: resume on the next cycle
                 raise BreakDGManagementCycle
             else:
                 # double check DG still has the right network
                 self.check_dg_network(data_gateway_network)
 
-    def manage_docker_data_gateway_connect_to_network(self, containers_to_connect: list,
-                                                      agent_container_id: str) -> None:
+    def manage_docker_data_gateway_connect_to_network(self, containers_to_connect: list, agent_container_id: str,
+                                                      network: str = utils.nuvlaedge_shared_net) -> None:
         """
         Connect this node's Agent container (+data source containers) to DG
 
         :param containers_to_connect: all containers to be connected to the DG network
         :param agent_container_id: ID of the agent container that is also to be connected
+        :param network: name of the DG network
         :return:
         """
         for ccont in containers_to_connect:
-            if utils.nuvlaedge_shared_net not in \
+            if network not in \
                     ccont.attrs.get('NetworkSettings', {}).get('Networks', {}).keys():
                 self.log.info(f'Connecting ({ccont.name}) '
-                              f'to network {utils.nuvlaedge_shared_net}')
+                              f'to network {network}')
                 try:
-                    self.container_runtime.client.api.connect_container_to_network(ccont.id, utils.nuvlaedge_shared_net)
+                    with mutation_limiter.priority(PRIORITY_HIGH if ccont.id == agent_container_id
+                                                   else PRIORITY_NORMAL):
+                        self.container_runtime.client.api.connect_container_to_network(ccont.id, network)
                 except Exception as e:
                     # doe Network exist? If so, and agent was not connected, need to break and retry
                     if "notfound" not in str(e).replace(' ', '').lower():
@@ -352,7 +511,8 @@ class Supervise(Containers):
         """ Sets the DG service.
 
         If we need to start or restart the DG or any of its components, we always "return" and resume the DG setup
-        on the next cycle
+        on the next cycle. Unless reconciling in "converge" mode: then, every new component is waited for (up to
+        dg_ready_timeout seconds) and the setup moves straight on to the next step
 
         :return:
         """
@@ -368,14 +528,18 @@ class Supervise(Containers):
             return
 
         # ## 2: DG network exists, but does the DG?
+        self.remove_other_data_gateway_placement()
         try:
-            self.manage_docker_data_gateway_object(dg_network)
+            if self.uses_node_data_gateway():
+                self.manage_node_data_gateway()
+            else:
+                self.manage_docker_data_gateway_object(dg_network)
         except BreakDGManagementCycle:
             return
 
         # ## 3: finally, connect this node's Agent container (+data source containers) to DG
         agent_container = self.find_nuvlaedge_agent()
-        data_source_containers = self.container_runtime.client.containers.list(filters={
+        data_source_containers = self.container_runtime.list_containers(filters={
             'label': 'nuvlaedge.data-source-container'
         })
 
@@ -386,25 +550,275 @@ class Supervise(Containers):
             return
 
         connecting_containers = [agent_container] + data_source_containers
+        try:
+            # to probe the DG
+            connecting_containers.append(self.container_runtime.get_current_container())
+        except RuntimeError as e:
+            self.log.warning(f'Cannot connect the system manager to the Data Gateway network: {str(e)}')
+
         try:
             self.manage_docker_data_gateway_connect_to_network(connecting_containers, agent_container_id)
+            if self.uses_node_data_gateway():
+                self.manage_docker_data_gateway_connect_to_network(connecting_containers, agent_container_id,
+                                                                   utils.data_gateway_node_net)
         except BreakDGManagementCycle:
             return
 
-        # TODO: unreachable code, try to find another way to detect agent<->dg connection issues (if needed)
-        if self.agent_dg_failed_connection > 3:
-            # do something after 3 reports
+        # ## 4: does the DG accept MQTT connections, and route messages?
+        self.check_data_gateway_readiness()
+
+        if self.agent_dg_failed_connection >= self.dg_max_probe_failures:
+            self.log.warning(f'Data Gateway failed {self.agent_dg_failed_connection} probes in a row '
+                             f'({self.dg_probe.last_error}). Latency: {self.dg_probe.summary()}')
             self.restart_data_gateway()
             self.agent_dg_failed_connection = 0
 
+    def data_gateway_is_running(self) -> bool:
+        """
+        Whether the DG exists and runs. For a Swarm service, whether one of its tasks runs. With the "node" placement,
+        whether the DG container of this node runs
+
+        :return: bool
+        """
+        found = self.find_node_data_gateway() if self.uses_node_data_gateway() \
+            else self.find_data_gateway(self.data_gateway_name)
+        if not found or not self.data_gateway_object:
+            return False
+
+        if self.is_cluster_enabled and not self.uses_node_data_gateway():
+            tasks = self.data_gateway_object.tasks(filters={'desired-state': 'running'})
+            return any(t.get('Status', {}).get('State') == 'running' for t in tasks)
+
+        return self.data_gateway_object.status == 'running'
+
+    def probe_data_gateway(self) -> bool:
+        """
+        Whether the DG accepts MQTT connections and routes a message back to its subscriber
+
+        :return: bool
+        """
+        return self.dg_probe.run() == PROBE_OK
+
+    def set_data_gateway_ready(self, ready: bool) -> None:
+        """
+        Creates or deletes the flag telling other components that the DG is ready, when it changes
+
+        :param ready: whether the DG accepts MQTT connections
+        """
+        if ready == self.data_gateway_ready:
+            return
+
+        try:
+            if ready:
+                utils.atomic_write(utils.data_gateway_ready_flag, datetime.utcnow().isoformat().split('.')[0] + 'Z')
+                self.log.info('Data Gateway is ready')
+            else:
+                os.remove(utils.data_gateway_ready_flag)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.log.error(f'Cannot update {utils.data_gateway_ready_flag}: {str(e)}')
+            return
+
+        self.data_gateway_ready = ready
+
+    def check_data_gateway_readiness(self) -> None:
+        """ Probes the DG over MQTT, and flags it as ready once it answers. When reconciling in "converge" mode, a DG
+        that was just launched or restarted is waited for, up to dg_ready_timeout seconds since it was, unless it
+        cannot even be resolved
+
+        Failed probes are counted in agent_dg_failed_connection, unless the DG cannot even be resolved (i.e. the system
+        manager is not on its network)
+        """
+        bringup_left = 0
+        if self.dg_bringup_started is not None:
+            bringup_left = self.dg_ready_timeout - (time.monotonic() - self.dg_bringup_started)
+
+        if self.dg_reconcile == 'converge' and not self.data_gateway_ready and bringup_left > 0:
+            ready = wait_until(lambda: self.probe_data_gateway() or self.dg_probe.last_result == PROBE_UNREACHABLE,
+                               bringup_left)
+            ready = ready and self.dg_probe.last_result != PROBE_UNREACHABLE
+        else:
+            ready = self.probe_data_gateway()
+
+        if ready:
+            self.agent_dg_failed_connection = 0
+        elif self.dg_probe.last_result == PROBE_FAILED:
+            self.agent_dg_failed_connection += 1
+
+        if not ready and self.data_gateway_ready:
+            self.log.warning(f'Data Gateway probe on port {utils.data_gateway_port} failed: {self.dg_probe.last_error}')
+        self.set_data_gateway_ready(ready)
+        if ready:
+            self.end_data_gateway_bringup()
+            self.log.debug(f'Data Gateway probe latency: {self.dg_probe.summary()}')
+
+    def uses_node_data_gateway(self) -> bool:
+        """ Whether this node runs its own DG container, i.e. the "node" placement in Swarm mode """
+        return self.is_cluster_enabled and self.dg_placement == 'node'
+
+    def manage_node_data_gateway(self) -> None:
+        """
+        Makes sure this node runs its own DG container, on a bridge network of its own. Only the containers of this
+        node are connected to that network, so that they talk to their own DG, by its name, without crossing the
+        overlay network nor publishing the DG port on the node
+
+        :raises BreakDGManagementCycle: if the DG network or the DG had to be created, and is not ready yet
+        """
+        if not self.find_docker_network([utils.data_gateway_node_net]):
+            if not self.setup_node_data_gateway_network():
+                self.operational_status.append((utils.status_degraded, 'Unable to create the Data Gateway network'))
+                raise BreakDGManagementCycle
+            self.start_data_gateway_bringup()
+
+        if self.find_node_data_gateway():
+            return
+
+        self.log.info('Data Gateway not found on this node. Launching it')
+        if not self.launch_node_data_gateway():
+            self.operational_status.append((utils.status_degraded, 'Unable to launch Data Gateway'))
+            raise BreakDGManagementCycle
+
+        self.start_data_gateway_bringup()
+        if self.dg_reconcile == 'converge':
+            if wait_until(self.data_gateway_is_running, self.dg_ready_timeout):
+                return
+            self.log.warning(f'Data Gateway not running after {self.dg_ready_timeout} seconds')
+
+        # NOTE: resume on the next cycle
+        raise BreakDGManagementCycle
+
+    def find_node_data_gateway(self) -> bool:
+        """ Looks up the DG container of this node, and sets self.data_gateway_object """
+        try:
+            self.data_gateway_object = self.container_runtime.client.containers.get(self.data_gateway_name)
+            return True
+        except docker.errors.NotFound:
+            self.data_gateway_object = None
+            return False
+
+    @prioritized(PRIORITY_HIGH)
+    def setup_node_data_gateway_network(self) -> bool:
+        """ Creates the bridge network of the DG of this node
+
+        :return: bool
+        """
+        self.log.info(f'Creating Data Gateway network {utils.data_gateway_node_net}')
+        try:
+            self.container_runtime.client.networks.create(utils.data_gateway_node_net,
+                                                          driver='bridge',
+                                                          labels={
+                                                              "nuvlaedge.network": "True",
+                                                              "nuvlaedge.data-gateway": "True"
+                                                          })
+        except docker.errors.APIError as e:
+            if '409' not in str(e):
+                self.log.error(f'Unable to create network {utils.data_gateway_node_net}: {str(e)}')
+                return False
+        return True
+
+    @prioritized(PRIORITY_HIGH)
+    def launch_node_data_gateway(self) -> bool:
+        """ Starts the DG container of this node, on its own network
+
+        :return: bool
+        """
+        labels = {
+            "nuvlaedge.component": "True",
+            "nuvlaedge.deployment": "production",
+            "nuvlaedge.data-gateway": "True",
+            "nuvlaedge.data-gateway-placement": "node"
+        }
+        self.set_data_gateway_ready(False)
+        try:
+            self.data_gateway_object = self.container_runtime.client.containers.run(self.data_gateway_image,
+                                                                                    name=self.data_gateway_name,
+                                                                                    hostname=self.data_gateway_name,
+                                                                                    init=True,
+                                                                                    detach=True,
+                                                                                    labels=labels,
+                                                                                    restart_policy={"Name": "always"},
+                                                                                    network=utils.data_gateway_node_net,
+                                                                                    command=data_gateway_command())
+            return True
+        except docker.errors.APIError as e:
+            self.log.error(f'Unable to launch Data Gateway {self.data_gateway_name} on this node: {str(e)}')
+            return False
+
+    @prioritized(PRIORITY_LOW)
+    def remove_other_data_gateway_placement(self) -> None:
+        """
+        In Swarm mode, removes the DG left behind by the other placement, if any, so that the DG name resolves to a
+        single DG. With the "node" placement, managers remove the DG service. With the "manager" placement, every node
+        removes its own DG container. Only done once per run, since the placement does not change while running
+        """
+        if self.dg_placement_cleaned or not self.is_cluster_enabled:
+            return
+
+        try:
+            if self.dg_placement == 'node' and self.i_am_manager:
+                for service in self.container_runtime.client.services.list(filters={'name': self.data_gateway_name}):
+                    if service.name == self.data_gateway_name:
+                        self.log.warning('Removing the Data Gateway service, replaced by one Data Gateway per node')
+                        service.remove()
+            elif self.dg_placement == 'manager':
+                for container in self.container_runtime.client.containers.list(
+                        all=True, filters={'label': 'nuvlaedge.data-gateway-placement=node'}):
+                    self.log.warning('Removing the Data Gateway of this node, replaced by the Data Gateway service')
+                    container.remove(force=True)
+        except docker.errors.APIError as e:
+            self.log.error(f'Cannot remove the Data Gateway of the previous placement: {str(e)}')
+            return
+
+        self.dg_placement_cleaned = True
+
+    def check_data_gateway_load(self) -> None:
+        """ Reads the load of the DG from the $SYS topics of its broker, and reports it in the operational status notes.
+        The status is degraded while any of the saturation thresholds is exceeded
+        """
+        if not self.data_gateway_enabled or not self.data_gateway_ready:
+            return
+
+        stats = self.dg_load.poll()
+        if not stats:
+            return
+
+        saturated = self.dg_load.saturated(stats)
+        if saturated:
+            self.log.warning(f'Data Gateway is saturated: {", ".join(saturated)}')
+        self.operational_status += self.dg_load.status_notes(stats)
+
+    def start_data_gateway_bringup(self) -> None:
+        """ Starts timing the DG bring-up, unless already started """
+        if self.dg_bringup_started is None:
+            self.dg_bringup_started = time.monotonic()
+
+    def end_data_gateway_bringup(self) -> None:
+        """ Reports how long it took from creating the first DG resource until the DG was ready """
+        if self.dg_bringup_started is None:
+            return
+
+        elapsed = time.monotonic() - self.dg_bringup_started
+        self.dg_bringup_started = None
+        self.log.info(f'Data Gateway ready in {elapsed:.1f} seconds')
+        metrics.data_gateway_ready.observe(elapsed, mode=self.dg_reconcile)
+
+    @prioritized(PRIORITY_HIGH)
     def restart_data_gateway(self):
         """
         Simply restarts the DG object
 
         :return:
         """
+        if not self.data_gateway_object:
+            self.log.warning('Data Gateway object does not exist. Cannot restart it')
+            return
+
         self.log.warning('Agent seems unable to reach the Data Gateway. Restarting the Data Gateway')
-        if self.is_cluster_enabled and self.i_am_manager:
+        self.set_data_gateway_ready(False)
+        self.start_data_gateway_bringup()
+        if self.is_cluster_enabled and self.i_am_manager and not self.uses_node_data_gateway():
+            # with the "node" placement, only the DG container of this node is restarted, not the ones of other nodes
             self.data_gateway_object.force_update()
         else:
             self.data_gateway_object.restart()
@@ -417,7 +831,13 @@ class Supervise(Containers):
                 self.data_gateway_object = self.container_runtime.client.services.get(name)
             elif not self.is_cluster_enabled and not self.i_am_manager:
                 # in single Docker machine
-                self.data_gateway_object = self.container_runtime.client.containers.get(name)
+                if name == self.data_gateway_name:
+                    self.data_gateway_object = self.container_runtime.components.get_container(
+                        ComponentRegistry.DATA_GATEWAY)
+                    if not self.data_gateway_object:
+                        raise docker.errors.NotFound(f'Container {name} not found')
+                else:
+                    self.data_gateway_object = self.container_runtime.client.containers.get(name)
 
             return True
         except (docker.errors.NotFound, docker.errors.APIError) as e:
@@ -435,6 +855,7 @@ class Supervise(Containers):
 
         return self.container_runtime.client.networks.list(names=network_names)
 
+    @prioritized(PRIORITY_LOW)
     def destroy_docker_network(self, network: docker.DockerClient.networks):
         """
         Deletes a network locally by disconnecting it from any container in use, and removing it
@@ -548,28 +969,23 @@ class Supervise(Containers):
         return True
 
     def get_project_name(self) -> str:
-        """"""
+        """ Gets the Docker Compose project name of this NuvlaEdge, as resolved once by the component registry
+
+        :return: project name
+        """
         try:
-            container_id = self.container_runtime.get_current_container_id()
-            myself = self.container_runtime.client.containers.get(container_id)
-        except docker.errors.NotFound:
+            project_name = self.container_runtime.components.project_name
+        except (RuntimeError, docker.errors.NotFound):
             err = f'Cannot find the current container. Cannot proceed'
             self.log.error(err)
             self.operational_status.append((utils.status_degraded, 'System Manager container lookup error'))
             raise RuntimeError(err)
 
-        try:
-            project_name = myself.labels['com.docker.compose.project']
-        except KeyError:
-            self.log.warning(f'Cannot infer Docker Compose project name from the labels in {myself.name}.'
-                             f'Trying to infer from container name')
-            try:
-                project_name = myself.name.split('-')[-3]
-            except (IndexError, AttributeError):
-                msg = 'Impossible to infer Docker Compose project name!'
-                self.log.error(msg)
-                self.operational_status.append((utils.status_degraded, msg))
-                raise RuntimeError(msg)
+        if not project_name:
+            msg = 'Impossible to infer Docker Compose project name!'
+            self.log.error(msg)
+            self.operational_status.append((utils.status_degraded, msg))
+            raise RuntimeError(msg)
 
         return project_name
 
@@ -594,7 +1010,9 @@ class Supervise(Containers):
                 raw_service_name = container.labels.get('com.docker.compose.service')
                 service_name = [raw_service_name] if raw_service_name else []
                 try:
-                    target_network.connect(container.name, aliases=service_name)
+                    with mutation_limiter.priority(container_priority(container.name)):
+                        target_network.connect(container.name, aliases=service_name)
+                    metrics.network_reconnects.inc(container=container.name, result='success')
                 except docker.errors.APIError as e:
                     if "already exists in network" in str(e).lower():
                         continue
@@ -602,11 +1020,29 @@ class Supervise(Containers):
                         self.log.warning(f'Network {target_network.name} ceased to exist '
                                          f'during connectivity check. Nothing to do.')
                         return
+                    metrics.network_reconnects.inc(container=container.name, result='failure')
                     self.log.error(f'Unable to reconnect {container.name} to '
                                    f'network {target_network.name}: {str(e)}')
                     self.operational_status.append((utils.status_degraded,
                                                     'NuvlaEdge containers lost their network connection'))
 
+    def list_nuvlaedge_containers(self, project_name: str = None) -> list:
+        """
+        Lists all the containers (running or not) of this NuvlaEdge's Docker Compose project, with a single listing
+        and without inspecting them, and keeps them for the healer
+
+        :param project_name: Docker Compose project name. Inferred if not given
+        :return: list of containers
+        """
+        if not project_name:
+            project_name = self.get_project_name()
+
+        filters = {
+            'label': f'com.docker.compose.project={project_name}'
+        }
+        self.nuvlaedge_containers = self.container_runtime.list_containers(filters=filters, all=True)
+        return self.nuvlaedge_containers
+
     def check_nuvlaedge_docker_connectivity(self):
         """
         Makes sure all NBE containers are connected to the original bridge network (at least)
@@ -624,14 +1060,13 @@ class Supervise(Containers):
         except:
             return
 
-        original_project_label = f'com.docker.compose.project={project_name}'
+        self.list_nuvlaedge_containers(project_name)
+        original_nb_containers = [c for c in self.nuvlaedge_containers if c.status.lower() == 'running']
+
         filters = {
-            'label': original_project_label
+            'label': f'com.docker.compose.project={project_name}',
+            'driver': 'bridge'
         }
-        original_nb_containers = self.container_runtime.client.containers.list(filters=filters)
-        self.nuvlaedge_containers = self.container_runtime.client.containers.list(filters=filters, all=True)
-
-        filters.update({'driver': 'bridge'})
         original_nb_internal_network = self.container_runtime.client.networks.list(filters=filters)
 
         if not original_nb_containers or not original_nb_internal_network:
@@ -650,18 +1085,30 @@ class Supervise(Containers):
         :return:
         """
         try:
-            self.container_runtime.client.api.start(container.id)
+            with mutation_limiter.priority(container_priority(container.name)):
+                self.container_runtime.client.api.start(container.id)
         except docker.errors.APIError as e:
             self.log.error(f'Cannot resume container {container.name}. Reason: {str(e)}')
 
         return
 
-    def heal_exited_container(self, container: docker.DockerClient.containers) -> None:
+    def heal_exited_container(self, container: docker.DockerClient.containers, immediately: bool = False) -> None:
         """
         Heals a container that has exited unexpectedly
         :param container: container object
+        :param immediately: restart it now instead of after a delay, unless it crashed before
         :return:
         """
+        if isinstance(container.attrs.get('State'), str):
+            # this is a container summary, so only inspect it if it did not exit gracefully
+            if get_exit_code_from_summary(container) == 0:
+                return
+            try:
+                container.reload()
+            except docker.errors.NotFound:
+                self.log.debug(f'Container {container.name} no longer exists. Nothing to heal')
+                return
+
         attrs = container.attrs
         state = attrs.get('State', {})
         exit_code = state.get('ExitCode', 0)
@@ -674,15 +1121,29 @@ class Supervise(Containers):
             if attrs.get('HostConfig', {}).get('RestartPolicy', {}).get('Name', 'no').lower() in ['no']:
                 return
 
+            if self.restart_scheduler.is_pending(container.name):
+                return
+
+            # space out the restarts of a container that keeps crashing, and give up if it crashes too often
+            if self.crash_loops.record_crash(container.name, state.get('FinishedAt'), uptime_from_state(state)):
+                metrics.crash_loops.inc(container=container.name)
+            if self.crash_loops.is_open(container.name):
+                self.operational_status.append(crash_loop_note(container.name, self.crash_loops))
+                return
+
+            if immediately and self.crash_loops.failures(container.name) <= 1:
+                self.log.warning(f'Container {container.name} down (code {exit_code}). Restarting it now')
+                with mutation_limiter.priority(container_priority(container.name)):
+                    self.restart_container(container.name, container.id)
+                return
+
             # at this stage we simply need to try to restart it
-            if (container.name in self.nuvlaedge_containers_restarting and
-                not self.nuvlaedge_containers_restarting[container.name].is_alive()) or \
-                    container.name not in self.nuvlaedge_containers_restarting:
-                self.log.warning(f'Container {container.name} down (code {exit_code}). Scheduling restart')
-                self.nuvlaedge_containers_restarting[container.name] = Timer(30,
-                                                                             self.restart_container,
-                                                                             (container.name, container.id))
-                self.nuvlaedge_containers_restarting[container.name].start()
+            delay = self.crash_loops.delay(container.name, self.restart_delay)
+            if self.restart_scheduler.schedule(container.name, container.id, delay):
+                self.log.warning(f'Container {container.name} down (code {exit_code}). '
+                                 f'Scheduling restart in {delay:.0f} seconds')
+                metrics.restarts_scheduled.inc(container=container.name)
+                self.restart_scheduler.start()
 
     def docker_container_healer(self):
         """
@@ -694,28 +1155,84 @@ class Supervise(Containers):
         if not self.nuvlaedge_containers:
             return
 
-        obsolete_containers = set(self.nuvlaedge_containers_restarting) - set([c.name for c in self.nuvlaedge_containers])
-        if obsolete_containers:
-            # this means we had old restarts for old containers, so let's just clean them up to avoid
-            # unnecessary memory pile up
-            for cname in obsolete_containers:
-                self.nuvlaedge_containers_restarting.pop(cname)
+        # the restarts of containers that are gone are no longer needed
+        names = [c.name for c in self.nuvlaedge_containers]
+        self.restart_scheduler.retain(names)
+        self.crash_loops.retain(names)
 
+        broken = []
         for container in self.nuvlaedge_containers:
             status = container.status.lower()
             if status in ["paused", "running", "restarting"]:
+                # it recovered on its own
+                self.restart_scheduler.cancel(container.name)
+                if status == 'running':
+                    self.crash_loops.record_running(container.name)
                 continue
 
             # what to do if:
             # . status is "created"?
             # .. just start the container
-            if status == 'created':
-                self.heal_created_container(container)
-
             # . status is "exited"?
             # .. understand why. If exit code is 0, then it exited gracefully...thus it is not broken
-            if status == 'exited':
-                self.heal_exited_container(container)
+            if status in ['created', 'exited']:
+                broken.append(container)
+
+        if self.healer_mode == 'waves' and len(broken) > 1:
+            self.heal_in_waves(broken)
+        else:
+            for container in broken:
+                if container.status.lower() == 'created':
+                    self.heal_created_container(container)
+                else:
+                    self.heal_exited_container(container)
+
+        # failed restarts keep the NuvlaEdge degraded until the container recovers
+        self.operational_status.extend(self.restart_scheduler.outcomes())
+
+    def heal_in_waves(self, containers: list) -> None:
+        """
+        Heals several containers at once, e.g. after a reboot, in waves given by their Docker Compose dependencies
+        (com.docker.compose.depends_on). The containers of a wave are healed in parallel, and exited containers are
+        restarted right away, unless they crashed before. The agent goes first
+
+        :param containers: containers in "created" or "exited" state
+        """
+        waves = restart_waves(containers, lambda c: c.labels, lambda c: c.name, priority=[ComponentRegistry.AGENT])
+        self.log.info(f'Healing {len(containers)} containers in {len(waves)} waves: '
+                      f'{" -> ".join(", ".join(c.name for c in wave) for wave in waves)}')
+
+        with ThreadPoolExecutor(max_workers=self.healer_workers, thread_name_prefix='healer') as pool:
+            for wave in waves:
+                for statuses in pool.map(self.heal_and_report, wave):
+                    self.operational_status.extend(statuses)
+
+    def heal_and_report(self, container: docker.DockerClient.containers) -> list:
+        """
+        Heals a container in immediate mode, from a thread of the healer pool
+
+        :param container: container in "created" or "exited" state
+        :return: operational status reported while healing it, as a list of (status, notes)
+        """
+        self.operational_status = []
+        if container.status.lower() == 'created':
+            self.heal_created_container(container)
+        else:
+            self.heal_exited_container(container, immediately=True)
+        return self.operational_status
+
+    def run_scheduled_restart(self, name: str, container_id: str) -> list:
+        """
+        Restarts a container, from the restart scheduler thread
+
+        :param name: container name
+        :param container_id: container ID
+        :return: operational status reported by the restart, as a list of (status, notes)
+        """
+        self.operational_status = []
+        with mutation_limiter.priority(container_priority(name)):
+            self.restart_container(name, container_id)
+        return self.operational_status
 
     def restart_container(self, name, container_id):
         """
@@ -726,8 +1243,10 @@ class Supervise(Containers):
         try:
             self.container_runtime.client.api.restart(container_id)
             self.log.info(f'Successfully restarted container {name}')
+            metrics.restarts_performed.inc(container=name, result='success')
         except docker.errors.APIError as e:
             self.log.error(f'Failed to heal container {name}. Reason: {str(e)}')
+            metrics.restarts_performed.inc(container=name, result='failure')
             self.operational_status.append((utils.status_degraded, f'Container {name} is down'))
 
             if any(w in str(e) for w in ['NotFound', 'network', 'not found']):
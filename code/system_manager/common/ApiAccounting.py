@@ -0,0 +1,226 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+
+""" Accounting of the calls made to the container runtime APIs (Docker daemon or Kubernetes API server)
+
+Every call is recorded with its endpoint, call site, latency and error, if any. Calls are grouped in rounds (e.g. one
+round of supervision checks), so that each round can be reported as "N API calls, M ms", and so that tests can assert
+that a round stays within a budget of API calls
+"""
+
+import os
+import re
+import sys
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, List, Union
+from urllib.parse import urlparse
+
+ApiCall = namedtuple('ApiCall', ['endpoint', 'call_site', 'duration', 'error'])
+
+# source code of the system manager, where call sites are looked for
+_code_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# modules that make the calls on behalf of others, and thus are never the call site
+_transport_modules = ('ApiAccounting.py', 'AsyncDocker.py')
+
+_http_methods = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+_api_version = re.compile(r'^/v\d+\.\d+')
+_object_id = re.compile(r'/[0-9a-f]{12,64}(?=/|$)')
+
+
+def normalize_docker_endpoint(method: str, url: str) -> str:
+    """ Turns a Docker API request into an endpoint, without API version nor object IDs
+
+    e.g. GET http+docker://localhost/v1.41/containers/3f4e...a1/json -> GET /containers/{id}/json
+    """
+    path = _api_version.sub('', urlparse(url).path)
+    return f'{method.upper()} {_object_id.sub("/{id}", path)}'
+
+
+@lru_cache(maxsize=None)
+def _is_call_site(filename: str) -> bool:
+    path = os.path.abspath(filename)
+    return path.startswith(_code_root) and 'site-packages' not in path and \
+        os.path.basename(path) not in _transport_modules
+
+
+def find_call_site() -> str:
+    """ Finds the innermost frame of the system manager's own code, outside of the API transport modules
+
+    :return: "file:line function"
+    """
+    frame = sys._getframe(1)
+    while frame:
+        if _is_call_site(frame.f_code.co_filename):
+            return f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}'
+        frame = frame.f_back
+
+    return 'unknown'
+
+
+class RoundReport:
+    """ API calls made during a round """
+
+    def __init__(self, calls: List[ApiCall]):
+        self.calls = calls
+
+    @property
+    def count(self) -> int:
+        return len(self.calls)
+
+    @property
+    def duration_ms(self) -> float:
+        return sum(c.duration for c in self.calls) * 1000
+
+    @property
+    def errors(self) -> List[ApiCall]:
+        return [c for c in self.calls if c.error]
+
+    def by(self, field: str) -> Dict[str, Dict[str, Union[int, float]]]:
+        """ Aggregates the calls by endpoint or by call site
+
+        :param field: "endpoint" or "call_site"
+        :return: dict of endpoint/call site to {"calls": N, "ms": M, "errors": E}, by descending number of calls
+        """
+        stats = {}
+        for call in self.calls:
+            s = stats.setdefault(getattr(call, field), {'calls': 0, 'ms': 0.0, 'errors': 0})
+            s['calls'] += 1
+            s['ms'] += call.duration * 1000
+            s['errors'] += 1 if call.error else 0
+
+        return dict(sorted(stats.items(), key=lambda kv: kv[1]['calls'], reverse=True))
+
+    def summary(self) -> str:
+        return f'{self.count} API calls, {self.duration_ms:.0f} ms' + \
+            (f', {len(self.errors)} errors' if self.errors else '')
+
+    def dump(self) -> str:
+        """ Summary, followed by one line per endpoint and per call site """
+        lines = [self.summary()]
+        for title, field in [('endpoint', 'endpoint'), ('call site', 'call_site')]:
+            lines += [f'  {title} {name}: {s["calls"]} calls, {s["ms"]:.1f} ms'
+                      + (f', {s["errors"]} errors' if s['errors'] else '')
+                      for name, s in self.by(field).items()]
+        return '\n'.join(lines)
+
+    def assert_budget(self, max_calls: int, max_ms: float = None) -> None:
+        """ Fails if the round made more API calls (or took longer) than allowed
+
+        :param max_calls: maximum number of API calls
+        :param max_ms: maximum accumulated latency of the API calls, in milliseconds
+        """
+        if self.count > max_calls or (max_ms is not None and self.duration_ms > max_ms):
+            raise AssertionError(f'API budget exceeded ({max_calls} calls'
+                                 + (f', {max_ms} ms' if max_ms is not None else '') + f'): {self.dump()}')
+
+
+class ApiAccounting:
+    """ Records the API calls, round after round """
+
+    def __init__(self):
+        self.total_calls = 0
+        self.total_errors = 0
+        self._calls: List[ApiCall] = []
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, duration: float, error: str = None, call_site: str = None) -> None:
+        call = ApiCall(endpoint, call_site or find_call_site(), duration, error)
+        with self._lock:
+            self._calls.append(call)
+            self.total_calls += 1
+            self.total_errors += 1 if error else 0
+
+    def end_round(self) -> RoundReport:
+        """ Closes the current round
+
+        :return: report of the calls made since the end of the previous round
+        """
+        with self._lock:
+            calls, self._calls = self._calls, []
+        return RoundReport(calls)
+
+    @contextmanager
+    def round(self):
+        """ Context manager accounting for the calls made within it, as a round of its own. Meant for tests, e.g.
+
+            with accounting.round() as report:
+                supervise.docker_container_healer()
+            report.assert_budget(3)
+        """
+        self.end_round()
+        report = RoundReport([])
+        try:
+            yield report
+        finally:
+            report.calls = self.end_round().calls
+
+    def instrument_docker(self, docker_client) -> None:
+        """ Wraps all the HTTP requests of a docker-py client (high-level and low-level APIs alike)
+
+        :param docker_client: docker.DockerClient
+        """
+        api = docker_client.api
+        if getattr(api.request, '_accounted', False) is True:
+            return
+
+        original = api.request
+
+        def request(method, url, *args, **kwargs):
+            start = time.perf_counter()
+            error = None
+            try:
+                response = original(method, url, *args, **kwargs)
+                status = getattr(response, 'status_code', 0)
+                if isinstance(status, int) and status >= 400:
+                    error = str(status)
+                return response
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                self.record(normalize_docker_endpoint(method, url), time.perf_counter() - start, error)
+
+        request._accounted = True
+        api.request = request
+
+    def instrument_kubernetes(self, api_client) -> None:
+        """ Wraps all the calls of a Kubernetes API client
+
+        :param api_client: kubernetes.client.ApiClient
+        """
+        if getattr(api_client.call_api, '_accounted', False) is True:
+            return
+
+        original = api_client.call_api
+
+        def call_api(*args, **kwargs):
+            # older clients call call_api(resource_path, method, ...), newer ones call_api(method, url, ...)
+            if str(args[0]).upper() in _http_methods:
+                method, resource_path = args[0], urlparse(args[1]).path
+            else:
+                resource_path, method = args[0], args[1]
+
+            start = time.perf_counter()
+            error = None
+            try:
+                response = original(*args, **kwargs)
+                # newer clients only raise errors once the response is deserialized
+                status = getattr(response, 'status', 0)
+                if isinstance(status, int) and status >= 400:
+                    error = str(status)
+                return response
+            except Exception as e:
+                error = str(getattr(e, 'status', '') or type(e).__name__)
+                raise
+            finally:
+                self.record(f'{method.upper()} {resource_path}', time.perf_counter() - start, error)
+
+        call_api._accounted = True
+        api_client.call_api = call_api
+
+
+accounting = ApiAccounting()
@@ -0,0 +1,222 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+
+""" Minimal asyncio client for the Docker Engine API, over the Docker UNIX socket
+
+Only implements what the asynchronous supervision engine needs: listing, inspecting, starting and restarting
+containers, and consuming the events stream. Every request uses its own short-lived connection, and the number of
+concurrent connections to the daemon is bounded
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import AsyncIterator, Tuple, Union
+from urllib.parse import quote, urlencode
+
+from system_manager.common.ApiAccounting import ApiAccounting, normalize_docker_endpoint
+from system_manager.common.RateLimiter import MutationLimiter, is_mutating
+
+
+class AsyncDockerError(Exception):
+    """ Error response from the Docker daemon """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f'{status}: {message}')
+        self.status = status
+        self.message = message
+
+
+class AsyncDockerNotFound(AsyncDockerError):
+    pass
+
+
+class AsyncDockerClient:
+    """ Talks HTTP/1.1 to the Docker daemon over its UNIX socket, without blocking the event loop """
+
+    def __init__(self, socket_path: str = '/var/run/docker.sock', max_connections: int = 4,
+                 api_version: str = None, timeout: float = 60, accounting: ApiAccounting = None,
+                 limiter: MutationLimiter = None):
+        """ Constructs the client
+
+        :param socket_path: path to the Docker socket
+        :param max_connections: maximum number of concurrent requests to the daemon (streams excluded)
+        :param api_version: Docker API version (e.g. 1.41). If not set, the daemon uses its own version
+        :param timeout: seconds to wait for the response to a request
+        :param accounting: if set, where to record every request
+        :param limiter: if set, rate limiter of the mutating requests
+        """
+        self.log = logging.getLogger(__name__)
+        self.socket_path = socket_path
+        self.max_connections = max_connections
+        self.prefix = f'/v{api_version}' if api_version else ''
+        self.timeout = timeout
+        self.accounting = accounting
+        self.limiter = limiter
+        self.requests = 0
+        self._semaphore = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created lazily, so that it belongs to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        return self._semaphore
+
+    def _url(self, path: str, params: dict = None) -> str:
+        query = {}
+        for k, v in (params or {}).items():
+            if v is None:
+                continue
+            if isinstance(v, bool):
+                v = int(v)
+            elif isinstance(v, dict):
+                v = json.dumps(v)
+            query[k] = v
+
+        return f'{self.prefix}{path}' + (f'?{urlencode(query)}' if query else '')
+
+    async def _send(self, method: str, path: str, params: dict = None,
+                    body: Union[dict, list] = None) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        payload = json.dumps(body).encode() if body is not None else b''
+        head = [f'{method} {self._url(path, params)} HTTP/1.1',
+                'Host: docker',
+                'Connection: close',
+                f'Content-Length: {len(payload)}']
+        if body is not None:
+            head.append('Content-Type: application/json')
+
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + payload)
+        await writer.drain()
+        self.requests += 1
+        return reader, writer
+
+    @staticmethod
+    async def _read_head(reader: asyncio.StreamReader) -> Tuple[int, dict]:
+        status_line = await reader.readline()
+        try:
+            status = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            raise AsyncDockerError(0, f'Invalid response from the Docker daemon: {status_line!r}')
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        return status, headers
+
+    @staticmethod
+    async def _read_chunks(reader: asyncio.StreamReader, headers: dict) -> AsyncIterator[bytes]:
+        if headers.get('transfer-encoding', '').lower() != 'chunked':
+            if 'content-length' in headers:
+                yield await reader.readexactly(int(headers['content-length']))
+            else:
+                yield await reader.read()
+            return
+
+        while True:
+            size_line = await reader.readline()
+            if not size_line:
+                return
+            size = int(size_line.split(b';')[0].strip() or b'0', 16)
+            if size == 0:
+                return
+            chunk = await reader.readexactly(size)
+            await reader.readexactly(2)
+            yield chunk
+
+    @staticmethod
+    def _raise_for_status(status: int, data: bytes) -> None:
+        if status < 400:
+            return
+
+        try:
+            message = json.loads(data).get('message', '')
+        except (ValueError, AttributeError):
+            message = data.decode(errors='replace')
+
+        raise (AsyncDockerNotFound if status == 404 else AsyncDockerError)(status, message)
+
+    async def request(self, method: str, path: str, params: dict = None,
+                      body: Union[dict, list] = None) -> Union[dict, list, str, None]:
+        """ Sends a request to the daemon and waits for the whole response
+
+        :param method: HTTP method
+        :param path: API path, without version prefix (e.g. /containers/json)
+        :param params: query parameters. Dicts are JSON-encoded, booleans are sent as 0/1
+        :param body: JSON body
+        :return: decoded JSON response, or raw text if not JSON, or None if empty
+        """
+        if self.limiter and is_mutating(method, path):
+            await self.limiter.acquire_async()
+
+        start = time.perf_counter()
+        status = None
+        try:
+            async with self.semaphore:
+                reader, writer = await self._send(method, path, params, body)
+                try:
+                    status, headers = await asyncio.wait_for(self._read_head(reader), self.timeout)
+                    data = b''.join([chunk async for chunk in self._read_chunks(reader, headers)])
+                finally:
+                    writer.close()
+        finally:
+            if self.accounting:
+                error = None if status and status < 400 else str(status or 'ConnectionError')
+                self.accounting.record(normalize_docker_endpoint(method, path), time.perf_counter() - start, error)
+
+        self._raise_for_status(status, data)
+        if not data:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return data.decode(errors='replace')
+
+    async def ping(self) -> bool:
+        return await self.request('GET', '/_ping') == 'OK'
+
+    async def containers(self, filters: dict = None, all: bool = False) -> list:
+        """ Lists container summaries, like docker-py's APIClient.containers """
+        return await self.request('GET', '/containers/json', {'all': all, 'filters': filters}) or []
+
+    async def inspect_container(self, container_id: str) -> dict:
+        return await self.request('GET', f'/containers/{quote(container_id)}/json')
+
+    async def start(self, container_id: str) -> None:
+        await self.request('POST', f'/containers/{quote(container_id)}/start')
+
+    async def restart(self, container_id: str, timeout: int = 10) -> None:
+        await self.request('POST', f'/containers/{quote(container_id)}/restart', {'t': timeout})
+
+    async def disconnect_container_from_network(self, container_id: str, network: str) -> None:
+        await self.request('POST', f'/networks/{quote(network)}/disconnect', body={'Container': container_id})
+
+    async def events(self, filters: dict = None) -> AsyncIterator[dict]:
+        """ Consumes the events stream, until the connection breaks
+
+        :param filters: Docker events filters
+        :return: async iterator of decoded events
+        """
+        reader, writer = await self._send('GET', '/events', {'filters': filters})
+        try:
+            status, headers = await asyncio.wait_for(self._read_head(reader), self.timeout)
+            if status >= 400:
+                self._raise_for_status(status, b''.join([c async for c in self._read_chunks(reader, headers)]))
+
+            buffer = b''
+            async for chunk in self._read_chunks(reader, headers):
+                buffer += chunk
+                # the daemon sends one JSON document per line
+                while b'\n' in buffer:
+                    line, buffer = buffer.split(b'\n', 1)
+                    if line.strip():
+                        yield json.loads(line)
+        finally:
+            writer.close()
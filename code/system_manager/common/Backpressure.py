@@ -0,0 +1,175 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+
+""" Backpressure from the container runtime
+
+The latency of the Docker daemon (or Kubernetes API server) is sampled once per round of checks, from a /_ping and from
+the calls accounted during the round. When it crosses the thresholds below, the supervision backs off: the intervals
+of the checks are stretched and, when overloaded, the non-critical checks are skipped. Backing off is immediate, while
+recovering goes one level at a time, after a few rounds with a lower latency
+"""
+
+import logging
+import os
+import time
+from typing import Callable, List, Union
+
+import system_manager.common.Metrics as metrics
+from system_manager.common import utils
+from system_manager.common.ApiAccounting import RoundReport
+
+LEVEL_NORMAL = 0
+LEVEL_SLOW = 1
+LEVEL_OVERLOADED = 2
+LEVEL_NAMES = {LEVEL_NORMAL: 'normal', LEVEL_SLOW: 'slow', LEVEL_OVERLOADED: 'overloaded'}
+
+# smoothed latency, in milliseconds, above which the container runtime is considered slow or overloaded
+LATENCY_SLOW_MS = float(os.getenv('NUVLAEDGE_SM_LATENCY_SLOW_MS', 250))
+LATENCY_OVERLOADED_MS = float(os.getenv('NUVLAEDGE_SM_LATENCY_OVERLOADED_MS', 1000))
+# rounds of checks with a lower latency before going down one level
+RECOVERY_ROUNDS = int(os.getenv('NUVLAEDGE_SM_BACKPRESSURE_RECOVERY_ROUNDS', 3))
+
+# multiplier of the intervals of the checks, per level
+STRETCH = {LEVEL_NORMAL: 1, LEVEL_SLOW: 2, LEVEL_OVERLOADED: 4}
+# checks (and parts of checks) that are skipped when overloaded
+NON_CRITICAL = ('requirements', 'node-label', 'data-gateway-load')
+
+# calls whose duration depends on how much they return or on how long they are kept open, not on the runtime's latency
+_long_lived = ('/events', '/logs', '/log')
+
+
+def round_latency(report: RoundReport) -> Union[float, None]:
+    """ Average latency of the read calls made during a round. Writes are left out, since restarts and stops
+    legitimately take seconds
+
+    :param report: API calls made during the round
+    :return: milliseconds, or None if there were no read calls
+    """
+    durations = [c.duration for c in report.calls
+                 if c.endpoint.startswith('GET ') and not c.endpoint.endswith(_long_lived)]
+    if not durations:
+        return None
+    return sum(durations) / len(durations) * 1000
+
+
+class DaemonBackpressure:
+    """ Tracks the latency of the container runtime and the resulting backpressure level """
+
+    def __init__(self, slow_ms: float = LATENCY_SLOW_MS, overloaded_ms: float = LATENCY_OVERLOADED_MS,
+                 recovery_rounds: int = RECOVERY_ROUNDS, smoothing: float = 0.5, ping: Callable[[], object] = None,
+                 non_critical: tuple = NON_CRITICAL):
+        """ Constructs the tracker
+
+        :param slow_ms: latency above which the runtime is slow
+        :param overloaded_ms: latency above which the runtime is overloaded
+        :param recovery_rounds: rounds below the threshold of the current level before going down one level
+        :param smoothing: weight of the latest sample in the smoothed latency, between 0 and 1
+        :param ping: cheap call to the runtime, e.g. docker.DockerClient.ping. Its errors count as an overload
+        :param non_critical: checks to skip when overloaded
+        """
+        self.log = logging.getLogger(__name__)
+        self.slow_ms = slow_ms
+        self.overloaded_ms = overloaded_ms
+        self.recovery_rounds = max(1, recovery_rounds)
+        self.smoothing = smoothing
+        self.ping = ping
+        self.non_critical = non_critical
+        self.level = LEVEL_NORMAL
+        self.latency_ms = None
+        self._good_rounds = 0
+
+    @property
+    def stretch(self) -> float:
+        return STRETCH[self.level]
+
+    def probe(self) -> Union[float, None]:
+        """ Pings the runtime
+
+        :return: milliseconds it took, or None if there is nothing to ping
+        """
+        if not self.ping:
+            return None
+
+        start = time.perf_counter()
+        try:
+            self.ping()
+        except Exception as e:
+            self.log.warning(f'Container runtime did not answer the ping: {str(e)}')
+            return max(self.overloaded_ms, (time.perf_counter() - start) * 1000)
+
+        return (time.perf_counter() - start) * 1000
+
+    def target_level(self, latency_ms: float) -> int:
+        if latency_ms >= self.overloaded_ms:
+            return LEVEL_OVERLOADED
+        if latency_ms >= self.slow_ms:
+            return LEVEL_SLOW
+        return LEVEL_NORMAL
+
+    def observe(self, *samples_ms: Union[float, None]) -> int:
+        """ Updates the smoothed latency with the slowest of the samples, and the level with it
+
+        :param samples_ms: latencies measured during the last round. None values are ignored
+        :return: the new level
+        """
+        samples = [s for s in samples_ms if s is not None]
+        if not samples:
+            return self.level
+
+        sample = max(samples)
+        self.latency_ms = sample if self.latency_ms is None else \
+            self.smoothing * sample + (1 - self.smoothing) * self.latency_ms
+
+        previous = self.level
+        target = self.target_level(self.latency_ms)
+        if target >= self.level:
+            self.level = target
+            self._good_rounds = 0
+        else:
+            self._good_rounds += 1
+            if self._good_rounds >= self.recovery_rounds:
+                self.level -= 1
+                self._good_rounds = 0
+
+        if self.level != previous:
+            log = self.log.warning if self.level > previous else self.log.info
+            log(f'Container runtime latency is {self.latency_ms:.0f} ms. Backpressure changed from '
+                f'{LEVEL_NAMES[previous]} to {LEVEL_NAMES[self.level]}')
+
+        metrics.runtime_latency.set(self.latency_ms / 1000)
+        metrics.backpressure_level.set(self.level)
+        return self.level
+
+    def observe_round(self, report: RoundReport, ping_ms: float = None) -> int:
+        """ Observes the latency of the round's calls, together with the one of a ping
+
+        :param report: API calls made during the round
+        :param ping_ms: latency of the ping made at the end of the round, as returned by probe(). It is part of the
+        round, so that it is accounted in the report of the round it measures
+        :return: the new level
+        """
+        return self.observe(ping_ms, round_latency(report))
+
+    def skips(self, name: str) -> bool:
+        """ Whether a non-critical check (or part of a check) should be skipped at the current level
+
+        :param name: e.g. "requirements"
+        """
+        return self.level >= LEVEL_OVERLOADED and name in self.non_critical
+
+    def status_notes(self) -> List[tuple]:
+        """ Operational status notes describing the current backpressure, if any
+
+        :return: list of tuples (status, status_notes)
+        """
+        if self.level == LEVEL_NORMAL:
+            return []
+
+        note = f'Container runtime is {LEVEL_NAMES[self.level]} ({self.latency_ms:.0f} ms). ' \
+               f'Supervision intervals stretched x{self.stretch}'
+        if self.level >= LEVEL_OVERLOADED:
+            note += f', skipping {", ".join(self.non_critical)}'
+        return [(utils.status_operational, note)]
+
+
+backpressure = DaemonBackpressure()
@@ -0,0 +1,203 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+
+""" Load of the Data Gateway, from the $SYS topics of its MQTT broker (mosquitto)
+
+mosquitto publishes its statistics as retained messages under $SYS/broker, every sys_interval seconds. Subscribing to
+them returns the latest values right away, so the load is polled with a short-lived connection at every check, rather
+than with a subscription kept open in the background
+"""
+
+import logging
+import os
+import time
+from typing import Dict, List, Union
+
+import system_manager.common.Metrics as metrics
+from system_manager.common import utils
+from system_manager.common.Mqtt import MqttClient, MqttError
+
+SYS_TOPIC = '$SYS/broker/#'
+
+# $SYS topic of each statistic. Rates are averaged over the last minute, per minute
+SYS_STATS = {
+    '$SYS/broker/load/messages/received/1min': 'messages_received_per_min',
+    '$SYS/broker/load/messages/sent/1min': 'messages_sent_per_min',
+    '$SYS/broker/load/bytes/received/1min': 'bytes_received_per_min',
+    '$SYS/broker/load/bytes/sent/1min': 'bytes_sent_per_min',
+    '$SYS/broker/clients/connected': 'clients',
+    '$SYS/broker/publish/messages/dropped': 'dropped_total',
+    # mosquitto 1.x only
+    '$SYS/broker/messages/inflight': 'inflight',
+    # all the messages held by the broker, retained ones included
+    '$SYS/broker/store/messages/count': 'stored',
+    '$SYS/broker/heap/current': 'heap_bytes',
+}
+
+# saturation thresholds. The Data Gateway is degraded when any of them is exceeded
+THRESHOLDS = {
+    'messages_per_s': float(os.getenv('NUVLAEDGE_SM_DG_MAX_MESSAGES_PER_S', 10000)),
+    'bytes_per_s': float(os.getenv('NUVLAEDGE_SM_DG_MAX_BYTES_PER_S', 50 * 1024 * 1024)),
+    'clients': float(os.getenv('NUVLAEDGE_SM_DG_MAX_CLIENTS', 1000)),
+    # QoS 0 messages are dropped now and then under normal load, when a client is slow
+    'dropped_per_s': float(os.getenv('NUVLAEDGE_SM_DG_MAX_DROPPED_PER_S', 10)),
+    'inflight': float(os.getenv('NUVLAEDGE_SM_DG_MAX_INFLIGHT', 1000)),
+    'stored': float(os.getenv('NUVLAEDGE_SM_DG_MAX_STORED', 100000)),
+    'heap_bytes': float(os.getenv('NUVLAEDGE_SM_DG_MAX_HEAP_BYTES', 256 * 1024 * 1024)),
+}
+
+_descriptions = {
+    'messages_per_s': 'messages/s',
+    'bytes_per_s': 'bytes/s',
+    'clients': 'connected clients',
+    'dropped_per_s': 'dropped messages/s',
+    'inflight': 'inflight messages',
+    'stored': 'stored messages',
+    'heap_bytes': 'bytes of heap',
+}
+
+
+def parse_number(payload: bytes) -> Union[float, None]:
+    """ Parses the value of a $SYS topic, e.g. b"12.34" or b"1234 seconds" """
+    try:
+        return float(payload.decode(errors='replace').split()[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def human_bytes(value: float) -> str:
+    for unit in ['B', 'kB', 'MB']:
+        if value < 1024:
+            return f'{value:.0f} {unit}' if unit == 'B' else f'{value:.1f} {unit}'
+        value /= 1024
+    return f'{value:.1f} GB'
+
+
+class BrokerLoadMonitor:
+    """ Polls the load of an MQTT broker from its $SYS topics """
+
+    def __init__(self, host: str, port: int = 1883, timeout: float = 2, settle: float = 0.2,
+                 thresholds: Dict[str, float] = None):
+        """ Constructs the monitor
+
+        :param host: broker host name
+        :param port: broker port
+        :param timeout: seconds to wait for the broker
+        :param settle: seconds without new $SYS messages after which all the retained ones are considered received
+        :param thresholds: saturation thresholds. Defaults to THRESHOLDS
+        """
+        self.log = logging.getLogger(__name__)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.settle = settle
+        self.thresholds = dict(THRESHOLDS if thresholds is None else thresholds)
+        self.stats: Dict[str, float] = {}
+        self._previous_dropped = None
+
+    def read_sys_topics(self) -> Dict[str, float]:
+        """ Subscribes to the $SYS topics and collects the retained values
+
+        :return: raw statistics, by name in SYS_STATS
+        :raises OSError, MqttError: if the broker cannot be reached
+        """
+        raw = {}
+        with MqttClient(self.host, self.port, timeout=self.timeout) as client:
+            client.subscribe(SYS_TOPIC)
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
+                message = client.receive(self.settle)
+                if message is None:
+                    break
+                topic, payload = message
+                name = SYS_STATS.get(topic)
+                value = parse_number(payload)
+                if name and value is not None:
+                    raw[name] = value
+
+        return raw
+
+    def poll(self) -> Dict[str, float]:
+        """ Reads the current load of the broker
+
+        :return: statistics (messages_per_s, bytes_per_s, clients, dropped_per_s, inflight, stored, heap_bytes),
+        without the ones the broker does not publish. Empty if the broker cannot be reached
+        """
+        try:
+            raw = self.read_sys_topics()
+        except (OSError, MqttError) as e:
+            self.log.debug(f'Cannot read the $SYS topics of {self.host}:{self.port}: {str(e)}')
+            self.stats = {}
+            return {}
+
+        now = time.monotonic()
+        stats = {}
+        if 'messages_received_per_min' in raw or 'messages_sent_per_min' in raw:
+            stats['messages_per_s'] = (raw.get('messages_received_per_min', 0)
+                                       + raw.get('messages_sent_per_min', 0)) / 60
+        if 'bytes_received_per_min' in raw or 'bytes_sent_per_min' in raw:
+            stats['bytes_per_s'] = (raw.get('bytes_received_per_min', 0) + raw.get('bytes_sent_per_min', 0)) / 60
+        for name in ['clients', 'inflight', 'stored', 'heap_bytes']:
+            if name in raw:
+                stats[name] = raw[name]
+
+        # dropped messages are a total, since the broker started
+        if 'dropped_total' in raw:
+            previous, self._previous_dropped = self._previous_dropped, (now, raw['dropped_total'])
+            if previous and now > previous[0] and raw['dropped_total'] >= previous[1]:
+                stats['dropped_per_s'] = (raw['dropped_total'] - previous[1]) / (now - previous[0])
+
+        self.stats = stats
+        self.export(stats)
+        return stats
+
+    @staticmethod
+    def export(stats: Dict[str, float]) -> None:
+        metrics.data_gateway_load.clear()
+        for name, value in stats.items():
+            metrics.data_gateway_load.set(value, stat=name)
+
+    def saturated(self, stats: Dict[str, float] = None) -> List[str]:
+        """ Statistics above their threshold
+
+        :param stats: as returned by poll(). Defaults to the last ones
+        :return: descriptions, e.g. "12000 messages/s (max 10000)"
+        """
+        stats = self.stats if stats is None else stats
+        return [f'{stats[name]:.0f} {_descriptions[name]} (max {threshold:.0f})'
+                for name, threshold in self.thresholds.items() if name in stats and stats[name] > threshold]
+
+    def summary(self, stats: Dict[str, float] = None) -> str:
+        stats = self.stats if stats is None else stats
+        parts = []
+        if 'messages_per_s' in stats:
+            parts.append(f'{stats["messages_per_s"]:.0f} msg/s')
+        if 'bytes_per_s' in stats:
+            parts.append(f'{human_bytes(stats["bytes_per_s"])}/s')
+        if 'clients' in stats:
+            parts.append(f'{stats["clients"]:.0f} clients')
+        if 'dropped_per_s' in stats:
+            parts.append(f'{stats["dropped_per_s"]:.1f} dropped/s')
+        if 'inflight' in stats:
+            parts.append(f'{stats["inflight"]:.0f} inflight')
+        if 'stored' in stats:
+            parts.append(f'{stats["stored"]:.0f} stored')
+        if 'heap_bytes' in stats:
+            parts.append(f'heap {human_bytes(stats["heap_bytes"])}')
+        return ', '.join(parts)
+
+    def status_notes(self, stats: Dict[str, float] = None) -> List[tuple]:
+        """ Operational status notes describing the load, degraded if the broker is saturated
+
+        :param stats: as returned by poll(). Defaults to the last ones
+        :return: list of tuples (status, status_notes)
+        """
+        stats = self.stats if stats is None else stats
+        if not stats:
+            return []
+
+        notes = [(utils.status_operational, f'Data Gateway load: {self.summary(stats)}')]
+        saturated = self.saturated(stats)
+        if saturated:
+            notes.append((utils.status_degraded, f'Data Gateway is saturated: {", ".join(saturated)}'))
+        return notes
@@ -0,0 +1,135 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+
+""" Inventory of the NuvlaEdge API certificates in the shared volume, and of their expiration dates """
+
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple, Union
+
+import OpenSSL
+
+from system_manager.common import utils
+
+
+class CertificateInventory:
+    """ Keeps the expiration date (notAfter) of a set of certificate files
+
+    Each file is only parsed again when its (inode, mtime, size) changes, so checking the inventory costs a few stat
+    calls. Since the expiration dates are known, so is the next time at which a rotation decision can change: until
+    then, and as long as no file changes, the decision is taken from the cache
+    """
+
+    default_files = ('ca.pem', 'server-cert.pem', 'cert.pem')
+
+    def __init__(self, directory: str = utils.data_volume, files: Tuple[str, ...] = default_files,
+                 rotation_threshold_days: int = 5, clock: Callable[[], datetime] = datetime.now):
+        """ Constructs the inventory
+
+        :param directory: where the certificate files are
+        :param files: names of the certificate files
+        :param rotation_threshold_days: certificates expiring in less than these days need to be rotated
+        :param clock: returns the current (local) time
+        """
+        self.log = logging.getLogger(__name__)
+        self.directory = directory
+        self.files = files
+        self.rotation_threshold_days = rotation_threshold_days
+        self.clock = clock
+        self.parses = 0
+        self._entries: Dict[str, Tuple[tuple, Union[datetime, None]]] = {}
+        self._expiring: List[str] = []
+        self._deadline = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def parse_not_after(content: bytes) -> datetime:
+        """ Gets the expiration date of a PEM certificate. Like the rest of the NuvlaEdge, only the day is considered
+
+        :param content: PEM certificate
+        :return: expiration date, at midnight
+        """
+        cert_obj = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, content)
+        end_date = cert_obj.get_notAfter().decode()
+        return datetime(int(end_date[0:4]), int(end_date[4:6]), int(end_date[6:8]))
+
+    def refresh(self) -> bool:
+        """ Stats the certificate files and parses the ones that changed
+
+        :return: True if any file was added, changed or removed since the last refresh
+        """
+        changed = False
+        with self._lock:
+            for file in self.files:
+                path = os.path.join(self.directory, file)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    if self._entries.pop(file, None):
+                        changed = True
+                    continue
+
+                key = (st.st_ino, st.st_mtime_ns, st.st_size)
+                entry = self._entries.get(file)
+                if entry and entry[0] == key:
+                    continue
+
+                changed = True
+                self.parses += 1
+                try:
+                    with open(path, 'rb') as fp:
+                        not_after = self.parse_not_after(fp.read())
+                except Exception as e:
+                    self.log.error(f'Unable to read certificate {path}: {str(e)}')
+                    not_after = None
+
+                self._entries[file] = (key, not_after)
+
+            if changed:
+                self._deadline = None
+
+        return changed
+
+    def not_after(self) -> Dict[str, datetime]:
+        """ Expiration date of each certificate that exists and could be parsed """
+        with self._lock:
+            return {file: entry[1] for file, entry in self._entries.items() if entry[1]}
+
+    def days_left(self, now: datetime = None) -> Dict[str, int]:
+        """ Days until each certificate expires, for status reporting
+
+        :param now: current time. Defaults to the clock
+        :return: dict of file name to days left (negative if already expired)
+        """
+        now = now or self.clock()
+        return {file: (not_after - now).days for file, not_after in self.not_after().items()}
+
+    def next_deadline(self, now: datetime = None) -> Union[datetime, None]:
+        """ Next time at which a certificate enters the rotation threshold, i.e. when the rotation decision can change
+        without any file changing
+
+        :param now: current time. Defaults to the clock
+        :return: datetime, or None if no certificate is going to enter the threshold
+        """
+        now = now or self.clock()
+        threshold = timedelta(days=self.rotation_threshold_days)
+        deadlines = [not_after - threshold for not_after in self.not_after().values() if not_after - threshold >= now]
+        return min(deadlines) if deadlines else None
+
+    def expiring(self) -> List[str]:
+        """ Refreshes the inventory and gets the certificates that expire in less than the rotation threshold. The
+        decision is only computed again when a file changed or when its deadline is reached
+
+        :return: names of the expiring certificate files
+        """
+        changed = self.refresh()
+        now = self.clock()
+        if changed or self._deadline is None or now >= self._deadline:
+            self._expiring = [file for file, days in self.days_left(now).items()
+                              if days < self.rotation_threshold_days]
+            # if no certificate can enter the threshold anymore, there is nothing to recompute until a file changes
+            self._deadline = self.next_deadline(now) or datetime.max
+
+        return list(self._expiring)
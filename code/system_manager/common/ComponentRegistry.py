@@ -0,0 +1,168 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+
+""" Registry of the NuvlaEdge components the system manager needs to find over and over again """
+
+import logging
+import threading
+from typing import Callable, Union
+
+import docker
+
+from system_manager.common import utils
+
+
+class ComponentRegistry:
+    """ Resolves the containers of the well-known NuvlaEdge components once, and keeps them by ID
+
+    A component is only resolved again (by name, labels, hostname, etc.) when a lookup by ID returns NotFound or when
+    it is explicitly invalidated, e.g. because a lifecycle event reported that its container was destroyed
+    """
+
+    SYSTEM_MANAGER = 'system-manager'
+    AGENT = 'agent'
+    DATA_GATEWAY = 'data-gateway'
+    ON_STOP = 'on-stop'
+    CREDENTIALS_MANAGER = 'credentials-manager'
+
+    def __init__(self, container_runtime):
+        """ Constructs the registry
+
+        :param container_runtime: Docker container runtime
+        """
+        self.log = logging.getLogger(__name__)
+        self.container_runtime = container_runtime
+        self.resolutions = 0
+        self._ids = {}
+        self._project_name = None
+        self._lock = threading.RLock()
+        self._resolvers = {
+            self.SYSTEM_MANAGER: self._resolve_system_manager,
+            self.AGENT: self._resolve_agent,
+            self.DATA_GATEWAY: lambda: self._resolve_by_name(utils.data_gateway_name),
+            self.ON_STOP: lambda: self._resolve_by_name(f'{utils.compose_project_name}-on-stop'),
+            self.CREDENTIALS_MANAGER:
+                lambda: self._resolve_by_name(self.container_runtime.credentials_manager_component)
+        }
+
+    def _resolve_by_name(self, name: str) -> Union[object, None]:
+        try:
+            return self.container_runtime.client.containers.get(name)
+        except docker.errors.NotFound:
+            return None
+
+    def _resolve_system_manager(self) -> object:
+        myself = self.container_runtime.find_current_container()
+
+        project_name = myself.labels.get('com.docker.compose.project')
+        if not project_name:
+            self.log.warning(f'Cannot infer Docker Compose project name from the labels in {myself.name}. '
+                             f'Trying to infer from container name')
+            try:
+                project_name = myself.name.split('-')[-3]
+            except (IndexError, AttributeError):
+                self.log.error('Impossible to infer Docker Compose project name!')
+
+        self._project_name = project_name
+        return myself
+
+    def _resolve_agent(self) -> Union[object, None]:
+        filters = {'label': ['nuvlaedge.component=True',
+                             'com.docker.compose.service=agent',
+                             f'com.docker.compose.project={self.project_name or utils.compose_project_name}']}
+        agents = self.container_runtime.list_containers(filters=filters)
+        return agents[0] if agents else None
+
+    def register(self, component: str, resolver: Callable[[], Union[object, None]]) -> None:
+        """ Registers a new component, or overrides how an existing one is resolved
+
+        :param component: name of the component
+        :param resolver: function returning the component's container, or None if it does not exist
+        """
+        with self._lock:
+            self._resolvers[component] = resolver
+            self._ids.pop(component, None)
+
+    def resolve(self, component: str) -> Union[object, None]:
+        """ Finds the container of a component from scratch, and keeps its ID
+
+        :param component: name of the component
+        :return: container object, or None if it does not exist
+        """
+        with self._lock:
+            self.resolutions += 1
+            container = self._resolvers[component]()
+            if container:
+                self._ids[component] = container.id
+            else:
+                self._ids.pop(component, None)
+
+            return container
+
+    def get_id(self, component: str) -> Union[str, None]:
+        """ Returns the container ID of a component, resolving it only if not known yet
+
+        :param component: name of the component
+        :return: container ID, or None if it does not exist
+        """
+        with self._lock:
+            if component not in self._ids:
+                self.resolve(component)
+
+            return self._ids.get(component)
+
+    def get_container(self, component: str) -> Union[object, None]:
+        """ Returns the container of a component, looking it up by ID. If not found, the component is resolved again
+
+        :param component: name of the component
+        :return: container object, or None if it does not exist
+        """
+        with self._lock:
+            container_id = self._ids.get(component)
+            if not container_id:
+                return self.resolve(component)
+
+            try:
+                return self.container_runtime.client.containers.get(container_id)
+            except docker.errors.NotFound:
+                self.log.debug(f'Container {container_id} of {component} is gone. Resolving it again')
+                return self.resolve(component)
+
+    @property
+    def project_name(self) -> Union[str, None]:
+        """ Docker Compose project name of this NuvlaEdge, as inferred from the system manager container """
+        with self._lock:
+            if self.SYSTEM_MANAGER not in self._ids:
+                self.resolve(self.SYSTEM_MANAGER)
+
+            return self._project_name
+
+    def invalidate(self, component: str = None) -> None:
+        """ Forgets a component, so that it is resolved again on the next lookup
+
+        :param component: name of the component. If not given, all components are forgotten
+        """
+        with self._lock:
+            if component:
+                self._ids.pop(component, None)
+            else:
+                self._ids.clear()
+
+    def invalidate_container(self, container_id: str) -> None:
+        """ Forgets whichever component had the given container ID
+
+        :param container_id: ID of the container
+        """
+        with self._lock:
+            for component, cid in list(self._ids.items()):
+                if cid == container_id:
+                    self.log.debug(f'Container {container_id} of {component} is gone')
+                    self._ids.pop(component)
+
+    def handle_event(self, event: dict) -> None:
+        """ Invalidates the components affected by a Docker lifecycle event
+
+        :param event: decoded Docker event
+        """
+        if event.get('Type') == 'container' and event.get('Action') == 'destroy':
+            self.invalidate_container(event.get('Actor', {}).get('ID'))
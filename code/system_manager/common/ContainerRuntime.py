@@ -3,13 +3,25 @@ import random
 import requests
 import socket
 import string
+import threading
 import time
 from abc import ABC, abstractmethod
 from datetime import datetime
 from pathlib import Path
 from system_manager.common import utils
+from system_manager.common.ApiAccounting import accounting
+from system_manager.common.ComponentRegistry import ComponentRegistry
+from system_manager.common.RateLimiter import mutation_limiter
 
 KUBERNETES_SERVICE_HOST = os.getenv('KUBERNETES_SERVICE_HOST')
+# connections kept alive to the Docker socket, shared by all the concurrent paths of the system manager:
+# the main loop, the events stream, the delayed container restarts and the on-stop launch at shutdown
+DOCKER_MAX_POOL_SIZE = int(os.getenv('NUVLAEDGE_DOCKER_MAX_POOL_SIZE', 4))
+# connections held for long by the events stream, the delayed container restarts and the on-stop launch at shutdown
+DOCKER_STREAMS = 3
+# Docker socket, as given by DOCKER_HOST (like for docker-py and the Docker CLI), or the default one
+DOCKER_SOCKET_FILE = os.getenv('DOCKER_HOST', '')[len('unix://'):] \
+    if os.getenv('DOCKER_HOST', '').startswith('unix://') else '/var/run/docker.sock'
 if KUBERNETES_SERVICE_HOST:
     from kubernetes import client, config
     ORCHESTRATOR = 'kubernetes'
@@ -76,21 +88,34 @@ class ContainerRuntime(ABC):
         """
         pass
 
+    def _get_node_info(self, node_info=None):
+        """ Returns the provided node info, or fetches it from the container runtime if not provided
+
+        :param node_info: node info previously fetched for the current cycle (e.g. from a NodeInfoSnapshot)
+        """
+        return node_info if node_info is not None else self.get_node_info()
+
     @abstractmethod
-    def get_ram_capacity(self):
+    def get_ram_capacity(self, node_info=None):
         """ Return the memory capacity for the node, as reported by the Container client
+
+        :param node_info: optional node info, to avoid fetching it again
         """
         pass
 
     @abstractmethod
-    def is_version_compatible(self):
+    def is_version_compatible(self, node_info=None):
         """ Checks if the container runtime engine has a version equal to or higher than the minimum requirements
+
+        :param node_info: optional node info, to avoid fetching it again
         """
         pass
 
     @abstractmethod
-    def is_coe_enabled(self, check_local_node_state=False):
+    def is_coe_enabled(self, check_local_node_state=False, node_info=None):
         """ Check if the COE (clustering) is enabled. For K8s this is always True
+
+        :param node_info: optional node info, to avoid fetching it again
         """
         pass
 
@@ -112,8 +137,10 @@ class ContainerRuntime(ABC):
         pass
 
     @abstractmethod
-    def get_node_id(self):
+    def get_node_id(self, node_info=None):
         """ Returns the node ID
+
+        :param node_info: optional node info, to avoid fetching it again
         """
         pass
 
@@ -125,8 +152,10 @@ class ContainerRuntime(ABC):
         pass
 
     @abstractmethod
-    def get_cluster_managers(self):
+    def get_cluster_managers(self, node_info=None):
         """ Retrieves the cluster manager nodes
+
+        :param node_info: optional node info, to avoid fetching it again
         """
         pass
 
@@ -163,14 +192,19 @@ class ContainerRuntime(ABC):
         pass
 
     @abstractmethod
-    def count_images_in_this_host(self):
+    def count_images_in_this_host(self, node_info=None):
         """ Counts the number of Docker images in this host
+
+        :param node_info: optional node info, to avoid fetching it again
         """
         pass
 
     @abstractmethod
-    def get_version(self):
+    def get_version(self, node_info=None):
         """ Gets the version of the underlying COE
+
+        :param node_info: optional node info, to avoid fetching it again (only used by COEs that report the
+        version as part of the node info)
         """
         pass
 
@@ -186,6 +220,8 @@ class Kubernetes(ContainerRuntime):
         config.load_incluster_config()
         self.client = client.CoreV1Api()
         self.client_apps = client.AppsV1Api()
+        accounting.instrument_kubernetes(self.client.api_client)
+        accounting.instrument_kubernetes(self.client_apps.api_client)
         self.namespace = os.getenv('MY_NAMESPACE', 'nuvlaedge')
         self.host_node_name = os.getenv('MY_HOST_NODE_NAME')
         self.minimum_major_version = '1'
@@ -195,10 +231,30 @@ class Kubernetes(ContainerRuntime):
         self.orchestrator = 'kubernetes'
         self.agent_dns = f'agent.{self.namespace}'
         self.my_component_name = 'nuvlaedge-engine-core'
+        # maximum number of objects per list response
+        self.list_limit = int(os.getenv('NUVLAEDGE_K8S_LIST_LIMIT', 250))
+
+    def list_all(self, list_function, **kwargs) -> list:
+        """ Lists objects page by page (limit/continue), so that large clusters are not listed in a single response
+
+        :param list_function: list method of the Kubernetes client, e.g. self.client.list_node
+        :param kwargs: arguments of the list method (namespace, selectors, ...)
+        :return: all the listed objects
+        """
+        items = []
+        kwargs['limit'] = self.list_limit
+        while True:
+            page = list_function(**kwargs)
+            items += page.items
+            next_page = page.metadata._continue if page.metadata else None
+            if not next_page:
+                return items
+
+            kwargs['_continue'] = next_page
 
     def list_internal_components(self, base_label=utils.base_label):
         # for k8s, components = pods
-        return self.client.list_namespaced_pod(namespace=self.namespace, label_selector=base_label).items
+        return self.list_all(self.client.list_namespaced_pod, namespace=self.namespace, label_selector=base_label)
 
     def fetch_container_logs(self, component, since, tail=30):
         # component = pod object
@@ -232,11 +288,11 @@ class Kubernetes(ContainerRuntime):
 
         return None
 
-    def get_ram_capacity(self):
-        return int(self.get_node_info().status.capacity.get('memory', '0').rstrip('Ki'))/1024
+    def get_ram_capacity(self, node_info=None):
+        return int(self._get_node_info(node_info).status.capacity.get('memory', '0').rstrip('Ki'))/1024
 
-    def is_version_compatible(self):
-        kubelet_version = self.get_version()
+    def is_version_compatible(self, node_info=None):
+        kubelet_version = self.get_version(node_info)
 
         kubelet_simplified_version = int(''.join(kubelet_version.lstrip('v').split('.')[0:2]))
         kubelet_minimum_version = int(self.minimum_major_version + self.minimum_minor_version)
@@ -249,7 +305,7 @@ class Kubernetes(ContainerRuntime):
 
         return True
 
-    def is_coe_enabled(self, check_local_node_state=False):
+    def is_coe_enabled(self, check_local_node_state=False, node_info=None):
         return True
 
     def infer_on_stop_docker_image(self):
@@ -260,13 +316,13 @@ class Kubernetes(ContainerRuntime):
         # not needed for k8s
         pass
 
-    def get_node_id(self):
-        return self.get_node_info().metadata.name
+    def get_node_id(self, node_info=None):
+        return self._get_node_info(node_info).metadata.name
 
     def list_nodes(self, optional_filter={}):
-        return self.client.list_node().items
+        return self.list_all(self.client.list_node)
 
-    def get_cluster_managers(self):
+    def get_cluster_managers(self, node_info=None):
         managers = []
         for n in self.list_nodes():
             for label in n.metadata.labels:
@@ -317,19 +373,21 @@ class Kubernetes(ContainerRuntime):
         return None, f'Cannot find agent container within main NuvlaEdge Engine pod with label {search_label}'
 
     def list_all_containers_in_this_node(self):
-        pods_here = self.client.list_pod_for_all_namespaces(field_selector=f'spec.nodeName={self.host_node_name}').items
+        pods_here = self.list_all(self.client.list_pod_for_all_namespaces,
+                                  field_selector=f'spec.nodeName={self.host_node_name}')
 
         containers = []
         for pod in pods_here:
-            containers += pod.status.container_statuses
+            # pending pods have no container statuses yet
+            containers += pod.status.container_statuses or []
 
         return containers
 
-    def count_images_in_this_host(self):
-        return len(self.get_node_info().status.images)
+    def count_images_in_this_host(self, node_info=None):
+        return len(self._get_node_info(node_info).status.images)
 
-    def get_version(self):
-        return self.get_node_info().status.node_info.kubelet_version
+    def get_version(self, node_info=None):
+        return self._get_node_info(node_info).status.node_info.kubelet_version
 
     def get_current_container_id(self) -> str:
         # TODO
@@ -343,7 +401,9 @@ class Docker(ContainerRuntime):
 
     def __init__(self, logging):
         super().__init__(logging)
-        self.client = docker.from_env()
+        self.client = docker.from_env(max_pool_size=DOCKER_MAX_POOL_SIZE)
+        accounting.instrument_docker(self.client)
+        mutation_limiter.instrument_docker(self.client)
         self.minimum_version = 18
         self.lost_quorum_hint = 'possible that too few managers are online'
         self.credentials_manager_component = utils.compose_project_name + "-compute-api"
@@ -351,8 +411,19 @@ class Docker(ContainerRuntime):
         self.orchestrator = 'docker'
         self.agent_dns = utils.compose_project_name + "-agent"
         self.my_component_name = utils.compose_project_name + '-system-manager'
+        self.components = ComponentRegistry(self)
         self.dg_encrypt_options = self.load_data_gateway_network_options()
 
+    def set_max_pool_size(self, size: int):
+        """ Resizes the pool of connections to the Docker socket. The pool is created again, on the next request
+
+        :param size: connections to keep alive
+        """
+        adapter = self.client.api._custom_adapter
+        if adapter.max_pool_size != size:
+            adapter.max_pool_size = size
+            adapter.pools.clear()
+
     def load_data_gateway_network_options(self) -> dict:
         """
         Loads the Data Gateway options from disk first, and then from env.
@@ -390,8 +461,40 @@ class Docker(ContainerRuntime):
         """
         return self.client.networks.get(name)
 
+    def list_containers(self, filters: dict = None, all: bool = False) -> list:
+        """
+        Lists containers with a single call to /containers/json, without inspecting each one of them (unlike
+        client.containers.list, which inspects every listed container)
+
+        The resulting container objects are built from the container summaries, so their attrs are partial (Id,
+        Names, State, Status, Labels, HostConfig.NetworkMode, NetworkSettings, ...). Use reload() on the containers
+        that need a full inspect
+
+        :param filters: Docker filters
+        :param all: whether to include containers that are not running
+        :return: list of Docker Container objects
+        """
+        return [self.container_from_summary(summary)
+                for summary in self.client.api.containers(all=all, filters=filters)]
+
+    def container_from_summary(self, summary: dict) -> object:
+        """
+        Converts a container summary (from /containers/json) into a Docker Container object, making sure the name and
+        labels are accessible the same way as in inspected containers
+
+        :param summary: container summary
+        :return: Docker Container object
+        """
+        attrs = dict(summary)
+        names = summary.get('Names')
+        if names:
+            attrs['Name'] = names[0]
+
+        attrs['Config'] = {'Labels': summary.get('Labels') or {}}
+        return self.client.containers.prepare_model(attrs)
+
     def list_internal_components(self, base_label=utils.base_label):
-        return self.client.containers.list(filters={"label": base_label})
+        return self.list_containers(filters={"label": base_label})
 
     def fetch_container_logs(self, component, since, tail=30):
         # component = container object
@@ -409,11 +512,11 @@ class Docker(ContainerRuntime):
     def get_node_info(self):
         return self.client.info()
 
-    def get_ram_capacity(self):
-        return self.get_node_info()['MemTotal']/1024/1024
+    def get_ram_capacity(self, node_info=None):
+        return self._get_node_info(node_info)['MemTotal']/1024/1024
 
-    def is_version_compatible(self):
-        docker_major_version = int(self.get_version())
+    def is_version_compatible(self, node_info=None):
+        docker_major_version = int(self.get_version(node_info))
 
         if docker_major_version < self.minimum_version:
             self.logging.error("Your Docker version is too old: {}. MIN REQUIREMENTS: Docker {} or newer"
@@ -422,11 +525,12 @@ class Docker(ContainerRuntime):
 
         return True
 
-    def is_coe_enabled(self, check_local_node_state=False):
-        if not self.client.info()['Swarm'].get('NodeID'):
+    def is_coe_enabled(self, check_local_node_state=False, node_info=None):
+        swarm_info = self._get_node_info(node_info).get('Swarm', {})
+        if not swarm_info.get('NodeID'):
             return False
 
-        if self.get_node_info().get('Swarm', {}).get('LocalNodeState', 'inactive').lower() == "inactive":
+        if swarm_info.get('LocalNodeState', 'inactive').lower() == "inactive":
             return False
 
         return True
@@ -435,14 +539,15 @@ class Docker(ContainerRuntime):
         on_stop_container_name = utils.compose_project_name + "-on-stop"
 
         try:
-            container = self.client.containers.get(on_stop_container_name)
-        except docker.errors.NotFound:
-            # default to dev image
-            return 'nuvladev/on-stop:main'
+            container = self.components.get_container(ComponentRegistry.ON_STOP)
         except Exception as e:
             self.logging.error(f"Unable to search for container {on_stop_container_name}. Reason: {str(e)}")
             return None
 
+        if not container:
+            # default to dev image
+            return 'nuvladev/on-stop:main'
+
         try:
             if container.status.lower() == "paused":
                 return container.attrs['Config']['Image']
@@ -471,7 +576,13 @@ class Docker(ContainerRuntime):
         except Exception as e:
             self.logging.debug(f'Failed to get container id from hostname: {e}')
 
-    def get_current_container(self):
+    def find_current_container(self):
+        """ Finds the container of the system manager, based on the hostname, cpuset or cgroup
+
+        This is costly, so it should only be used to resolve the system manager in the component registry
+
+        :return: container object
+        """
         get_id_functions = [self._get_container_id_from_hostname,
                             self._get_container_id_from_cpuset,
                             self._get_container_id_from_cgroup]
@@ -486,8 +597,19 @@ class Docker(ContainerRuntime):
                 self.logging.debug(f'No container id found for "{get_id_function.__name__}"')
         raise RuntimeError('Failed to get current container')
 
+    def get_current_container(self):
+        container = self.components.get_container(ComponentRegistry.SYSTEM_MANAGER)
+        if not container:
+            raise RuntimeError('Failed to get current container')
+
+        return container
+
     def get_current_container_id(self) -> str:
-        return self.get_current_container().id
+        container_id = self.components.get_id(ComponentRegistry.SYSTEM_MANAGER)
+        if not container_id:
+            raise RuntimeError('Failed to get current container')
+
+        return container_id
 
     @staticmethod
     def get_compose_project_name_from_labels(labels, default='nuvlaedge'):
@@ -531,14 +653,14 @@ class Docker(ContainerRuntime):
                                    },
                                    detach=True)
 
-    def get_node_id(self):
-        return self.get_node_info().get("Swarm", {}).get("NodeID")
+    def get_node_id(self, node_info=None):
+        return self._get_node_info(node_info).get("Swarm", {}).get("NodeID")
 
     def list_nodes(self, optional_filter={}):
         return self.client.nodes.list(filters=optional_filter)
 
-    def get_cluster_managers(self):
-        remote_managers = self.get_node_info().get('Swarm', {}).get('RemoteManagers')
+    def get_cluster_managers(self, node_info=None):
+        remote_managers = self._get_node_info(node_info).get('Swarm', {}).get('RemoteManagers')
         cluster_managers = []
         if remote_managers and isinstance(remote_managers, list):
             cluster_managers = [rm.get('NodeID') for rm in remote_managers]
@@ -590,51 +712,116 @@ class Docker(ContainerRuntime):
 
     def restart_credentials_manager(self):
         try:
-            self.client.api.restart(self.credentials_manager_component, timeout=30)
+            credentials_manager = self.components.get_id(ComponentRegistry.CREDENTIALS_MANAGER) or \
+                                  self.credentials_manager_component
+            self.client.api.restart(credentials_manager, timeout=30)
         except docker.errors.NotFound:
             self.logging.exception(f"Container {self.credentials_manager_component} is not running. Nothing to do...")
 
     def find_nuvlaedge_agent_container(self):
         try:
-            current_container = self.get_current_container()
-            project_name = self.get_compose_project_name_from_labels(current_container.labels)
+            # the agent is searched within the same compose project as this container
+            self.get_current_container_id()
         except Exception as e:
             self.logging.warning(f'Failed to get current container. Cannot find agent container. {e}')
             return None, 'Cannot find Agent container'
 
-        filters = {'label': ['nuvlaedge.component=True',
-                             'com.docker.compose.service=agent',
-                             f'com.docker.compose.project={project_name}']}
-        try:
-            return self.client.containers.list(filters=filters)[0], None
-        except IndexError:
+        agent_container = self.components.get_container(ComponentRegistry.AGENT)
+        # the agent is looked up by its (cached) ID, whatever its state: a stopped agent is as good as gone
+        if not agent_container or agent_container.status != 'running':
             message = 'Agent container not found'
             self.logging.warning(message)
             return None, message
 
+        return agent_container, None
+
     def list_all_containers_in_this_node(self):
-        return self.client.containers.list(all=True)
+        return self.list_containers(all=True)
 
-    def count_images_in_this_host(self):
-        return self.get_node_info().get("Images")
+    def count_images_in_this_host(self, node_info=None):
+        return self._get_node_info(node_info).get("Images")
 
-    def get_version(self):
+    def get_version(self, node_info=None):
         return self.client.version()["Components"][0]["Version"].split(".")[0].replace('v', '')
 
 
+def docker_pool_size(workers: int, healer_workers: int) -> int:
+    """ Connections to keep alive to the Docker socket, so that no concurrent path has to open its own
+
+    :param workers: checks running concurrently
+    :param healer_workers: containers healed in parallel
+    :return: pool size, at least DOCKER_MAX_POOL_SIZE
+    """
+    return max(DOCKER_MAX_POOL_SIZE, workers + healer_workers + DOCKER_STREAMS)
+
+
+class NodeInfoSnapshot:
+    """ Snapshot of the node info reported by the container runtime (Docker /info or the k8s Node)
+
+    The node info is fetched at most once until the snapshot is invalidated, so that all the checks in a supervision
+    cycle can share it instead of querying the container runtime over and over again
+    """
+
+    def __init__(self, container_runtime: ContainerRuntime):
+        self.container_runtime = container_runtime
+        self.fetch_count = 0
+        self._node_info = None
+        self._valid = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        """ Returns the node info, fetching it only if the snapshot is not valid
+
+        :return: node info, as returned by container_runtime.get_node_info()
+        """
+        with self._lock:
+            if not self._valid:
+                self._node_info = self.container_runtime.get_node_info()
+                self._valid = True
+                self.fetch_count += 1
+
+            return self._node_info
+
+    def invalidate(self):
+        """ Forces the next get() to fetch the node info again """
+        with self._lock:
+            self._valid = False
+
+
 # --------------------
+_container_runtime = None
+_container_runtime_lock = threading.Lock()
+
+
+def get_container_runtime(logging, docker_socket_file: str = DOCKER_SOCKET_FILE) -> ContainerRuntime:
+    """ Returns the container runtime shared by the whole process, creating it on the first call
+
+    This way, there is only one client (and one pool of connections) to the container runtime, no matter how many
+    classes need it
+
+    :param logging: logger to be used by the container runtime, if it has to be created
+    :param docker_socket_file: path to the Docker socket
+    :return: Kubernetes or Docker container runtime
+    """
+    global _container_runtime
+
+    with _container_runtime_lock:
+        if _container_runtime is None:
+            if ORCHESTRATOR == 'kubernetes':
+                _container_runtime = Kubernetes(logging)
+            elif os.path.exists(docker_socket_file):
+                _container_runtime = Docker(logging)
+            else:
+                raise Exception(f'Orchestrator is "{ORCHESTRATOR}", but file {docker_socket_file} is not present')
+
+        return _container_runtime
+
+
 class Containers:
     """ Common set of methods and variables for the NuvlaEdge system-manager
     """
     def __init__(self, logging):
-        """ Constructs an Container object
+        """ Constructs an Container object, with the container runtime shared by the whole process
         """
-        self.docker_socket_file = '/var/run/docker.sock'
-
-        if ORCHESTRATOR == 'kubernetes':
-            self.container_runtime = Kubernetes(logging)
-        else:
-            if os.path.exists(self.docker_socket_file):
-                self.container_runtime = Docker(logging)
-            else:
-                raise Exception(f'Orchestrator is "{ORCHESTRATOR}", but file {self.docker_socket_file} is not present')
+        self.docker_socket_file = DOCKER_SOCKET_FILE
+        self.container_runtime = get_container_runtime(logging, self.docker_socket_file)
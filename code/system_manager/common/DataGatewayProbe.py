@@ -0,0 +1,134 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+
+""" Active health probe of the Data Gateway
+
+Every probe connects to the Data Gateway over MQTT, subscribes to a reserved topic, publishes on it and waits for its
+own message to come back. Both the connection and the round trip are timed, and kept in a window of recent samples
+from which percentiles are computed, so that a wedged or overloaded broker shows up even when it still accepts TCP
+connections
+"""
+
+import itertools
+import logging
+import math
+import socket
+import time
+from collections import deque
+from typing import Dict, Union
+
+import system_manager.common.Metrics as metrics
+from system_manager.common.Mqtt import MqttClient, MqttError
+
+# reserved topic, under which every probe publishes to itself
+PROBE_TOPIC = 'nuvlaedge/system-manager/probe'
+
+PROBE_OK = 'ok'
+# the broker could not be resolved: the system manager is not on its network, which says nothing about the broker
+PROBE_UNREACHABLE = 'unreachable'
+PROBE_FAILED = 'failed'
+
+
+class LatencyWindow:
+    """ Most recent latency samples """
+
+    def __init__(self, size: int = 100):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Union[float, None]:
+        """ Nearest-rank percentile
+
+        :param p: between 0 and 100
+        :return: seconds, or None if there are no samples
+        """
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    def summary(self) -> Dict[str, float]:
+        """ Median, 95th and 99th percentiles, in milliseconds """
+        if not self.samples:
+            return {}
+        return {f'p{p}': round(self.percentile(p) * 1000, 1) for p in (50, 95, 99)}
+
+
+class DataGatewayProbe:
+    """ Publish/subscribe round trips to the Data Gateway """
+
+    def __init__(self, host: str, port: int = 1883, timeout: float = 2, window: int = 100):
+        """ Constructs the probe
+
+        :param host: Data Gateway host name
+        :param port: Data Gateway MQTT port
+        :param timeout: seconds to wait for the connection, and then for the message to come back
+        :param window: number of samples kept for the percentiles
+        """
+        self.log = logging.getLogger(__name__)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connect_latency = LatencyWindow(window)
+        self.round_trip_latency = LatencyWindow(window)
+        self.last_result = None
+        self.last_error = None
+        self._sequence = itertools.count()
+
+    def run(self) -> str:
+        """ Probes the Data Gateway once
+
+        :return: PROBE_OK, PROBE_UNREACHABLE or PROBE_FAILED
+        """
+        client = MqttClient(self.host, self.port, timeout=self.timeout)
+        topic = f'{PROBE_TOPIC}/{client.client_id}'
+        payload = f'{next(self._sequence)} {time.time()}'.encode()
+        self.last_error = None
+        try:
+            start = time.perf_counter()
+            client.connect()
+            connected = time.perf_counter()
+
+            client.subscribe(topic)
+            sent = time.perf_counter()
+            client.publish(topic, payload)
+            deadline = sent + self.timeout
+            while True:
+                message = client.receive(max(0.0, deadline - time.perf_counter()))
+                if message is None:
+                    raise socket.timeout(f'Probe message did not come back within {self.timeout} seconds')
+                if message == (topic, payload):
+                    break
+            received = time.perf_counter()
+        except socket.gaierror as e:
+            self.last_error = str(e)
+            return self._result(PROBE_UNREACHABLE)
+        except (OSError, MqttError) as e:
+            self.last_error = str(e) or type(e).__name__
+            return self._result(PROBE_FAILED)
+        finally:
+            client.close()
+
+        self.connect_latency.add(connected - start)
+        self.round_trip_latency.add(received - sent)
+        metrics.data_gateway_connect.observe(connected - start)
+        metrics.data_gateway_round_trip.observe(received - sent)
+        return self._result(PROBE_OK)
+
+    def _result(self, result: str) -> str:
+        self.last_result = result
+        metrics.data_gateway_probes.inc(result=result)
+        if result != PROBE_OK:
+            self.log.debug(f'Data Gateway probe {result}: {self.last_error}')
+        return result
+
+    def summary(self) -> str:
+        """ Latency percentiles, e.g. "connect p50 1.2 ms, p95 3.4 ms, ... round trip p50 ..." """
+        parts = []
+        for name, window in [('connect', self.connect_latency), ('round trip', self.round_trip_latency)]:
+            stats = window.summary()
+            if stats:
+                parts.append(f'{name} ' + ', '.join(f'{p} {ms} ms' for p, ms in stats.items()))
+        return '; '.join(parts) or 'no samples'
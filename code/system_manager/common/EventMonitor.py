@@ -0,0 +1,143 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+
+""" Background consumer of the Docker events stream, used to wake up the supervision loop as soon as a NuvlaEdge
+container dies or loses its network """
+
+import logging
+import threading
+from typing import Callable
+
+import system_manager.common.Metrics as metrics
+from system_manager.common import utils
+
+
+class DockerEventFilter:
+    """ Selects the Docker events that concern the NuvlaEdge containers and networks
+
+    The stream is filtered by the daemon on the event type and action. Since network events do not carry the labels
+    of the containers they refer to, the label filtering (compose project and nuvlaedge.component=True) is done here.
+    """
+
+    container_actions = ['die', 'oom', 'destroy']
+    network_actions = ['disconnect', 'destroy']
+
+    def __init__(self, project_name: str):
+        """ Constructs the filter
+
+        :param project_name: Docker Compose project name of the NuvlaEdge
+        """
+        self.project_label = f'com.docker.compose.project={project_name}'
+        self.network_prefixes = (f'{project_name}_', utils.nuvlaedge_shared_net, utils.data_gateway_node_net)
+
+    @property
+    def filters(self) -> dict:
+        return {
+            'type': ['container', 'network'],
+            'event': list(set(self.container_actions + self.network_actions))
+        }
+
+    def is_relevant(self, event: dict) -> bool:
+        """ Checks whether an event concerns a NuvlaEdge container or network
+
+        :param event: decoded Docker event
+        :return: bool
+        """
+        event_type = event.get('Type')
+        action = event.get('Action', '')
+        attributes = event.get('Actor', {}).get('Attributes', {})
+
+        if event_type == 'container' and action in self.container_actions:
+            labels = {f'{k}={v}' for k, v in attributes.items()}
+            return utils.base_label in labels or self.project_label in labels
+
+        if event_type == 'network' and action in self.network_actions:
+            return attributes.get('name', '').startswith(self.network_prefixes)
+
+        return False
+
+
+class DockerEventMonitor(DockerEventFilter, threading.Thread):
+    """ Consumes the Docker /events stream and notifies the supervisor about relevant changes in the NuvlaEdge
+    containers and networks.
+
+    Whenever the connection to the daemon is lost (e.g. the daemon restarted), the monitor reconnects and asks for a
+    full resync, since events might have been missed in the meantime.
+    """
+
+    def __init__(self, container_runtime, project_name: str,
+                 on_change: Callable[[dict], None],
+                 on_resync: Callable[[], None],
+                 reconnect_interval: float = 5):
+        """ Constructs the monitor
+
+        :param container_runtime: Docker container runtime
+        :param project_name: Docker Compose project name of the NuvlaEdge
+        :param on_change: called with the raw event, for every relevant event
+        :param on_resync: called whenever the stream (re)connects after a failure
+        :param reconnect_interval: seconds to wait before reconnecting to the daemon
+        """
+        DockerEventFilter.__init__(self, project_name)
+        threading.Thread.__init__(self, name='docker-events-monitor', daemon=True)
+        self.log = logging.getLogger(__name__)
+        self.container_runtime = container_runtime
+        self.on_change = on_change
+        self.on_resync = on_resync
+        self.reconnect_interval = reconnect_interval
+        self.events_received = 0
+        self.reconnections = 0
+        self._stream = None
+        self._stopped = threading.Event()
+
+    def handle_event(self, event: dict) -> None:
+        if not self.is_relevant(event):
+            return
+
+        self.events_received += 1
+        metrics.docker_events.inc(type=event.get('Type'), action=event.get('Action'))
+        self.log.debug(f'Docker event {event.get("Type")}/{event.get("Action")} '
+                       f'for {event.get("Actor", {}).get("ID")}')
+        self.on_change(event)
+
+    def consume(self, resync: bool = False) -> None:
+        """ Blocks while consuming the events stream, until it breaks or the monitor is stopped
+
+        :param resync: whether to request a full resync once connected
+        """
+        self._stream = stream = self.container_runtime.client.events(decode=True, filters=self.filters)
+        if resync:
+            # we might have missed events while disconnected, so the whole state must be re-read
+            self.reconnections += 1
+            self.log.info('Reconnected to the Docker events stream. Requesting full resync')
+            self.on_resync()
+
+        try:
+            for event in stream:
+                if self._stopped.is_set():
+                    break
+                self.handle_event(event)
+        finally:
+            stream.close()
+            self._stream = None
+
+    def run(self) -> None:
+        resync = False
+        while not self._stopped.is_set():
+            try:
+                self.consume(resync)
+            except Exception as e:
+                if self._stopped.is_set():
+                    break
+                self.log.warning(f'Lost connection to the Docker events stream: {str(e)}')
+
+            resync = True
+            self._stopped.wait(self.reconnect_interval)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        stream = self._stream
+        if stream:
+            try:
+                stream.close()
+            except Exception as e:
+                self.log.debug(f'Error while closing the Docker events stream: {str(e)}')
@@ -0,0 +1,245 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+
+""" Minimal Prometheus instrumentation for the system manager: counters, gauges and histograms, rendered in the
+Prometheus text exposition format and served over HTTP
+
+Deliberately small, to avoid yet another dependency on the NuvlaEdge devices
+"""
+
+import logging
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+
+    def escape(v):
+        return str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+
+class Metric:
+    """ Base class of all the metrics: a family of values, one per combination of label values """
+
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        """ Constructs the metric
+
+        :param name: metric name
+        :param documentation: help text
+        :param labelnames: names of the labels. Every update must give a value for each of them
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """ Current samples, as (name, labels, value) """
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.type}']
+        lines += [f'{name}{format_labels(labels)} {format_value(value)}' for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if amount < 0:
+            raise ValueError('Counters can only increase')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    default_buckets = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = default_buckets):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+            return counts[-1]
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                samples += [(f'{self.name}_bucket', {**labels, 'le': format_value(bound)}, count)
+                            for bound, count in zip(self.buckets, counts)]
+                samples += [(f'{self.name}_sum', labels, total),
+                            (f'{self.name}_count', labels, counts[-1])]
+        return samples
+
+
+class Registry:
+    """ Set of metrics to be exposed together """
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f'Metric {metric.name} already registered')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(m.render() for m in self.metrics.values()) + '\n'
+
+
+registry = Registry()
+
+# the system manager's own metrics
+check_duration = registry.register(
+    Histogram('nuvlaedge_sm_check_duration_seconds', 'Duration of the supervision checks', ['check']))
+restarts_scheduled = registry.register(
+    Counter('nuvlaedge_sm_container_restarts_scheduled_total', 'Restarts scheduled by the healer', ['container']))
+restarts_performed = registry.register(
+    Counter('nuvlaedge_sm_container_restarts_total', 'Restarts performed by the healer', ['container', 'result']))
+crash_loops = registry.register(
+    Counter('nuvlaedge_sm_container_crash_loops_total', 'Containers no longer restarted because they kept crashing',
+            ['container']))
+restarts_pending = registry.register(
+    Gauge('nuvlaedge_sm_container_restarts_pending', 'Restarts scheduled by the healer and not performed yet'))
+mutations_queued = registry.register(
+    Gauge('nuvlaedge_sm_docker_mutations_queued', 'Mutating Docker calls waiting for the rate limiter', ['priority']))
+mutation_wait = registry.register(
+    Histogram('nuvlaedge_sm_docker_mutation_wait_seconds', 'Time mutating Docker calls waited for the rate limiter',
+              ['priority'], buckets=(0, .01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)))
+runtime_latency = registry.register(
+    Gauge('nuvlaedge_sm_runtime_latency_seconds', 'Smoothed latency of the container runtime API'))
+backpressure_level = registry.register(
+    Gauge('nuvlaedge_sm_backpressure_level', 'Backpressure from the container runtime (0 normal, 1 slow, 2 overloaded)'))
+data_gateway_ready = registry.register(
+    Histogram('nuvlaedge_sm_data_gateway_ready_seconds',
+              'Time from creating the first Data Gateway resource until it accepts MQTT connections',
+              ['mode'], buckets=(1, 2.5, 5, 10, 15, 30, 45, 60, 90, 120, 300)))
+data_gateway_probes = registry.register(
+    Counter('nuvlaedge_sm_data_gateway_probes_total', 'MQTT probes of the Data Gateway, by result', ['result']))
+data_gateway_connect = registry.register(
+    Histogram('nuvlaedge_sm_data_gateway_connect_seconds', 'Time for the Data Gateway to accept an MQTT connection',
+              buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2)))
+data_gateway_round_trip = registry.register(
+    Histogram('nuvlaedge_sm_data_gateway_round_trip_seconds',
+              'Time for a message published to the Data Gateway to come back to its subscriber',
+              buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2)))
+data_gateway_load = registry.register(
+    Gauge('nuvlaedge_sm_data_gateway_load', 'Load of the Data Gateway broker, from its $SYS topics', ['stat']))
+network_reconnects = registry.register(
+    Counter('nuvlaedge_sm_network_reconnects_total', 'Containers reconnected to their original network',
+            ['container', 'result']))
+docker_events = registry.register(
+    Counter('nuvlaedge_sm_docker_events_total', 'Relevant Docker events received', ['type', 'action']))
+status_transitions = registry.register(
+    Counter('nuvlaedge_sm_status_transitions_total', 'Changes of the operational status',
+            ['from_status', 'to_status']))
+operational_status = registry.register(
+    Gauge('nuvlaedge_sm_operational_status', 'Current operational status (1 for the current one)', ['status']))
+certificate_days_left = registry.register(
+    Gauge('nuvlaedge_sm_certificate_days_left', 'Days until the API certificates expire', ['file']))
+status_writes = registry.register(
+    Counter('nuvlaedge_sm_status_writes_total', 'Writes of the operational status files, by result', ['result']))
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'NuvlaEdgeSystemManager'
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(f'{self.address_string()} - {format % args}')
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ['/metrics', '/metrics/']:
+            self.send_error(404, 'Not found. Try /metrics')
+            return
+
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(address: str, metrics_registry: Registry = registry) -> ThreadingHTTPServer:
+    """ Serves the metrics on /metrics, in a background thread
+
+    :param address: [HOST:]PORT. HOST defaults to 127.0.0.1, as the metrics are not authenticated
+    :param metrics_registry: metrics to serve
+    :return: the running server
+    """
+    host, _, port = str(address).rpartition(':')
+    host = host or '127.0.0.1'
+    server = ThreadingHTTPServer((host, int(port)), MetricsRequestHandler)
+    server.daemon_threads = True
+    server.registry = metrics_registry
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.getLogger(__name__).info(f'Serving Prometheus metrics on {host}:{server.server_port}/metrics')
+    return server
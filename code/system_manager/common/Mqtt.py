@@ -0,0 +1,237 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+
+""" Minimal MQTT 3.1.1 client, to probe the Data Gateway (an MQTT broker) without depending on a full MQTT library
+
+Only what the probes need is implemented: connecting, publishing and subscribing with QoS 0, and pinging. There is no
+reconnection, no QoS 1 or 2 and no background thread: the caller drives the connection
+"""
+
+import itertools
+import select
+import socket
+import struct
+import time
+from typing import Tuple, Union
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+SUBSCRIBE = 0x82
+SUBACK = 0x90
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+CONNACK_ERRORS = {1: 'unacceptable protocol version', 2: 'identifier rejected', 3: 'server unavailable',
+                  4: 'bad user name or password', 5: 'not authorized'}
+
+_client_ids = itertools.count()
+
+
+class MqttError(Exception):
+    pass
+
+
+def encode_length(length: int) -> bytes:
+    """ Encodes the remaining length of a packet, 7 bits per byte """
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(value: Union[str, bytes]) -> bytes:
+    data = value.encode() if isinstance(value, str) else value
+    return struct.pack('!H', len(data)) + data
+
+
+def packet(packet_type: int, body: bytes = b'') -> bytes:
+    return bytes([packet_type]) + encode_length(len(body)) + body
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """ Whether a topic matches a subscription filter, with + and # wildcards. Topics starting with $ only match
+    filters that start with $ as well
+    """
+    if topic.startswith('$') and not topic_filter.startswith('$'):
+        return False
+
+    filter_levels = topic_filter.split('/')
+    levels = topic.split('/')
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(levels) or (level != '+' and level != levels[i]):
+            return False
+
+    return len(filter_levels) == len(levels)
+
+
+class MqttClient:
+    """ Blocking MQTT client over a single TCP connection """
+
+    def __init__(self, host: str, port: int = 1883, client_id: str = None, timeout: float = 5, keepalive: int = 30):
+        """ Constructs the client. Nothing is sent until connect()
+
+        :param host: broker host name or address
+        :param port: broker port
+        :param client_id: MQTT client identifier. Unique per process by default
+        :param timeout: seconds to wait for the broker to answer
+        :param keepalive: seconds the broker waits for a packet before closing the connection
+        """
+        self.host = host
+        self.port = port
+        self.client_id = client_id or f'nuvlaedge-sm-{socket.gethostname()}-{next(_client_ids)}'
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.sock = None
+        self._packet_ids = itertools.count(1)
+        self._buffer = b''
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def connect(self) -> None:
+        """ Opens the connection and waits for the broker to accept it
+
+        :raises MqttError: if the broker refuses the connection
+        :raises OSError: if the broker cannot be reached or does not answer in time
+        """
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # protocol name and level, clean session, keep alive
+        self.sock.sendall(packet(CONNECT, encode_string('MQTT') + struct.pack('!BBH', 4, 0x02, self.keepalive)
+                                 + encode_string(self.client_id)))
+        packet_type, body = self._expect(CONNACK)
+        if len(body) < 2 or body[1] != 0:
+            code = body[1] if len(body) > 1 else None
+            self.close()
+            raise MqttError(f'Connection refused: {CONNACK_ERRORS.get(code, code)}')
+
+    def publish(self, topic: str, payload: Union[str, bytes] = b'') -> None:
+        data = payload.encode() if isinstance(payload, str) else payload
+        self.sock.sendall(packet(PUBLISH, encode_string(topic) + data))
+
+    def subscribe(self, *topic_filters: str) -> None:
+        """ Subscribes to topics, with QoS 0, and waits for the broker to acknowledge it
+
+        :raises MqttError: if the broker rejects any of the subscriptions
+        """
+        packet_id = next(self._packet_ids) % 65536 or 1
+        body = struct.pack('!H', packet_id) + b''.join(encode_string(t) + b'\x00' for t in topic_filters)
+        self.sock.sendall(packet(SUBSCRIBE, body))
+        _, ack = self._expect(SUBACK)
+        if 0x80 in ack[2:]:
+            raise MqttError(f'Subscription refused: {", ".join(topic_filters)}')
+
+    def ping(self) -> float:
+        """ Pings the broker
+
+        :return: seconds it took to answer
+        """
+        start = time.perf_counter()
+        self.sock.sendall(packet(PINGREQ))
+        self._expect(PINGRESP)
+        return time.perf_counter() - start
+
+    def receive(self, timeout: float = None) -> Union[Tuple[str, bytes], None]:
+        """ Waits for a message on the subscribed topics. Other packets are discarded
+
+        :param timeout: seconds to wait. Defaults to the client's timeout
+        :return: (topic, payload), or None if nothing was received in time
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while True:
+            received = self._read_packet(deadline)
+            if received is None:
+                return None
+
+            packet_type, body = received
+            if packet_type & 0xF0 == PUBLISH:
+                topic_length = struct.unpack('!H', body[:2])[0]
+                topic = body[2:2 + topic_length].decode(errors='replace')
+                # QoS 1 and 2 messages have a packet identifier, which is not used
+                offset = 2 + topic_length + (2 if packet_type & 0x06 else 0)
+                return topic, body[offset:]
+
+    def close(self) -> None:
+        if not self.sock:
+            return
+        try:
+            self.sock.sendall(packet(DISCONNECT))
+        except OSError:
+            pass
+        finally:
+            self.sock.close()
+            self.sock = None
+            self._buffer = b''
+
+    def _expect(self, expected_type: int) -> Tuple[int, bytes]:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            received = self._read_packet(deadline)
+            if received is None:
+                raise socket.timeout(f'No answer from the MQTT broker at {self.host}:{self.port}')
+            if received[0] & 0xF0 == expected_type & 0xF0:
+                return received
+
+    def _fill(self, size: int, deadline: float) -> bool:
+        """ Reads from the socket until the buffer has at least size bytes, or until the deadline
+
+        :return: False if the deadline passed
+        """
+        while len(self._buffer) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.sock], [], [], remaining)[0]:
+                return False
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError(f'MQTT broker at {self.host}:{self.port} closed the connection')
+            self._buffer += data
+        return True
+
+    def _read_packet(self, deadline: float) -> Union[Tuple[int, bytes], None]:
+        # fixed header, then up to 4 bytes of remaining length
+        if not self._fill(2, deadline):
+            return None
+
+        length, multiplier, offset = 0, 1, 1
+        while True:
+            if not self._fill(offset + 1, deadline):
+                return None
+            byte = self._buffer[offset]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            offset += 1
+            if not byte & 0x80:
+                break
+            if offset > 4:
+                raise MqttError('Malformed packet length')
+
+        if not self._fill(offset + length, deadline):
+            return None
+
+        packet_type, body = self._buffer[0], self._buffer[offset:offset + length]
+        self._buffer = self._buffer[offset + length:]
+        return packet_type, body
+
+
+def is_broker_ready(host: str, port: int = 1883, timeout: float = 2) -> bool:
+    """ Whether an MQTT broker accepts connections
+
+    :param host: broker host name or address
+    :param port: broker port
+    :param timeout: seconds to wait for the broker
+    """
+    try:
+        with MqttClient(host, port, timeout=timeout):
+            return True
+    except (OSError, MqttError):
+        return False
@@ -0,0 +1,225 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+
+""" Rate limiting of the calls that change the state of the Docker daemon (restarts, connects, removals, service
+updates, etc.), so that a cascade of failures does not make an already struggling daemon worse
+
+All the mutating calls share a single token bucket. When it is empty, callers queue by priority class (agent and data
+gateway first) and then by arrival order
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, List
+
+import system_manager.common.Metrics as metrics
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITY_NAMES = {PRIORITY_HIGH: 'high', PRIORITY_NORMAL: 'normal', PRIORITY_LOW: 'low'}
+
+# mutating calls per second, on average, and how many can be made at once. A rate of 0 disables the limiter
+MUTATION_RATE = float(os.getenv('NUVLAEDGE_SM_MUTATION_RATE', 5))
+MUTATION_BURST = int(os.getenv('NUVLAEDGE_SM_MUTATION_BURST', 10))
+
+_mutating_methods = ('POST', 'PUT', 'PATCH', 'DELETE')
+# long-lived calls, which do not change the state of the daemon
+_not_mutating = ('/wait', '/attach', '/logs')
+
+_priority = contextvars.ContextVar('mutation_priority', default=PRIORITY_NORMAL)
+
+
+def is_mutating(method: str, url: str) -> bool:
+    return method.upper() in _mutating_methods and not url.split('?')[0].endswith(_not_mutating)
+
+
+class MutationLimiter:
+    """ Token bucket shared by all the mutating calls, with a queue of waiters ordered by priority class """
+
+    def __init__(self, rate: float = MUTATION_RATE, burst: int = MUTATION_BURST, max_wait: float = 30,
+                 clock: Callable[[], float] = time.monotonic):
+        """ Constructs the limiter
+
+        :param rate: tokens added to the bucket per second. 0 disables the limiter
+        :param burst: size of the bucket
+        :param max_wait: seconds after which a call goes through anyway, rather than failing
+        :param clock: monotonic clock
+        """
+        self.log = logging.getLogger(__name__)
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_wait = max_wait
+        self.clock = clock
+        self.tokens = float(self.burst)
+        self._updated = clock()
+        self._waiters: List[list] = []
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    @contextmanager
+    def priority(self, level: int):
+        """ Context manager giving a priority class to the mutating calls made within it, in this thread or task
+
+        :param level: PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW
+        """
+        token = _priority.set(level)
+        try:
+            yield
+        finally:
+            _priority.reset(token)
+
+    def queue_depth(self) -> int:
+        with self._condition:
+            return sum(1 for w in self._waiters if not w[-1])
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _enqueue(self, level: int) -> list:
+        # [priority, arrival, cancelled]
+        waiter = [level, next(self._seq), False]
+        with self._condition:
+            heapq.heappush(self._waiters, waiter)
+            self._update_depth(level)
+        return waiter
+
+    def _try_take(self, waiter: list) -> float:
+        """ Takes a token for the waiter, if it is its turn and there is one
+
+        :return: 0 if taken, otherwise seconds to wait before trying again
+        """
+        while self._waiters and self._waiters[0][-1]:
+            heapq.heappop(self._waiters)
+
+        self._refill()
+        if self._waiters and self._waiters[0] is waiter and self.tokens >= 1:
+            heapq.heappop(self._waiters)
+            self.tokens -= 1
+            self._update_depth(waiter[0])
+            return 0
+
+        return max(0.005, (1 - self.tokens) / self.rate)
+
+    def _give_up(self, waiter: list) -> None:
+        waiter[-1] = True
+        self._update_depth(waiter[0])
+
+    def _update_depth(self, level: int) -> None:
+        depth = sum(1 for w in self._waiters if w[0] == level and not w[-1])
+        metrics.mutations_queued.set(depth, priority=PRIORITY_NAMES.get(level, str(level)))
+
+    def _account(self, level: int, waited: float) -> None:
+        metrics.mutation_wait.observe(waited, priority=PRIORITY_NAMES.get(level, str(level)))
+        if waited >= self.max_wait:
+            self.log.warning(f'Mutating call waited {waited:.1f} seconds for the rate limiter. Letting it through')
+
+    def acquire(self, level: int = None) -> float:
+        """ Waits for a token, blocking the calling thread
+
+        :param level: priority class. Defaults to the one of the current context
+        :return: seconds waited
+        """
+        if not self.enabled:
+            return 0
+
+        level = _priority.get() if level is None else level
+        start = self.clock()
+        waiter = self._enqueue(level)
+        with self._condition:
+            while True:
+                delay = self._try_take(waiter)
+                waited = self.clock() - start
+                if delay == 0:
+                    # the next one in the queue might be able to go too
+                    self._condition.notify_all()
+                    break
+                if waited >= self.max_wait:
+                    self._give_up(waiter)
+                    self._condition.notify_all()
+                    break
+                self._condition.wait(min(delay, self.max_wait - waited))
+
+        self._account(level, waited)
+        return waited
+
+    async def acquire_async(self, level: int = None) -> float:
+        """ Waits for a token, without blocking the event loop
+
+        :param level: priority class. Defaults to the one of the current context
+        :return: seconds waited
+        """
+        if not self.enabled:
+            return 0
+
+        level = _priority.get() if level is None else level
+        start = self.clock()
+        waiter = self._enqueue(level)
+        try:
+            while True:
+                with self._condition:
+                    delay = self._try_take(waiter)
+                    waited = self.clock() - start
+                    if delay == 0:
+                        self._condition.notify_all()
+                        break
+                    if waited >= self.max_wait:
+                        self._give_up(waiter)
+                        self._condition.notify_all()
+                        break
+                await asyncio.sleep(min(delay, self.max_wait - waited))
+        except asyncio.CancelledError:
+            with self._condition:
+                self._give_up(waiter)
+                self._condition.notify_all()
+            raise
+
+        self._account(level, waited)
+        return waited
+
+    def instrument_docker(self, docker_client) -> None:
+        """ Makes all the mutating HTTP requests of a docker-py client wait for a token
+
+        :param docker_client: docker.DockerClient
+        """
+        api = docker_client.api
+        if getattr(api.request, '_rate_limited', False) is True:
+            return
+
+        original = api.request
+
+        def request(method, url, *args, **kwargs):
+            if is_mutating(method, url):
+                self.acquire()
+            return original(method, url, *args, **kwargs)
+
+        request._rate_limited = True
+        api.request = request
+
+
+mutation_limiter = MutationLimiter()
+
+
+def prioritized(level: int):
+    """ Decorator giving a priority class to all the mutating calls made by a function """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with mutation_limiter.priority(level):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
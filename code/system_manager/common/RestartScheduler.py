@@ -0,0 +1,410 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+
+""" Delayed restarts of the NuvlaEdge containers, from a single background thread, detection of the containers that
+keep crashing, and ordering of the containers to heal by their Docker Compose dependencies
+"""
+
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, TypeVar, Union
+
+# a container crashing this many times within the window (seconds) is no longer restarted
+CRASH_LOOP_MAX_FAILURES = int(os.getenv('NUVLAEDGE_SM_CRASH_LOOP_MAX_FAILURES', 5))
+CRASH_LOOP_WINDOW = float(os.getenv('NUVLAEDGE_SM_CRASH_LOOP_WINDOW', 1800))
+# upper bound of the exponential backoff between restarts, in seconds
+RESTART_MAX_DELAY = float(os.getenv('NUVLAEDGE_SM_RESTART_MAX_DELAY', 600))
+
+T = TypeVar('T')
+
+
+class PendingRestart:
+    """ A restart waiting for its time to come """
+
+    def __init__(self, name: str, container_id: str, due_at: float, seq: int):
+        self.name = name
+        self.container_id = container_id
+        self.due_at = due_at
+        self.seq = seq
+        self.running = False
+        self.cancelled = False
+
+    def __lt__(self, other: 'PendingRestart') -> bool:
+        return (self.due_at, self.seq) < (other.due_at, other.seq)
+
+
+class DelayedRestartScheduler:
+    """ Keeps the pending restarts in a priority queue, ordered by due time, and runs them one after the other from a
+    single thread, so that the number of threads does not grow with the number of failed containers
+
+    A pending restart can be cancelled, e.g. when its container recovers on its own or disappears. The outcome of
+    each restart (a list of (status, notes)) is kept until the container is restarted successfully or its restart is
+    cancelled, and can be merged into the operational status from any thread
+    """
+
+    def __init__(self, restart: Callable[[str, str], list], clock: Callable[[], float] = time.monotonic,
+                 on_change: Callable[[int], None] = None):
+        """ Constructs the scheduler
+
+        :param restart: called with the container name and ID when the restart is due. Returns the operational
+        status it reports, as a list of (status, notes). Empty when the restart succeeded
+        :param clock: monotonic clock
+        :param on_change: called with the number of pending restarts, every time it changes
+        """
+        self.log = logging.getLogger(__name__)
+        self.restart = restart
+        self.clock = clock
+        self.on_change = on_change
+        self._queue: List[PendingRestart] = []
+        self._pending: Dict[str, PendingRestart] = {}
+        self._outcomes: Dict[str, list] = {}
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def schedule(self, name: str, container_id: str, delay: float) -> bool:
+        """ Schedules the restart of a container, unless it is already pending
+
+        :param name: container name
+        :param container_id: container ID
+        :param delay: seconds to wait before restarting it
+        :return: True if scheduled, False if a restart of this container is already pending or running
+        """
+        with self._condition:
+            if name in self._pending:
+                return False
+
+            restart = PendingRestart(name, container_id, self.clock() + delay, next(self._seq))
+            self._pending[name] = restart
+            heapq.heappush(self._queue, restart)
+            self._condition.notify()
+            count = len(self._pending)
+
+        self._changed(count)
+        return True
+
+    def cancel(self, name: str) -> bool:
+        """ Cancels the pending restart of a container, and forgets the outcome of its previous ones. A restart that
+        is already running is not interrupted, but its outcome is discarded
+
+        :param name: container name
+        :return: True if there was a pending restart
+        """
+        with self._condition:
+            self._outcomes.pop(name, None)
+            restart = self._pending.pop(name, None)
+            if restart is None:
+                return False
+
+            restart.cancelled = True
+            self._compact()
+            count = len(self._pending)
+
+        self._changed(count)
+        return True
+
+    def retain(self, names: Iterable[str]) -> List[str]:
+        """ Cancels the restarts of the containers that are not in the given names, e.g. because they are gone
+
+        :param names: names of the containers that still exist
+        :return: names of the containers whose restart was cancelled
+        """
+        names = set(names)
+        with self._condition:
+            obsolete = [name for name in set(self._pending) | set(self._outcomes) if name not in names]
+
+        return [name for name in obsolete if self.cancel(name)]
+
+    def is_pending(self, name: str) -> bool:
+        with self._condition:
+            return name in self._pending
+
+    def pending(self) -> List[str]:
+        """ Names of the containers waiting to be restarted, or being restarted """
+        with self._condition:
+            return list(self._pending)
+
+    def outcomes(self) -> list:
+        """ Operational status reported by the last restart of every container that has not recovered yet
+
+        :return: list of (status, notes)
+        """
+        with self._condition:
+            return [status for outcome in self._outcomes.values() for status in outcome]
+
+    def time_until_next(self) -> Union[float, None]:
+        """ Seconds until the next restart is due, or None if there are none waiting """
+        with self._condition:
+            return self._time_until_next()
+
+    def _time_until_next(self) -> Union[float, None]:
+        while self._queue and self._queue[0].cancelled:
+            heapq.heappop(self._queue)
+        if not self._queue:
+            return None
+        return max(0.0, self._queue[0].due_at - self.clock())
+
+    def _compact(self) -> None:
+        # cancelled restarts are left in the queue until they reach its head, unless they pile up
+        if len(self._queue) > 2 * len(self._pending) + 16:
+            self._queue = [r for r in self._queue if not r.cancelled]
+            heapq.heapify(self._queue)
+
+    def _changed(self, count: int) -> None:
+        if self.on_change:
+            self.on_change(count)
+
+    def run_due(self) -> int:
+        """ Runs the restarts that are due, one after the other, in the calling thread
+
+        :return: number of restarts run
+        """
+        ran = 0
+        while True:
+            with self._condition:
+                if self._time_until_next() != 0:
+                    return ran
+                restart = heapq.heappop(self._queue)
+                restart.running = True
+
+            try:
+                outcome = list(self.restart(restart.name, restart.container_id) or [])
+            except Exception as e:
+                self.log.exception(f'Failed to restart container {restart.name}: {str(e)}')
+                outcome = []
+
+            with self._condition:
+                if not restart.cancelled:
+                    self._pending.pop(restart.name, None)
+                    if outcome:
+                        self._outcomes[restart.name] = outcome
+                    else:
+                        self._outcomes.pop(restart.name, None)
+                count = len(self._pending)
+
+            self._changed(count)
+            ran += 1
+
+    def start(self) -> 'DelayedRestartScheduler':
+        """ Starts the background thread running the restarts, if not running yet """
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name='restart-scheduler', daemon=True)
+                self._thread.start()
+
+        return self
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._stopped and self._time_until_next() != 0:
+                    self._condition.wait(self._time_until_next())
+                if self._stopped:
+                    return
+
+            self.run_due()
+
+
+class CrashHistory:
+    """ Recent crashes of a container """
+
+    def __init__(self):
+        self.crashes: Deque[float] = deque()
+        self.last_crash_id = None
+        self.running_since = None
+        self.tripped = False
+
+
+class CrashLoopBreaker:
+    """ Keeps the recent crashes of every container, to space out its restarts with an exponential backoff (plus
+    jitter), and to stop restarting it once it crashed too many times within a window (the circuit is open)
+
+    The history of a container is forgotten, and its circuit closed again, once it stays healthy (running) for a
+    while, be it because it was fixed by hand or because its last restart was the good one
+    """
+
+    def __init__(self, max_failures: int = CRASH_LOOP_MAX_FAILURES, window: float = CRASH_LOOP_WINDOW,
+                 max_delay: float = RESTART_MAX_DELAY, jitter: float = 0.1, healthy_after: float = 300,
+                 clock: Callable[[], float] = time.monotonic):
+        """ Constructs the breaker
+
+        :param max_failures: crashes within the window after which the container is no longer restarted
+        :param window: seconds during which the crashes are remembered
+        :param max_delay: maximum seconds between two restarts
+        :param jitter: maximum random delay added to each restart, as a fraction of the delay
+        :param healthy_after: seconds a container has to run for its history to be forgotten
+        :param clock: monotonic clock
+        """
+        self.log = logging.getLogger(__name__)
+        self.max_failures = max_failures
+        self.window = window
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.healthy_after = healthy_after
+        self.clock = clock
+        self._history: Dict[str, CrashHistory] = {}
+        self._lock = threading.Lock()
+
+    def record_crash(self, name: str, crash_id: str = None, uptime: float = None) -> bool:
+        """ Records that a container crashed
+
+        :param name: container name
+        :param crash_id: identifies the crash (e.g. the State.FinishedAt of the container), so that a crash seen
+        several times is only counted once
+        :param uptime: seconds the container ran before crashing, if known. Long enough, and the crashes before are
+        forgotten
+        :return: True if this crash opened the circuit
+        """
+        now = self.clock()
+        with self._lock:
+            history = self._history.setdefault(name, CrashHistory())
+            if crash_id is not None and crash_id == history.last_crash_id:
+                return False
+
+            if uptime is not None and uptime >= self.healthy_after and not history.tripped:
+                history.crashes.clear()
+
+            history.last_crash_id = crash_id
+            history.running_since = None
+            history.crashes.append(now)
+            while history.crashes and history.crashes[0] < now - self.window:
+                history.crashes.popleft()
+
+            if history.tripped or len(history.crashes) < self.max_failures:
+                return False
+
+            history.tripped = True
+
+        self.log.error(f'Container {name} crashed {self.max_failures} times in less than {self.window:.0f} seconds. '
+                       f'Not restarting it anymore, until it runs again')
+        return True
+
+    def record_running(self, name: str) -> bool:
+        """ Records that a container is running. Once it has been running for long enough, it is considered healthy
+
+        :param name: container name
+        :return: True if the container is now healthy, and its history was forgotten
+        """
+        now = self.clock()
+        with self._lock:
+            history = self._history.get(name)
+            if history is None:
+                return False
+
+            if history.running_since is None:
+                history.running_since = now
+            if now - history.running_since < self.healthy_after:
+                return False
+
+            self._history.pop(name)
+
+        self.log.info(f'Container {name} is healthy again')
+        return True
+
+    def is_open(self, name: str) -> bool:
+        """ Whether the container crashed too often to be restarted """
+        with self._lock:
+            history = self._history.get(name)
+            return history is not None and history.tripped
+
+    def failures(self, name: str) -> int:
+        """ Crashes of the container within the window """
+        with self._lock:
+            history = self._history.get(name)
+            return len(history.crashes) if history else 0
+
+    def delay(self, name: str, base_delay: float) -> float:
+        """ Seconds to wait before restarting a container: the base delay, doubled for every crash within the window
+        but the first one, up to the maximum delay, plus jitter
+
+        :param name: container name
+        :param base_delay: delay after the first crash
+        """
+        delay = min(self.max_delay, base_delay * 2 ** max(0, self.failures(name) - 1))
+        return delay + random.uniform(0, delay * self.jitter) if self.jitter else delay
+
+    def retain(self, names: Iterable[str]) -> None:
+        """ Forgets the containers that are not in the given names, e.g. because they are gone """
+        names = set(names)
+        with self._lock:
+            for name in [n for n in self._history if n not in names]:
+                self._history.pop(name)
+
+
+def compose_dependencies(labels: dict) -> List[str]:
+    """ Services a container depends on, from the label set by Docker Compose, e.g.
+    "system-manager:service_started:false,security:service_healthy:true"
+
+    :param labels: container labels
+    :return: names of the services
+    """
+    depends_on = (labels or {}).get('com.docker.compose.depends_on') or ''
+    return [d.split(':')[0].strip() for d in depends_on.split(',') if d.strip()]
+
+
+def dependency_waves(dependencies: Dict[str, Iterable[str]], priority: Iterable[str] = ()) -> List[List[str]]:
+    """ Groups services in waves, so that every service comes after the ones it depends on. Dependencies on services
+    that are not given (e.g. because they are running fine) are ignored
+
+    :param dependencies: names of the services it depends on, for every service
+    :param priority: services going first within their wave
+    :return: waves of services, in order. Services in a dependency cycle make up the last wave
+    """
+    priority = list(priority)
+    remaining = {name: {d for d in deps if d in dependencies and d != name} for name, deps in dependencies.items()}
+
+    def order(name: str) -> tuple:
+        return (priority.index(name) if name in priority else len(priority)), name
+
+    waves = []
+    while remaining:
+        wave = sorted([name for name, deps in remaining.items() if not deps], key=order)
+        if not wave:
+            logging.getLogger(__name__).warning(f'Circular dependencies between services: {", ".join(remaining)}')
+            wave = sorted(remaining, key=order)
+
+        waves.append(wave)
+        for name in wave:
+            remaining.pop(name)
+        for deps in remaining.values():
+            deps.difference_update(wave)
+
+    return waves
+
+
+def restart_waves(containers: List[T], labels_of: Callable[[T], dict], name_of: Callable[[T], str],
+                  priority: Iterable[str] = ()) -> List[List[T]]:
+    """ Groups containers in waves, by the dependencies between their Docker Compose services
+
+    :param containers: containers to heal
+    :param labels_of: returns the labels of a container
+    :param name_of: returns the name of a container. Used as service name if the container has none
+    :param priority: services going first within their wave
+    :return: waves of containers, in order
+    """
+    services: Dict[str, List[T]] = {}
+    dependencies: Dict[str, List[str]] = {}
+    for container in containers:
+        labels = labels_of(container) or {}
+        service = labels.get('com.docker.compose.service') or name_of(container)
+        services.setdefault(service, []).append(container)
+        dependencies.setdefault(service, []).extend(compose_dependencies(labels))
+
+    return [[c for service in wave for c in services[service]] for wave in dependency_waves(dependencies, priority)]
@@ -0,0 +1,274 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+
+""" Scheduler for the periodic supervision checks of the system manager """
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Union
+
+
+class Job:
+    """ A periodic check, with its own interval, jitter and priority """
+
+    def __init__(self, name: str, func: Callable, interval: float, jitter: float = 0, priority: int = 0,
+                 depends_on: Iterable[str] = (), timeout: float = None):
+        """ Constructs a job
+
+        :param name: unique name of the job
+        :param func: function to be called, without arguments
+        :param interval: seconds between two runs
+        :param jitter: maximum random delay (seconds) added to each run, to avoid all jobs running in lockstep
+        :param priority: jobs with higher priority run first when several are due
+        :param depends_on: names of the jobs that, when due in the same round, must finish before this one starts
+        :param timeout: seconds after which the scheduler stops waiting for the job, when running in parallel
+        """
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.priority = priority
+        self.depends_on = tuple(depends_on)
+        self.timeout = timeout
+        self.running = False
+        self.runs = 0
+        self.timeouts = 0
+        self.last_started = None
+        self.last_duration = None
+        self.next_run = None
+        self.forced_run = None
+        self._base = None
+
+    def start(self, now: float) -> None:
+        self._base = now
+        self.next_run = now
+
+    def is_due(self, now: float) -> bool:
+        return self.next_run <= now or (self.forced_run is not None and self.forced_run <= now)
+
+    def due_at(self) -> float:
+        return self.next_run if self.forced_run is None else min(self.next_run, self.forced_run)
+
+    def reschedule(self, now: float, stretch: float = 1) -> None:
+        """ Moves the job to its next slot. Slots are always a multiple of the interval away from the start, so the
+        period does not drift with the duration of the job nor with the jitter
+
+        :param now: current (monotonic) time
+        :param stretch: multiplier of the interval, e.g. to back off when the container runtime is slow
+        """
+        self.forced_run = None
+        if self.next_run > now:
+            # the job was forced to run ahead of its slot, which is kept as is
+            return
+
+        interval = self.interval * stretch
+        missed = int((now - self._base) // interval) + 1
+        self._base += missed * interval
+        self.next_run = self._base + (random.uniform(0, self.jitter) if self.jitter else 0)
+
+
+class Scheduler:
+    """ Runs periodic jobs, each with its own interval, jitter and priority
+
+    The scheduler sleeps until the next job is due, but the sleep can be interrupted with wake(), e.g. from a signal
+    handler or from the Docker events monitor
+
+    With more than one worker, the jobs that are due run concurrently in a bounded thread pool, each one as soon as
+    the jobs it depends on are done, so a round takes about as long as its slowest chain of jobs
+    """
+
+    def __init__(self, min_wake_interval: float = 1, clock: Callable[[], float] = time.monotonic, workers: int = 1,
+                 on_job_finished: Callable[[Job], None] = None):
+        """ Constructs the scheduler
+
+        :param min_wake_interval: minimum seconds between two runs of the same job, when woken up on demand.
+        Coalesces bursts of wake-ups
+        :param clock: monotonic clock
+        :param workers: number of threads running the jobs. With 1, jobs run sequentially in the caller's thread
+        :param on_job_finished: called with the job every time it finishes, e.g. to record its duration
+        """
+        self.log = logging.getLogger(__name__)
+        self.jobs: Dict[str, Job] = {}
+        self.min_wake_interval = min_wake_interval
+        self.clock = clock
+        self.workers = workers
+        self.on_job_finished = on_job_finished
+        # multiplier of the intervals of all the jobs. Jobs woken up on demand still run right away
+        self.stretch = 1
+        self._executor = None
+        self._wakeup = threading.Event()
+        self._listeners: List[Callable[[], None]] = []
+        # reentrant: wake() is called from signal handlers, which run on the main thread, possibly while it holds the lock
+        self._lock = threading.RLock()
+
+    def add_job(self, name: str, func: Callable, interval: float, jitter: float = 0, priority: int = 0,
+                depends_on: Iterable[str] = (), timeout: float = None) -> Job:
+        """ Adds a job, to be run as soon as the scheduler runs, and then periodically
+
+        :return: the new Job
+        """
+        job = Job(name, func, interval, jitter, priority, depends_on, timeout)
+        job.start(self.clock())
+        with self._lock:
+            self.jobs[name] = job
+
+        return job
+
+    def wake(self, *names: str) -> None:
+        """ Requests some jobs to run as soon as possible, and interrupts the current sleep
+
+        :param names: names of the jobs to run. If none, all jobs run
+        """
+        now = self.clock()
+        with self._lock:
+            for name in (names or list(self.jobs)):
+                job = self.jobs.get(name)
+                if not job:
+                    continue
+                forced_run = now if job.last_started is None else \
+                    max(now, job.last_started + self.min_wake_interval)
+                job.forced_run = forced_run if job.forced_run is None else min(job.forced_run, forced_run)
+
+        self._notify()
+
+    def add_wake_listener(self, listener: Callable[[], None]) -> None:
+        """ Registers a function to be called whenever the scheduler is woken up, e.g. to wake up an event loop that
+        drives the jobs instead of run_pending()
+
+        :param listener: function without arguments. Must be thread-safe
+        """
+        self._listeners.append(listener)
+
+    def _notify(self) -> None:
+        self._wakeup.set()
+        for listener in self._listeners:
+            listener()
+
+    def due_jobs(self) -> List[Job]:
+        """ Gets the jobs that are due, by descending priority. Jobs still running from a previous round are left out
+        """
+        now = self.clock()
+        with self._lock:
+            due = [job for job in self.jobs.values() if job.is_due(now) and not job.running]
+
+        return sorted(due, key=lambda j: j.priority, reverse=True)
+
+    def job_started(self, job: Job) -> None:
+        job.last_started = self.clock()
+        job.running = True
+
+    def job_finished(self, job: Job) -> None:
+        """ Accounts for a finished run of a job, and moves it to its next slot """
+        job.runs += 1
+        job.last_duration = self.clock() - job.last_started
+        with self._lock:
+            job.running = False
+            job.reschedule(self.clock(), self.stretch)
+
+        if self.on_job_finished:
+            try:
+                self.on_job_finished(job)
+            except Exception as e:
+                self.log.error(f'Error while accounting for check {job.name}: {str(e)}')
+
+    def run_job(self, job: Job) -> None:
+        self.job_started(job)
+        try:
+            job.func()
+        except Exception as e:
+            self.log.exception(f'Check {job.name} failed: {str(e)}')
+        finally:
+            self.job_finished(job)
+
+    def run_pending(self) -> List[str]:
+        """ Runs all the jobs that are due, by priority
+
+        :return: names of the jobs that ran (or started, for those that timed out)
+        """
+        self._wakeup.clear()
+        if self.workers > 1:
+            return self._run_concurrently(self.due_jobs())
+
+        ran = []
+        for job in self.due_jobs():
+            self.run_job(job)
+            ran.append(job.name)
+
+        return ran
+
+    def _run_concurrently(self, due: List[Job]) -> List[str]:
+        """ Runs the due jobs in the thread pool. A job is submitted once all its dependencies that are also due have
+        finished or timed out. Jobs that time out keep running in the background, but are not waited for
+
+        :param due: jobs to run, by descending priority
+        :return: names of the jobs that ran
+        """
+        if not self._executor:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='check')
+
+        pending = list(due)
+        names = {job.name for job in due}
+        done = set()
+        running = {}
+        ran = []
+
+        while pending or running:
+            for job in [j for j in pending if all(d in done or d not in names for d in j.depends_on)]:
+                pending.remove(job)
+                # flag it now, so that a timed out job is not picked up again before it really starts
+                job.running = True
+                deadline = self.clock() + job.timeout if job.timeout else None
+                running[self._executor.submit(self.run_job, job)] = (job, deadline)
+                ran.append(job.name)
+
+            if not running:
+                # what is left depends on itself, one way or another
+                self.log.error(f'Circular dependencies between checks: {", ".join(j.name for j in pending)}')
+                break
+
+            deadlines = [d for _, d in running.values() if d is not None]
+            timeout = max(0.0, min(deadlines) - self.clock()) if deadlines else None
+            finished, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                job, _ = running.pop(future)
+                done.add(job.name)
+
+            now = self.clock()
+            for future, (job, deadline) in list(running.items()):
+                if deadline is not None and deadline <= now:
+                    self.log.warning(f'Check {job.name} did not finish within {job.timeout} seconds. '
+                                     f'Not waiting for it anymore')
+                    job.timeouts += 1
+                    running.pop(future)
+                    done.add(job.name)
+                    # once it finally returns, it has to be rescheduled
+                    future.add_done_callback(lambda f: self._notify())
+
+        return ran
+
+    def shutdown(self) -> None:
+        """ Stops the thread pool, without waiting for the running jobs """
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def time_until_next(self) -> Union[float, None]:
+        """ Seconds until the next job is due, or None if there are no jobs waiting to run """
+        with self._lock:
+            due_at = [job.due_at() for job in self.jobs.values() if not job.running]
+            if not due_at:
+                return None
+            next_run = min(due_at)
+
+        return max(0.0, next_run - self.clock())
+
+    def wait(self) -> bool:
+        """ Sleeps until the next job is due, or until woken up
+
+        :return: True if woken up before the next job was due
+        """
+        return self._wakeup.wait(self.time_until_next())
@@ -0,0 +1,165 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+
+""" Local HTTP API serving the operational status of the NuvlaEdge, on a UNIX socket or on a local port
+
+GET /status returns the current status as JSON, with an ETag. GET /status?wait=N blocks until the status version is
+greater than N (long-poll), or until the timeout expires, in which case it returns 304 Not Modified
+"""
+
+import hashlib
+import json
+import logging
+import os
+import socketserver
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple, Union
+from urllib.parse import parse_qs, urlparse
+
+
+class StatusBoard:
+    """ Latest aggregated operational status, versioned, which threads can wait on """
+
+    def __init__(self):
+        self.version = 0
+        self._snapshot = self._make_snapshot(0, None, [], {})
+        self._digest = None
+        self._changed = threading.Condition()
+
+    @staticmethod
+    def _make_snapshot(version: int, status: Union[str, None], notes: List[str],
+                       checks: Dict[str, List[Tuple[str, str]]]) -> dict:
+        return {
+            'version': version,
+            'status': status,
+            'notes': notes,
+            'checks': {name: [{'status': s[0], 'notes': s[-1]} for s in results]
+                       for name, results in checks.items()},
+            'updated': datetime.utcnow().isoformat() + 'Z'
+        }
+
+    def publish(self, status: str, notes: List[str], checks: Dict[str, List[Tuple[str, str]]]) -> bool:
+        """ Sets the current status. The version is only increased (and waiters notified) if something changed
+
+        :param status: aggregated operational status
+        :param notes: aggregated status notes
+        :param checks: operational status reported by each check, as lists of (status, notes)
+        :return: True if the status changed
+        """
+        digest = hashlib.sha256(json.dumps([status, notes, checks], sort_keys=True).encode()).hexdigest()
+        with self._changed:
+            if digest == self._digest:
+                return False
+
+            self._digest = digest
+            self.version += 1
+            self._snapshot = self._make_snapshot(self.version, status, list(notes), checks)
+            self._changed.notify_all()
+            return True
+
+    def snapshot(self) -> dict:
+        with self._changed:
+            return self._snapshot
+
+    def wait_for(self, version: int, timeout: float) -> Union[dict, None]:
+        """ Waits until the status version is greater than the given one
+
+        :param version: last version known by the caller
+        :param timeout: maximum seconds to wait
+        :return: the new snapshot, or None if it did not change in time
+        """
+        with self._changed:
+            if self._changed.wait_for(lambda: self.version > version, timeout):
+                return self._snapshot
+            return None
+
+
+class StatusRequestHandler(BaseHTTPRequestHandler):
+    """ Serves the StatusBoard of the server """
+
+    server_version = 'NuvlaEdgeSystemManager'
+    max_wait = 60
+
+    def address_string(self) -> str:
+        # UNIX sockets have no client address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'local'
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(f'{self.address_string()} - {format % args}')
+
+    def send_json(self, code: int, snapshot: Union[dict, None]) -> None:
+        body = json.dumps(snapshot).encode() if snapshot is not None else b''
+        version = snapshot['version'] if snapshot else self.server.board.version
+        self.send_response(code)
+        self.send_header('ETag', f'"{version}"')
+        if body:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path not in ['/status', '/status/']:
+            self.send_error(404, 'Not found. Try /status')
+            return
+
+        board = self.server.board
+        query = parse_qs(url.query)
+        try:
+            wait = int(query['wait'][0]) if 'wait' in query else None
+            timeout = min(float(query.get('timeout', [30])[0]), self.max_wait)
+        except ValueError:
+            self.send_error(400, 'wait must be an integer, and timeout a number')
+            return
+
+        if wait is not None:
+            snapshot = board.wait_for(wait, max(timeout, 0))
+            if snapshot:
+                self.send_json(200, snapshot)
+            else:
+                self.send_json(304, None)
+            return
+
+        snapshot = board.snapshot()
+        if self.headers.get('If-None-Match') == f'"{snapshot["version"]}"':
+            self.send_json(304, None)
+            return
+
+        self.send_json(200, snapshot)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        # HTTPServer expects these
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def start_status_server(board: StatusBoard, address: str) -> socketserver.BaseServer:
+    """ Serves the status board in a background thread
+
+    :param board: StatusBoard to serve
+    :param address: path to a UNIX socket (starting with /), or [HOST:]PORT. HOST defaults to 127.0.0.1
+    :return: the running server
+    """
+    if address.startswith('/'):
+        if os.path.exists(address):
+            # left over by a previous run
+            os.remove(address)
+        server = ThreadingUnixHTTPServer(address, StatusRequestHandler)
+    else:
+        host, _, port = address.rpartition(':')
+        server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), StatusRequestHandler)
+        server.daemon_threads = True
+
+    server.board = board
+    threading.Thread(target=server.serve_forever, name='status-api', daemon=True).start()
+    logging.getLogger(__name__).info(f'Serving the operational status on {address}')
+    return server
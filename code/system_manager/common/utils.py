@@ -4,13 +4,23 @@
 """ Common set of managament methods to be used by
  the different system manager classes """
 
+import hashlib
+import json
 import os
 import logging
+import tempfile
+import threading
+from datetime import datetime
+
+import system_manager.common.Metrics as metrics
 
 
 data_volume = "/srv/nuvlaedge/shared"
 operational_status_file = f'{data_volume}/.status'
 operational_status_notes_file = f'{data_volume}/.status_notes'
+# status and notes together, with a version, for readers that need a consistent pair
+operational_status_json_file = f'{data_volume}/.status.json'
+operational_status_json_enabled = os.getenv('NUVLAEDGE_SM_STATUS_JSON', 'false').lower() == 'true'
 base_label = "nuvlaedge.component=True"
 node_label_key = "nuvlaedge"
 
@@ -18,6 +28,14 @@ compose_project_name = os.getenv('COMPOSE_PROJECT_NAME', 'nuvlaedge')
 nuvlaedge_shared_net = compose_project_name + '-shared-network'
 nuvlaedge_shared_net_unencrypted = f'{data_volume}/.nuvlabox-shared-net-unencrypted'
 overlay_network_service = 'nuvlaedge-ack'
+data_gateway_name = os.getenv('NUVLAEDGE_DATA_GATEWAY_NAME',
+                              os.getenv('NUVLABOX_DATA_GATEWAY_NAME', 'data-gateway'))
+data_gateway_port = int(os.getenv('NUVLAEDGE_DATA_GATEWAY_PORT', 1883))
+# exists while the Data Gateway accepts MQTT connections
+data_gateway_ready_flag = f'{data_volume}/.data_gateway_ready'
+# bridge network of the Data Gateway of each node, with the "node" placement in Swarm mode
+# (its name must not contain nuvlaedge_shared_net, since Docker matches network names by substring)
+data_gateway_node_net = compose_project_name + '-data-gateway-node'
 
 status_degraded = 'DEGRADED'
 status_operational = 'OPERATIONAL'
@@ -28,18 +46,111 @@ tls_sync_file = f"{data_volume}/.tls"
 log = logging.getLogger(__name__)
 
 
-def set_operational_status(status: str, notes: list = []):
-    log.debug(f'Write operational status "{status}" to file "{operational_status_file}"')
-    with open(operational_status_file, 'w') as s:
-        s.write(status)
+def atomic_write(path: str, content: str, mode: int = 0o644) -> None:
+    """ Writes a file atomically: readers either see the old content or the new one, never a partial write
 
+    :param path: file path
+    :param content: new content
+    :param mode: permissions of the file. Temporary files are only readable by their owner, while these files are read
+    by other components, which may run as other users
+    """
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or '.', prefix=f'.{name}.', suffix='.tmp')
     try:
+        with os.fdopen(fd, 'w') as f:
+            os.fchmod(f.fileno(), mode)
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class StatusWriter:
+    """ Writes the operational status and notes to the shared volume, only when they change
+
+    Every write is atomic (temporary file, fsync and rename), to spare flash storage from needless writes and other
+    components from reading half-written files
+    """
+
+    def __init__(self, status_file: str = operational_status_file,
+                 notes_file: str = operational_status_notes_file,
+                 json_file: str = None):
+        """ Constructs the writer
+
+        :param status_file: where to write the status
+        :param notes_file: where to write the status notes, one per line
+        :param json_file: if set, where to write the status and notes together, as versioned JSON
+        """
+        self.status_file = status_file
+        self.notes_file = notes_file
+        self.json_file = json_file
+        self.version = 0
+        self.writes = 0
+        self.skipped = 0
+        self._digest = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(status: str, notes_str: str) -> str:
+        return hashlib.sha256(f'{status}\0{notes_str}'.encode()).hexdigest()
+
+    def write(self, status: str, notes: list = None) -> bool:
+        """ Writes the status and notes, unless they are the same as in the last write
+
+        :param status: operational status
+        :param notes: list of status notes
+        :return: True if the files were written
+        """
+        notes = notes or []
         notes_str = '\n'.join(notes)
-        log.debug(f'Write operational status notes to file "{operational_status_notes_file}": {notes_str}')
-        with open(operational_status_notes_file, 'w') as sn:
-            sn.write(notes_str)
-    except Exception as e:
-        log.warning(f'Failed to write status notes {notes} in {operational_status_notes_file}: {str(e)}')
+        digest = self.digest(status, notes_str)
+
+        with self._lock:
+            # someone might have deleted the files in the meantime
+            if digest == self._digest and os.path.exists(self.status_file):
+                self.skipped += 1
+                metrics.status_writes.inc(result='skipped')
+                return False
+
+            self._digest = None
+            log.debug(f'Write operational status "{status}" to file "{self.status_file}"')
+            atomic_write(self.status_file, status)
+            self.writes += 1
+            metrics.status_writes.inc(result='written')
+
+            try:
+                log.debug(f'Write operational status notes to file "{self.notes_file}": {notes_str}')
+                atomic_write(self.notes_file, notes_str)
+            except Exception as e:
+                log.warning(f'Failed to write status notes {notes} in {self.notes_file}: {str(e)}')
+                return True
+
+            self.version += 1
+            if self.json_file:
+                try:
+                    atomic_write(self.json_file, json.dumps({'version': self.version,
+                                                             'status': status,
+                                                             'notes': notes,
+                                                             'updated': datetime.utcnow().isoformat() + 'Z'}))
+                except Exception as e:
+                    log.warning(f'Failed to write operational status in {self.json_file}: {str(e)}')
+                    return True
+
+            self._digest = digest
+            return True
+
+
+status_writer = StatusWriter(json_file=operational_status_json_file if operational_status_json_enabled else None)
+
+
+def set_operational_status(status: str, notes: list = []):
+    status_writer.write(status, notes)
 
 
 def status_file_exists() -> bool:
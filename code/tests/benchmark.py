@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" End-to-end benchmark of the supervision cycles, against the fake Docker daemon
+
+Every scenario starts a FakeDockerDaemon at a given scale, and runs manager_main.main() against it, in a process of
+its own, for a number of rounds in which all the checks are due. For every round (cycle), it records the latency, the
+number of API calls (and their accumulated latency), the CPU time and the RSS of the system manager. The first cycle
+(where the NuvlaEdge components are resolved) is reported on its own, and the others as min/median/p95/max
+
+Results are stored as JSON, to be compared with the results of another release, e.g.
+
+    # from the <project_root>/code folder
+    python -m tests.benchmark --output 2.5.0.json
+    python -m tests.benchmark --output new.json --compare 2.5.0.json
+"""
+
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import SUPPRESS, ArgumentParser
+from datetime import datetime
+from typing import Dict, List
+
+# scale of the node and latency of the daemon (seconds per request), for every scenario
+SCENARIOS = {
+    'small': dict(containers=10, networks=10),
+    'medium': dict(containers=100, networks=50, nodes=3, services=10),
+    'large': dict(containers=1000, networks=50, nodes=10, services=50),
+    'large-slow-daemon': dict(containers=1000, networks=50, nodes=10, services=50, latency=0.005),
+    'standalone': dict(containers=100, networks=50, swarm=False),
+}
+
+# metrics reported for every scenario, as min/median/p95/max over the cycles after the first one
+CYCLE_METRICS = ['cycle_ms', 'cpu_ms', 'api_calls', 'api_ms']
+
+_code_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def current_rss_kb() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        return peak_rss_kb()
+
+
+def peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def use_data_volume(data_volume: str) -> None:
+    """ Makes the system manager write its files in the given folder, instead of the NuvlaEdge shared volume """
+    from system_manager.common import utils
+
+    utils.data_volume = data_volume
+    utils.operational_status_file = os.path.join(data_volume, '.status')
+    utils.operational_status_notes_file = os.path.join(data_volume, '.status_notes')
+    utils.status_writer = utils.StatusWriter(utils.operational_status_file, utils.operational_status_notes_file)
+
+
+class CycleRecorder:
+    """ Measures the rounds of checks run by manager_main.main() """
+
+    def __init__(self, run_pending, end_of_round):
+        """
+        :param run_pending: function starting a round of checks (scheduler.run_pending)
+        :param end_of_round: function ending it (manager_main.end_of_round)
+        """
+        self._run_pending = run_pending
+        self._end_of_round = end_of_round
+        self._start = None
+        self.cycles = []
+
+    def run_pending(self):
+        self._start = (time.perf_counter(), time.process_time())
+        return self._run_pending()
+
+    def end_of_round(self):
+        api_calls = self._end_of_round()
+        wall, cpu = self._start
+        self.cycles.append({'cycle_ms': (time.perf_counter() - wall) * 1000,
+                            'cpu_ms': (time.process_time() - cpu) * 1000,
+                            'api_calls': api_calls.count,
+                            'api_ms': api_calls.duration_ms,
+                            'rss_kb': current_rss_kb()})
+        return api_calls
+
+
+def run_cycles(rounds: int, data_volume: str) -> dict:
+    """ Runs main() for a number of rounds, in this process. DOCKER_HOST must point to the fake daemon
+
+    :param rounds: number of rounds of checks
+    :param data_volume: where the status files go, instead of the NuvlaEdge shared volume
+    :return: measurements of every cycle, and of the whole process
+    """
+    start_cpu = time.process_time()
+    import manager_main
+    use_data_volume(data_volume)
+    startup_cpu_ms = (time.process_time() - start_cpu) * 1000
+
+    recorder = CycleRecorder(manager_main.scheduler.run_pending, manager_main.end_of_round)
+    manager_main.scheduler.run_pending = recorder.run_pending
+    manager_main.end_of_round = recorder.end_of_round
+
+    # all the checks are due in every round
+    schedule = {name: (0.001, 0, priority) for name, (_, _, priority) in manager_main.default_schedule.items()}
+    manager_main.main(schedule, rounds=rounds)
+
+    return {'cycles': recorder.cycles,
+            'startup_cpu_ms': startup_cpu_ms,
+            'total_cpu_ms': time.process_time() * 1000,
+            'peak_rss_kb': peak_rss_kb()}
+
+
+def stats(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {'min': round(ordered[0], 3),
+            'median': round(statistics.median(ordered), 3),
+            'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+            'max': round(ordered[-1], 3)}
+
+
+def run_scenario(name: str, rounds: int = 20, **options) -> dict:
+    """ Runs a scenario against a fake Docker daemon, with the system manager in a process of its own
+
+    :param name: name of the scenario, in SCENARIOS
+    :param rounds: number of rounds of checks
+    :param options: overrides the options of the scenario (see FakeDockerDaemon and FakeDockerState)
+    :return: results of the scenario
+    """
+    from tests.utils.fake_docker import FakeDockerDaemon
+
+    options = {**SCENARIOS[name], **options}
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, 'docker.sock')
+        env = {**os.environ,
+               'DOCKER_HOST': f'unix://{socket_path}',
+               'PYTHONPATH': os.pathsep.join(filter(None, [_code_dir, os.environ.get('PYTHONPATH')]))}
+        env.pop('KUBERNETES_SERVICE_HOST', None)
+
+        with FakeDockerDaemon(socket_path, hostname=socket.gethostname(), **options) as daemon:
+            child = subprocess.run([sys.executable, '-m', 'tests.benchmark', '--cycles', str(rounds), tmp],
+                                   cwd=_code_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   universal_newlines=True)
+            if child.returncode != 0:
+                raise RuntimeError(f'Scenario {name} failed: {child.stderr}')
+            daemon_requests = sum(daemon.requests.values())
+
+    measured = json.loads(child.stdout.strip().splitlines()[-1])
+    cycles = measured['cycles']
+    result = {'options': options,
+              'rounds': len(cycles),
+              'first_cycle': {k: round(v, 3) for k, v in cycles[0].items()} if cycles else {},
+              'startup_cpu_ms': round(measured['startup_cpu_ms'], 3),
+              'total_cpu_ms': round(measured['total_cpu_ms'], 3),
+              'rss_kb': {'last': cycles[-1]['rss_kb'] if cycles else 0, 'peak': measured['peak_rss_kb']},
+              'daemon_requests': daemon_requests}
+    result.update({metric: stats([c[metric] for c in cycles[1:]]) for metric in CYCLE_METRICS})
+    return result
+
+
+def run_benchmark(scenarios: List[str], rounds: int, label: str = None) -> dict:
+    """ Runs several scenarios
+
+    :param scenarios: names of the scenarios
+    :param rounds: number of rounds of checks, per scenario
+    :param label: label of the results, e.g. the release. Defaults to "git describe"
+    :return: results, ready to be stored as JSON
+    """
+    return {**describe_run(label), 'scenarios': {name: run_scenario(name, rounds) for name in scenarios}}
+
+
+def describe_run(label: str = None) -> dict:
+    """ What the results were measured on
+
+    :param label: label of the results, e.g. the release. Defaults to "git describe"
+    """
+    if not label:
+        try:
+            label = subprocess.check_output(['git', 'describe', '--tags', '--always', '--dirty'], cwd=_code_dir,
+                                            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            label = 'unknown'
+
+    return {'label': label,
+            'created': datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()}
+
+
+def format_title(results: dict, baseline: dict = None) -> str:
+    return f'{results["label"]} ({results["created"]})' + \
+        (f' vs. {baseline["label"]} ({baseline["created"]})' if baseline else '')
+
+
+def format_metric(metric: str, value: float, old_value: float = None, indent: int = 4) -> str:
+    line = f'{" " * indent}{metric:>15}: {value:12.3f}'
+    if old_value:
+        line += f'  (was {old_value:.3f}, {(value - old_value) / old_value * 100:+.1f}%)'
+    return line
+
+
+def format_results(results: dict, baseline: dict = None) -> str:
+    """ Table of the median of every metric, per scenario, with the relative change from a baseline, if given """
+    lines = [format_title(results, baseline)]
+    for name, scenario in results['scenarios'].items():
+        old = (baseline or {}).get('scenarios', {}).get(name, {})
+        lines.append(f'  {name}:')
+        metrics = [(m, scenario[m].get('median'), old.get(m, {}).get('median')) for m in CYCLE_METRICS] + \
+                  [('first_cycle_ms', scenario['first_cycle'].get('cycle_ms'),
+                    old.get('first_cycle', {}).get('cycle_ms')),
+                   ('peak_rss_kb', scenario['rss_kb']['peak'], old.get('rss_kb', {}).get('peak'))]
+        lines += [format_metric(metric, value, old_value) for metric, value, old_value in metrics if value is not None]
+    return '\n'.join(lines)
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark of the supervision cycles, against a fake Docker daemon')
+    parser.add_argument('--scenario', dest='scenarios', action='append', choices=list(SCENARIOS),
+                        help='Scenario to run. Can be repeated. Defaults to all of them')
+    parser.add_argument('--rounds', type=int, default=20, help='Rounds of checks per scenario')
+    parser.add_argument('--label', help='Label of the results, e.g. the release. Defaults to "git describe"')
+    parser.add_argument('--output', help='Where to store the results, as JSON')
+    parser.add_argument('--compare', metavar='RESULTS', help='Results of a previous run, to compare with')
+    # internal: runs the cycles of one scenario in this process, and prints the measurements
+    parser.add_argument('--cycles', nargs=2, metavar=('ROUNDS', 'DATA_VOLUME'), help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cycles:
+        print(json.dumps(run_cycles(int(args.cycles[0]), args.cycles[1])))
+        return
+
+    results = run_benchmark(args.scenarios or list(SCENARIOS), args.rounds, args.label)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print(format_results(results, baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Benchmark of the Kubernetes container runtime, against the fake Kubernetes API server
+
+Every scenario starts a FakeKubernetesApiServer at a given scale, and times the operations of the system manager that
+talk to the Kubernetes API (requirements check, node classification, listing the containers of the node and fetching
+the logs of the NuvlaEdge pods), in a process of its own, round after round. For every operation, it reports the
+latency, CPU time and number of API calls, as min/median/p95/max
+
+Results are stored as JSON, to be compared with the results of another release, e.g.
+
+    # from the <project_root>/code folder
+    python -m tests.benchmark_kubernetes --output k8s-2.5.0.json
+    python -m tests.benchmark_kubernetes --output k8s-new.json --compare k8s-2.5.0.json
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import SUPPRESS, ArgumentParser
+from typing import Callable, Dict, List
+
+from tests.benchmark import _code_dir, current_rss_kb, describe_run, format_metric, format_title, peak_rss_kb, \
+    stats, use_data_volume
+
+# scale of the cluster and latency of the API server (seconds per request), for every scenario
+SCENARIOS = {
+    'single-node': dict(nodes=1, pods_per_node=20),
+    '100-pods-per-node': dict(nodes=3, pods_per_node=100),
+    '500-pods-per-node': dict(nodes=3, pods_per_node=500),
+    '500-pods-per-node-slow-api': dict(nodes=3, pods_per_node=500, latency=0.005),
+}
+
+# metrics reported for every operation
+OPERATION_METRICS = ['ms', 'cpu_ms', 'api_calls']
+
+
+def run_operations(rounds: int, data_volume: str, api_url: str) -> dict:
+    """ Times the operations for a number of rounds, in this process. KUBERNETES_SERVICE_HOST must be set
+
+    :param rounds: number of rounds
+    :param data_volume: where the status files go, instead of the NuvlaEdge shared volume
+    :param api_url: URL of the (fake) Kubernetes API server
+    :return: measurements of every operation, in every round
+    """
+    from kubernetes import client, config
+
+    # instead of the service account of the pod
+    client.Configuration.set_default(client.Configuration(host=api_url))
+    config.load_incluster_config = lambda: None
+
+    import manager_main
+    import system_manager.Requirements as MinReq
+    from system_manager.common.ApiAccounting import accounting
+    from system_manager.common.ContainerRuntime import NodeInfoSnapshot
+    use_data_volume(data_volume)
+
+    runtime = manager_main.self_sup.container_runtime
+    node_info = NodeInfoSnapshot(runtime)
+    software_requirements = MinReq.SoftwareRequirements()
+    system_requirements = MinReq.SystemRequirements()
+
+    def fetch_logs():
+        for pod in runtime.list_internal_components():
+            runtime.fetch_container_logs(pod, since=60)
+
+    operations: Dict[str, Callable] = {
+        'requirements_check': lambda: manager_main.requirements_check(software_requirements, system_requirements,
+                                                                      [], node_info),
+        'classify_this_node': lambda: manager_main.self_sup.classify_this_node(node_info),
+        'list_node_containers': runtime.list_all_containers_in_this_node,
+        'fetch_logs': fetch_logs,
+    }
+
+    measurements = {name: [] for name in operations}
+    for _ in range(rounds):
+        for name, operation in operations.items():
+            # every operation fetches the node info, as the first check of a round does
+            node_info.invalidate()
+            wall, cpu = time.perf_counter(), time.process_time()
+            with accounting.round() as api_calls:
+                operation()
+            measurements[name].append({'ms': (time.perf_counter() - wall) * 1000,
+                                       'cpu_ms': (time.process_time() - cpu) * 1000,
+                                       'api_calls': api_calls.count})
+
+    return {'operations': measurements,
+            'rss_kb': current_rss_kb(),
+            'peak_rss_kb': peak_rss_kb()}
+
+
+def run_scenario(name: str, rounds: int = 10, **options) -> dict:
+    """ Runs a scenario against a fake Kubernetes API server, with the system manager in a process of its own
+
+    :param name: name of the scenario, in SCENARIOS
+    :param rounds: number of rounds
+    :param options: overrides the options of the scenario (see FakeKubernetesApiServer and FakeKubernetesState)
+    :return: results of the scenario
+    """
+    from tests.utils.fake_kubernetes import FakeKubernetesApiServer
+
+    options = {**SCENARIOS[name], **options}
+    with tempfile.TemporaryDirectory() as tmp, FakeKubernetesApiServer(**options) as server:
+        env = {**os.environ,
+               'KUBERNETES_SERVICE_HOST': '127.0.0.1',
+               'KUBERNETES_SERVICE_PORT': str(server.port),
+               'MY_HOST_NODE_NAME': server.state.node_names[0],
+               'MY_NAMESPACE': server.state.namespace,
+               'PYTHONPATH': os.pathsep.join(filter(None, [_code_dir, os.environ.get('PYTHONPATH')]))}
+        env.pop('DOCKER_HOST', None)
+
+        child = subprocess.run([sys.executable, '-m', 'tests.benchmark_kubernetes',
+                                '--operations', str(rounds), tmp, server.url],
+                               cwd=_code_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True)
+        if child.returncode != 0:
+            raise RuntimeError(f'Scenario {name} failed: {child.stderr}')
+        server_requests = dict(server.requests)
+
+    measured = json.loads(child.stdout.strip().splitlines()[-1])
+    return {'options': options,
+            'rounds': rounds,
+            'operations': {operation: {metric: stats([m[metric] for m in measurements])
+                                       for metric in OPERATION_METRICS}
+                           for operation, measurements in measured['operations'].items()},
+            'rss_kb': {'last': measured['rss_kb'], 'peak': measured['peak_rss_kb']},
+            'server_requests': server_requests}
+
+
+def run_benchmark(scenarios: List[str], rounds: int, label: str = None) -> dict:
+    """ Runs several scenarios
+
+    :param scenarios: names of the scenarios
+    :param rounds: number of rounds, per scenario
+    :param label: label of the results, e.g. the release. Defaults to "git describe"
+    :return: results, ready to be stored as JSON
+    """
+    return {**describe_run(label), 'scenarios': {name: run_scenario(name, rounds) for name in scenarios}}
+
+
+def format_results(results: dict, baseline: dict = None) -> str:
+    """ Table of the median of every metric, per scenario and operation, with the relative change from a baseline """
+    lines = [format_title(results, baseline)]
+    for name, scenario in results['scenarios'].items():
+        old = (baseline or {}).get('scenarios', {}).get(name, {})
+        lines.append(f'  {name}:')
+        for operation, metrics in scenario['operations'].items():
+            old_metrics = old.get('operations', {}).get(operation, {})
+            lines.append(f'    {operation}:')
+            lines += [format_metric(metric, metrics[metric]['median'],
+                                    old_metrics.get(metric, {}).get('median'), indent=6)
+                      for metric in OPERATION_METRICS if metrics.get(metric)]
+        lines.append(format_metric('peak_rss_kb', scenario['rss_kb']['peak'], old.get('rss_kb', {}).get('peak')))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark of the Kubernetes runtime, against a fake Kubernetes API server')
+    parser.add_argument('--scenario', dest='scenarios', action='append', choices=list(SCENARIOS),
+                        help='Scenario to run. Can be repeated. Defaults to all of them')
+    parser.add_argument('--rounds', type=int, default=10, help='Rounds of operations per scenario')
+    parser.add_argument('--label', help='Label of the results, e.g. the release. Defaults to "git describe"')
+    parser.add_argument('--output', help='Where to store the results, as JSON')
+    parser.add_argument('--compare', metavar='RESULTS', help='Results of a previous run, to compare with')
+    # internal: runs the operations of one scenario in this process, and prints the measurements
+    parser.add_argument('--operations', nargs=3, metavar=('ROUNDS', 'DATA_VOLUME', 'API_URL'), help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.operations:
+        print(json.dumps(run_operations(int(args.operations[0]), args.operations[1], args.operations[2])))
+        return
+
+    results = run_benchmark(args.scenarios or list(SCENARIOS), args.rounds, args.label)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print(format_results(results, baseline))
+
+
+if __name__ == '__main__':
+    main()
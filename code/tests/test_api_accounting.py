@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import mock
+import unittest
+from types import SimpleNamespace
+from system_manager.common.ApiAccounting import ApiAccounting, normalize_docker_endpoint
+
+
+class ApiAccountingTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.obj = ApiAccounting()
+
+    def test_normalize_docker_endpoint(self):
+        self.assertEqual(normalize_docker_endpoint('get', 'http+docker://localhost/v1.41/containers/json'),
+                         'GET /containers/json',
+                         'Failed to remove API version')
+        self.assertEqual(normalize_docker_endpoint('POST', f'http+docker://localhost/v1.41/containers/{"a1" * 32}/'
+                                                           f'restart?t=10'),
+                         'POST /containers/{id}/restart',
+                         'Failed to remove object ID and query')
+        self.assertEqual(normalize_docker_endpoint('GET', '/networks/nuvlaedge-shared-network'),
+                         'GET /networks/nuvlaedge-shared-network',
+                         'Names should be kept')
+
+    def test_instrument_docker(self):
+        responses = [SimpleNamespace(status_code=200), SimpleNamespace(status_code=404), ConnectionError('gone')]
+
+        def request(method, url, **kwargs):
+            r = responses.pop(0)
+            if isinstance(r, Exception):
+                raise r
+            return r
+
+        client = SimpleNamespace(api=SimpleNamespace(request=request))
+        self.obj.instrument_docker(client)
+        # instrumenting twice has no effect
+        self.obj.instrument_docker(client)
+
+        client.api.request('GET', 'http+docker://localhost/v1.41/info')
+        client.api.request('GET', 'http+docker://localhost/v1.41/containers/abcdef123456/json')
+        self.assertRaises(ConnectionError, client.api.request, 'GET', 'http+docker://localhost/v1.41/version')
+
+        report = self.obj.end_round()
+        self.assertEqual([(c.endpoint, c.error) for c in report.calls],
+                         [('GET /info', None), ('GET /containers/{id}/json', '404'),
+                          ('GET /version', 'ConnectionError')],
+                         'Failed to record calls')
+        self.assertTrue(all(c.call_site.startswith('test_api_accounting.py:') for c in report.calls),
+                        'Failed to find the call site')
+        self.assertEqual((self.obj.total_calls, self.obj.total_errors), (3, 2),
+                         'Failed to count calls')
+        self.assertEqual(self.obj.end_round().count, 0,
+                         'A new round should start empty')
+
+    def test_instrument_kubernetes(self):
+        api_client = SimpleNamespace(call_api=mock.MagicMock(return_value='pods'))
+        self.obj.instrument_kubernetes(api_client)
+        self.assertEqual(api_client.call_api('/api/v1/namespaces/{namespace}/pods', 'GET', {'namespace': 'ne'}),
+                         'pods',
+                         'Failed to call the API')
+
+        report = self.obj.end_round()
+        self.assertEqual(report.calls[0].endpoint, 'GET /api/v1/namespaces/{namespace}/pods',
+                         'Failed to record Kubernetes call')
+
+        # newer clients give the method first, and only raise errors once the response is deserialized
+        api_client = SimpleNamespace(call_api=mock.MagicMock(return_value=SimpleNamespace(status=404)))
+        self.obj.instrument_kubernetes(api_client)
+        api_client.call_api('GET', 'https://10.0.0.1:6443/api/v1/nodes/node-0?pretty=false')
+        self.assertEqual(self.obj.end_round().calls[0][::3], ('GET /api/v1/nodes/node-0', '404'),
+                         'Failed to record Kubernetes call from newer client')
+
+    def test_budget(self):
+        with self.obj.round() as report:
+            for endpoint in ['GET /containers/json', 'GET /containers/json', 'GET /info']:
+                self.obj.record(endpoint, 0.01)
+
+        self.assertEqual(report.summary(), '3 API calls, 30 ms',
+                         'Wrong round summary')
+        self.assertEqual(report.by('endpoint')['GET /containers/json']['calls'], 2,
+                         'Failed to aggregate by endpoint')
+        self.assertIn('endpoint GET /info: 1 calls', report.dump(),
+                      'Failed to dump details')
+
+        report.assert_budget(3)
+        self.assertRaises(AssertionError, report.assert_budget, 2)
+        self.assertRaises(AssertionError, report.assert_budget, 3, max_ms=10)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from system_manager.common.AsyncDocker import AsyncDockerClient, AsyncDockerError, AsyncDockerNotFound
+
+
+class AsyncDockerClientTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.socket = os.path.join(self.tmp.name, 'docker.sock')
+        self.received = []
+        self.server = await asyncio.start_unix_server(self.handle, path=self.socket)
+        self.obj = AsyncDockerClient(self.socket, max_connections=2, timeout=5)
+
+    async def asyncTearDown(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+        self.tmp.cleanup()
+
+    async def handle(self, reader, writer):
+        request_line = (await reader.readline()).decode().strip()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            k, _, v = line.decode().partition(':')
+            headers[k.strip().lower()] = v.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        self.received.append((request_line, body))
+
+        method, path, _ = request_line.split(' ')
+        if path == '/_ping':
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: 2\r\n\r\nOK')
+        elif path.startswith('/containers/json'):
+            # chunked response
+            payload = json.dumps([{'Id': 'a', 'Names': ['/a']}, {'Id': 'b', 'Names': ['/b']}]).encode()
+            writer.write(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n')
+            for part in (payload[:10], payload[10:]):
+                writer.write(f'{len(part):x}\r\n'.encode() + part + b'\r\n')
+            writer.write(b'0\r\n\r\n')
+        elif path == '/containers/missing/json':
+            payload = b'{"message": "No such container: missing"}'
+            writer.write(f'HTTP/1.1 404 Not Found\r\nContent-Length: {len(payload)}\r\n\r\n'.encode() + payload)
+        elif path.startswith('/containers/a/restart'):
+            writer.write(b'HTTP/1.1 204 No Content\r\n\r\n')
+        elif path.startswith('/containers/b/restart'):
+            payload = b'{"message": "boom"}'
+            writer.write(f'HTTP/1.1 500 Server Error\r\nContent-Length: {len(payload)}\r\n\r\n'.encode() + payload)
+        elif path.startswith('/events'):
+            writer.write(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n')
+            # an event split across chunks, and two events in one chunk
+            events = b'{"Type": "container", "Action": "die"}\n{"Type": "network", "Action": "disconnect"}\n'
+            for part in (events[:15], events[15:]):
+                writer.write(f'{len(part):x}\r\n'.encode() + part + b'\r\n')
+            writer.write(b'0\r\n\r\n')
+
+        await writer.drain()
+        writer.close()
+
+    async def test_request(self):
+        self.assertTrue(await self.obj.ping(),
+                        'Failed to ping the daemon')
+
+        containers = await self.obj.containers(filters={'label': ['x=y']}, all=True)
+        self.assertEqual([c['Id'] for c in containers], ['a', 'b'],
+                         'Failed to read chunked response')
+        self.assertIn('all=1', self.received[-1][0],
+                      'Booleans should be sent as 0/1')
+        self.assertIn('filters=%7B%22label%22', self.received[-1][0],
+                      'Filters should be JSON-encoded')
+
+        self.assertIsNone(await self.obj.restart('a', timeout=3),
+                          'Failed to restart container')
+        self.assertIn('t=3', self.received[-1][0],
+                      'Restart timeout not sent')
+        self.assertEqual(self.obj.requests, 3,
+                         'Failed to count requests')
+
+    async def test_errors(self):
+        with self.assertRaises(AsyncDockerNotFound) as cm:
+            await self.obj.inspect_container('missing')
+        self.assertEqual(cm.exception.message, 'No such container: missing',
+                         'Failed to parse error message')
+
+        with self.assertRaises(AsyncDockerError) as cm:
+            await self.obj.restart('b')
+        self.assertEqual(cm.exception.status, 500,
+                         'Failed to get error status')
+
+    async def test_concurrent_requests(self):
+        results = await asyncio.gather(*[self.obj.ping() for _ in range(10)])
+        self.assertTrue(all(results),
+                        'Concurrent requests failed')
+
+    async def test_events(self):
+        events = [e async for e in self.obj.events({'type': ['container']})]
+        self.assertEqual([e['Action'] for e in events], ['die', 'disconnect'],
+                         'Failed to decode events stream')
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import mock
+import threading
+import unittest
+from system_manager.AsyncSupervise import AsyncSupervise
+from system_manager.common import utils
+from system_manager.common.AsyncDocker import AsyncDockerError, AsyncDockerNotFound
+from system_manager.common.Scheduler import Scheduler
+
+
+def summary(name, state, status=''):
+    return {'Id': f'{name}-id', 'Names': [f'/{name}'], 'State': state, 'Status': status}
+
+
+def inspect(exit_code, restart_policy='always', restarting=False):
+    return {'State': {'ExitCode': exit_code, 'Restarting': restarting},
+            'HostConfig': {'RestartPolicy': {'Name': restart_policy}}}
+
+
+class AsyncSuperviseTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.client = mock.AsyncMock()
+        self.scheduler = Scheduler()
+        self.store_result = mock.MagicMock()
+        self.report = mock.MagicMock()
+        self.obj = AsyncSupervise(mock.MagicMock(), self.scheduler, self.client,
+                                  store_result=self.store_result,
+                                  report=self.report)
+        self.obj.restart_delay = 0
+        self.obj.loop = asyncio.get_running_loop()
+        self.obj._wakeup = asyncio.Event()
+        self.obj._report = asyncio.Event()
+        logging.disable(logging.CRITICAL)
+
+    async def asyncTearDown(self) -> None:
+        self.obj.executor.shutdown()
+        logging.disable(logging.NOTSET)
+
+    async def test_heal(self):
+        self.client.containers.return_value = [summary('running', 'running', 'Up 5 minutes'),
+                                               summary('created', 'created'),
+                                               summary('graceful', 'exited', 'Exited (0) 1 minute ago'),
+                                               summary('no-policy', 'exited', 'Exited (1) 1 minute ago'),
+                                               summary('broken', 'exited', 'Exited (137) 1 minute ago')]
+        self.client.inspect_container.side_effect = \
+            lambda cid: inspect(1, 'no') if cid == 'no-policy-id' else inspect(137)
+
+        self.assertEqual(await self.obj.heal(), [],
+                         'Nothing should have been reported yet')
+        self.assertIn(f'com.docker.compose.project={self.obj.project_name}',
+                      self.client.containers.call_args[1]['filters']['label'],
+                      'Containers should be listed within the compose project')
+        self.client.start.assert_awaited_once_with('created-id')
+        self.assertEqual(sorted(c.args[0] for c in self.client.inspect_container.await_args_list),
+                         ['broken-id', 'no-policy-id'],
+                         'Only containers that did not exit gracefully should be inspected')
+
+        # only the broken container with a restart policy is restarted
+        self.assertEqual(list(self.obj.restarting), ['broken'],
+                         'Failed to schedule restart')
+        await self.obj.restarting['broken']
+        self.client.restart.assert_awaited_once_with('broken-id')
+
+    async def test_heal_restart_failure(self):
+        self.client.containers.return_value = [summary('broken', 'exited', 'Exited (1) 1 minute ago')]
+        self.client.inspect_container.return_value = inspect(1)
+        self.client.restart.side_effect = AsyncDockerError(500, 'failed to set up network')
+        self.client.disconnect_container_from_network.side_effect = AsyncDockerNotFound(404, 'no such network')
+
+        await self.obj.heal()
+        await self.obj.restarting['broken']
+        self.client.disconnect_container_from_network.assert_awaited_once_with('broken-id',
+                                                                               utils.nuvlaedge_shared_net)
+
+        # the outcome is reported by the next run
+        self.client.containers.return_value = []
+        self.obj.restarting['broken'] = self.obj.loop.create_task(asyncio.sleep(3600))
+        self.obj.restart_notes['broken'] = (utils.status_degraded, 'Container broken is down')
+        pending = self.obj.restarting['broken']
+        self.assertEqual(await self.obj.heal(), [],
+                         'Notes about containers that are gone should be dropped')
+        await asyncio.sleep(0)
+        self.assertTrue(pending.cancelled(),
+                        'Restart of a container that is gone should be cancelled')
+
+    async def test_heal_reports_down_containers(self):
+        self.client.containers.return_value = [summary('broken', 'exited', 'Exited (1) 1 minute ago')]
+        self.client.inspect_container.return_value = inspect(1)
+        self.client.restart.side_effect = AsyncDockerError(500, 'boom')
+
+        await self.obj.heal()
+        await self.obj.restarting['broken']
+        self.assertEqual(await self.obj.heal(), [(utils.status_degraded, 'Container broken is down')],
+                         'Failed to report container that could not be restarted')
+
+    async def test_heal_drops_notes_of_recovered_containers(self):
+        self.client.containers.return_value = [summary('broken', 'exited', 'Exited (1) 1 minute ago')]
+        self.client.inspect_container.return_value = inspect(1)
+        self.client.restart.side_effect = AsyncDockerError(500, 'boom')
+
+        await self.obj.heal()
+        await self.obj.restarting['broken']
+        self.obj.restart_delay = 3600
+        self.assertEqual(len(await self.obj.heal()), 1)
+        pending = self.obj.restarting['broken']
+
+        # back up, but not thanks to the healer
+        self.client.containers.return_value = [summary('broken', 'running', 'Up 1 second')]
+        self.assertEqual(await self.obj.heal(), [],
+                         'A container that is back up should not be reported as down')
+        await asyncio.sleep(0)
+        self.assertTrue(pending.cancelled(),
+                        'Restart of a container that is back up should be cancelled')
+        self.assertEqual(self.obj.restarting, {})
+
+    async def test_heal_crash_looping_container(self):
+        self.obj.crash_loops.max_failures = 2
+        self.client.containers.return_value = [summary('broken', 'exited', 'Exited (1) 1 minute ago')]
+        for i in range(3):
+            self.client.inspect_container.return_value = {**inspect(1), 'State': {'ExitCode': 1,
+                                                                                  'FinishedAt': f'crash-{i}'}}
+            notes = await self.obj.heal()
+            if 'broken' in self.obj.restarting:
+                await self.obj.restarting.pop('broken')
+
+        self.assertEqual(self.client.restart.await_count, 1,
+                         'Should not restart a container that keeps crashing')
+        self.assertEqual(len(notes), 1)
+        self.assertIn('crash looping', notes[0][1],
+                      'Failed to report the crash loop')
+
+    async def test_heal_in_waves(self):
+        self.obj.healer_mode = 'waves'
+        self.obj.restart_delay = 3600
+        agent = summary('agent', 'exited', 'Exited (255) 1 minute ago')
+        agent['Labels'] = {'com.docker.compose.service': 'agent',
+                           'com.docker.compose.depends_on': 'security:service_started:false'}
+        security = summary('security', 'created')
+        security['Labels'] = {'com.docker.compose.service': 'security'}
+        self.client.containers.return_value = [agent, security]
+        self.client.inspect_container.return_value = inspect(255)
+
+        healed = []
+        self.client.start.side_effect = lambda cid: healed.append(cid)
+        self.client.restart.side_effect = lambda cid: healed.append(cid)
+        await self.obj.heal()
+        self.assertEqual(healed, ['security-id', 'agent-id'],
+                         'Failed to heal containers by dependency order, right away')
+        self.assertEqual(self.obj.restarting, {})
+
+    async def test_run_jobs(self):
+        order = []
+        self.scheduler.add_job('data-gateway', lambda: order.append('data-gateway'), 60,
+                               priority=50, depends_on=['classification'])
+        self.scheduler.add_job('classification', lambda: order.append('classification'), 60, priority=90)
+        self.scheduler.add_job('healer', mock.MagicMock(), 60, priority=70)
+        self.client.containers.return_value = []
+
+        self.assertEqual(self.obj.start_due_jobs(), ['classification', 'healer', 'data-gateway'],
+                         'Failed to start jobs by priority')
+        self.assertEqual(self.obj.start_due_jobs(), [],
+                         'Running jobs should not be started again')
+        await asyncio.gather(*self.obj.tasks.values())
+
+        self.assertEqual(order, ['classification', 'data-gateway'],
+                         'Dependency order was not respected')
+        self.scheduler.jobs['healer'].func.assert_not_called()
+        self.store_result.assert_called_once_with('healer', [])
+        self.assertTrue(self.obj._report.is_set(),
+                        'Status should be written once checks are done')
+        self.assertEqual([j.runs for j in self.scheduler.jobs.values()], [1, 1, 1],
+                         'Failed to account for the jobs runs')
+        self.assertGreater(self.scheduler.time_until_next(), 0,
+                           'Jobs should have been rescheduled')
+
+    async def test_run_jobs_timeout(self):
+        release = threading.Event()
+        self.scheduler.add_job('data-gateway', lambda: release.wait(5), 60, priority=50, timeout=0.1)
+        self.scheduler.add_job('data-gateway-load', mock.MagicMock(), 60, priority=30, depends_on=['data-gateway'],
+                               timeout=0.1)
+
+        self.obj.start_due_jobs()
+        await asyncio.wait_for(asyncio.gather(*self.obj.tasks.values()), 2)
+        job = self.scheduler.jobs['data-gateway']
+        self.assertEqual(job.timeouts, 1)
+        self.assertEqual(self.scheduler.jobs['data-gateway-load'].timeouts, 0,
+                         'A check stuck past its timeout should not hold up the others')
+        self.scheduler.jobs['data-gateway-load'].func.assert_called_once()
+        self.assertTrue(job.running,
+                        'A check that is still running should not be finished')
+        self.assertEqual(self.obj.start_due_jobs(), [],
+                         'A check that is still running should not be started again')
+
+        release.set()
+        for _ in range(40):
+            if not any(j.running for j in self.scheduler.jobs.values()):
+                break
+            await asyncio.sleep(0.05)
+        self.assertEqual([j.running for j in self.scheduler.jobs.values()], [False, False],
+                         'Checks should be finished once they return')
+        self.assertEqual([j.runs for j in self.scheduler.jobs.values()], [1, 1])
+        self.scheduler.jobs['data-gateway-load'].func.assert_called_once()
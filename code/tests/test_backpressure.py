@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import mock
+import unittest
+import system_manager.common.Backpressure as Backpressure
+from system_manager.common.ApiAccounting import ApiCall, RoundReport
+from system_manager.common.Backpressure import DaemonBackpressure, LEVEL_NORMAL, LEVEL_OVERLOADED, LEVEL_SLOW
+
+
+class DaemonBackpressureTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.obj = DaemonBackpressure(slow_ms=100, overloaded_ms=500, recovery_rounds=2, smoothing=1)
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_round_latency(self):
+        self.assertIsNone(Backpressure.round_latency(RoundReport([])))
+        report = RoundReport([ApiCall('GET /containers/json', 'x', 0.01, None),
+                              ApiCall('GET /containers/{id}/json', 'x', 0.03, None),
+                              ApiCall('POST /containers/{id}/restart', 'x', 10, None),
+                              ApiCall('GET /events', 'x', 60, None)])
+        self.assertAlmostEqual(Backpressure.round_latency(report), 20,
+                               msg='Only the latency of the short read calls should be considered')
+
+    def test_levels(self):
+        self.assertEqual(self.obj.observe(None), LEVEL_NORMAL,
+                         'No samples should not change anything')
+        self.assertEqual(self.obj.observe(50, None), LEVEL_NORMAL)
+        self.assertEqual(self.obj.status_notes(), [])
+
+        # backing off is immediate
+        self.assertEqual(self.obj.observe(20, 600), LEVEL_OVERLOADED,
+                         'The slowest sample should be considered')
+        self.assertEqual(self.obj.stretch, 4)
+        self.assertTrue(self.obj.skips('requirements'))
+        self.assertFalse(self.obj.skips('healer'),
+                         'Critical checks should never be skipped')
+        self.assertIn('skipping requirements', self.obj.status_notes()[0][1])
+
+        # recovering is gradual
+        self.assertEqual(self.obj.observe(10), LEVEL_OVERLOADED)
+        self.assertEqual(self.obj.observe(10), LEVEL_SLOW,
+                         'Should only go down one level, after a few rounds')
+        self.assertEqual(self.obj.stretch, 2)
+        self.assertFalse(self.obj.skips('requirements'))
+        self.assertEqual(len(self.obj.status_notes()), 1)
+        self.assertEqual(self.obj.observe(200), LEVEL_SLOW,
+                         'A slow round should reset the recovery')
+        self.obj.observe(10)
+        self.assertEqual(self.obj.observe(10), LEVEL_NORMAL)
+        self.assertEqual(Backpressure.metrics.backpressure_level.value(), LEVEL_NORMAL)
+
+    def test_smoothing(self):
+        self.obj.smoothing = 0.5
+        self.obj.observe(0)
+        self.assertEqual(self.obj.observe(300), LEVEL_SLOW,
+                         'A single slow round should be smoothed out')
+        self.assertEqual(self.obj.latency_ms, 150)
+
+    def test_probe(self):
+        self.assertIsNone(self.obj.probe())
+        self.obj.ping = mock.MagicMock()
+        self.assertLess(self.obj.probe(), 100)
+        self.obj.ping.side_effect = ConnectionError('timeout')
+        self.assertGreaterEqual(self.obj.probe(), 500,
+                                'A failed ping should count as an overload')
+
+        report = RoundReport([])
+        self.assertEqual(self.obj.observe_round(report, self.obj.probe()), LEVEL_OVERLOADED)
+
+    def test_ping_accounted_in_its_round(self):
+        import manager_main
+
+        accounting = manager_main.accounting
+        accounting.end_round()
+        ping = mock.MagicMock(side_effect=lambda: accounting.record('GET /_ping', 0.001))
+        with mock.patch.object(manager_main.backpressure, 'ping', ping), \
+                mock.patch.object(manager_main, 'report_operational_status'), \
+                mock.patch.object(manager_main, 'store_check_result'):
+            self.assertEqual(manager_main.end_of_round().count, 1,
+                             'The ping should be accounted in the round it measures')
+            self.assertEqual(manager_main.end_of_round(probe=False).count, 0,
+                             'The ping should not be charged to the next round')
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import docker
+import os
+import tempfile
+import unittest
+import tests.benchmark as benchmark
+from tests.utils.fake_docker import FakeDockerDaemon
+
+
+class FakeDockerDaemonTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.daemon = FakeDockerDaemon(os.path.join(self.tmp.name, 'docker.sock'), containers=30, networks=8,
+                                       nodes=2, hostname='myself').start()
+        self.client = docker.DockerClient(base_url=self.daemon.base_url)
+
+    def tearDown(self):
+        self.client.close()
+        self.daemon.stop()
+        self.tmp.cleanup()
+
+    def test_state(self):
+        self.assertEqual(len(self.client.api.containers(all=True)), 30,
+                         'Failed to simulate the requested number of containers')
+        self.assertEqual(len(self.client.networks.list()), 8,
+                         'Failed to simulate the requested number of networks')
+        self.assertEqual(self.client.containers.get('myself').name, 'nuvlaedge-system-manager-1',
+                         'The system manager should be found by its hostname')
+
+        project = self.client.api.containers(all=True, filters={'label': 'com.docker.compose.project=nuvlaedge'})
+        self.assertEqual(len(project), 7,
+                         'Failed to filter containers by label')
+
+        swarm = self.client.info()['Swarm']
+        self.assertEqual([m['NodeID'] for m in swarm['RemoteManagers']], [swarm['NodeID']],
+                         'This node should be the only manager')
+
+    def test_changes(self):
+        network = self.client.networks.get('nuvlaedge-shared-network')
+        network.connect('nuvlaedge-agent-1')
+        self.assertIn('nuvlaedge-shared-network',
+                      self.client.containers.get('nuvlaedge-agent-1').attrs['NetworkSettings']['Networks'],
+                      'Failed to connect container')
+        self.assertRaises(docker.errors.APIError, network.connect, 'nuvlaedge-agent-1')
+
+        self.client.api.restart('nuvlaedge-agent-1')
+        self.assertEqual(self.client.containers.get('nuvlaedge-agent-1').attrs['RestartCount'], 1,
+                         'Failed to restart container')
+        self.assertRaises(docker.errors.NotFound, self.client.containers.get, 'nope')
+
+    def test_latency(self):
+        self.daemon.latency = {'GET /info': 0.2}
+        self.assertEqual(self.daemon.latency_of('GET /info'), 0.2)
+        self.assertEqual(self.daemon.latency_of('GET /version'), 0,
+                         'Latency should only be injected on the given endpoints')
+
+    def test_events(self):
+        events = self.client.events(decode=True)
+        self.daemon.emit({'Type': 'container', 'Action': 'die', 'Actor': {'ID': 'abc', 'Attributes': {}}})
+        self.assertEqual(next(events)['Action'], 'die',
+                         'Failed to stream event')
+        events.close()
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def test_run_scenario(self):
+        result = benchmark.run_scenario('small', rounds=4)
+        self.assertEqual(result['rounds'], 4,
+                         'Failed to run the requested number of rounds')
+        for metric in benchmark.CYCLE_METRICS:
+            self.assertEqual(set(result[metric]), {'min', 'median', 'p95', 'max'},
+                             f'Missing statistics for {metric}')
+        self.assertGreater(result['rss_kb']['peak'], 0)
+
+        # once the NuvlaEdge components are resolved, a round of checks takes a handful of API calls
+        self.assertLessEqual(result['api_calls']['max'], 12,
+                             f'Too many API calls per round: {result}')
+        self.assertGreater(result['first_cycle']['api_calls'], result['api_calls']['max'],
+                           'The first round should be the most expensive')
+
+    def test_format_results(self):
+        scenario = {'first_cycle': {'cycle_ms': 40.0}, 'rss_kb': {'peak': 1000},
+                    **{m: {'median': 10.0} for m in benchmark.CYCLE_METRICS}}
+        baseline = {'label': 'old', 'created': 'then', 'scenarios': {'small': scenario}}
+        results = {'label': 'new', 'created': 'now',
+                   'scenarios': {'small': {**scenario, 'cycle_ms': {'median': 15.0}}}}
+
+        table = benchmark.format_results(results, baseline)
+        self.assertIn('new (now) vs. old (then)', table)
+        self.assertIn('(was 10.000, +50.0%)', table,
+                      'Failed to compare with baseline')
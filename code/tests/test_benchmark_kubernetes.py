@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import mock
+import os
+import unittest
+import tests.benchmark_kubernetes as benchmark
+from kubernetes import client
+from tests.utils.fake_kubernetes import FakeKubernetesApiServer, matches_selector
+
+
+class FakeKubernetesApiServerTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.server = FakeKubernetesApiServer(nodes=2, pods_per_node=30).start()
+        self.client = client.CoreV1Api(client.ApiClient(client.Configuration(host=self.server.url)))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_selectors(self):
+        labels = {'app': 'a', 'tier': 'web'}
+        self.assertTrue(matches_selector(labels, 'app=a,tier'))
+        self.assertTrue(matches_selector(labels, 'app==a,tier!=db,!other'))
+        self.assertFalse(matches_selector(labels, 'app=b'))
+        self.assertFalse(matches_selector(labels, 'other'))
+
+        pods = self.client.list_namespaced_pod('nuvlaedge', label_selector='component=nuvlaedge-engine-core').items
+        self.assertEqual([p.metadata.name for p in pods], ['nuvlaedge-engine-core'],
+                         'Failed to select pods by label')
+        pods = self.client.list_pod_for_all_namespaces(field_selector='spec.nodeName=node-1').items
+        self.assertEqual(len(pods), 30,
+                         'Failed to select pods by node')
+
+    def test_pagination(self):
+        names = []
+        _continue = None
+        while True:
+            page = self.client.list_pod_for_all_namespaces(field_selector='spec.nodeName=node-0', limit=7,
+                                                           _continue=_continue)
+            self.assertLessEqual(len(page.items), 7)
+            names += [p.metadata.name for p in page.items]
+            _continue = page.metadata._continue
+            if not _continue:
+                break
+
+        self.assertEqual(len(names), 32,
+                         'Failed to list all the pods, page by page')
+        self.assertEqual(self.server.requests['GET /api/v1/pods'], 5)
+
+    def test_read(self):
+        node = self.client.read_node('node-0')
+        self.assertIn('node-role.kubernetes.io/master', node.metadata.labels,
+                      'The first node should be a master')
+        self.assertTrue(node.status.node_info.kubelet_version.startswith('v1.'))
+
+        log = self.client.read_namespaced_pod_log(namespace='nuvlaedge', name='nuvlaedge-engine-core',
+                                                  container='nuvlaedge-agent', tail_lines=3)
+        self.assertEqual(len(log.splitlines()), 3,
+                         'Failed to tail the logs')
+        self.assertRaises(client.ApiException, self.client.read_node, 'node-42')
+
+
+class BenchmarkKubernetesTestCase(unittest.TestCase):
+
+    @mock.patch.dict(os.environ, {'NUVLAEDGE_K8S_LIST_LIMIT': '10'})
+    def test_run_scenario(self):
+        result = benchmark.run_scenario('single-node', rounds=2)
+        self.assertEqual(set(result['operations']),
+                         {'requirements_check', 'classify_this_node', 'list_node_containers', 'fetch_logs'},
+                         'Missing operations')
+
+        calls = {operation: metrics['api_calls']['max'] for operation, metrics in result['operations'].items()}
+        # the node info, and then the list of nodes
+        self.assertEqual(calls['classify_this_node'], 2)
+        # 22 pods in this node, in pages of 10
+        self.assertEqual(calls['list_node_containers'], 3,
+                         'Pods should have been listed page by page')
+        # the NuvlaEdge pods, and then the logs of each of their 6 containers
+        self.assertEqual(calls['fetch_logs'], 7)
+        self.assertGreater(result['rss_kb']['peak'], 0)
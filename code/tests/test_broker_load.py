@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import unittest
+import system_manager.common.BrokerLoad as BrokerLoad
+from system_manager.common import utils
+from tests.utils.fake_mqtt import FakeMqttBroker
+
+SYS_TOPICS = {
+    '$SYS/broker/version': b'mosquitto version 2.0.15',
+    '$SYS/broker/uptime': b'3600 seconds',
+    '$SYS/broker/load/messages/received/1min': b'540.00',
+    '$SYS/broker/load/messages/sent/1min': b'60.00',
+    '$SYS/broker/load/bytes/received/1min': b'61440.00',
+    '$SYS/broker/load/bytes/sent/1min': b'0.00',
+    '$SYS/broker/clients/connected': b'12',
+    '$SYS/broker/publish/messages/dropped': b'100',
+    '$SYS/broker/messages/inflight': b'3',
+    '$SYS/broker/store/messages/count': b'5000',
+    '$SYS/broker/heap/current': b'2097152',
+}
+
+
+class BrokerLoadTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.broker = FakeMqttBroker(retained=dict(SYS_TOPICS)).start()
+        self.obj = BrokerLoad.BrokerLoadMonitor('127.0.0.1', self.broker.port, timeout=1, settle=0.1)
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        self.broker.stop()
+        logging.disable(logging.NOTSET)
+
+    def test_parse_number(self):
+        self.assertEqual(BrokerLoad.parse_number(b'12.5'), 12.5)
+        self.assertEqual(BrokerLoad.parse_number(b'3600 seconds'), 3600)
+        self.assertIsNone(BrokerLoad.parse_number(b'mosquitto version 2.0.15'))
+        self.assertIsNone(BrokerLoad.parse_number(b''))
+
+    def test_poll(self):
+        stats = self.obj.poll()
+        self.assertEqual(stats, {'messages_per_s': 10, 'bytes_per_s': 1024, 'clients': 12, 'inflight': 3,
+                                 'stored': 5000, 'heap_bytes': 2097152},
+                         'Dropped messages/s need two samples')
+        self.assertEqual(BrokerLoad.metrics.data_gateway_load.value(stat='clients'), 12)
+        self.assertEqual(self.obj.status_notes(),
+                         [(utils.status_operational, 'Data Gateway load: 10 msg/s, 1.0 kB/s, 12 clients, '
+                                                     '3 inflight, 5000 stored, heap 2.0 MB')])
+
+        self.broker.retained['$SYS/broker/publish/messages/dropped'] = b'100'
+        self.assertEqual(self.obj.poll()['dropped_per_s'], 0)
+        self.assertEqual(self.obj.saturated(), [])
+
+        self.broker.retained['$SYS/broker/publish/messages/dropped'] = b'200'
+        self.broker.retained['$SYS/broker/clients/connected'] = b'2000'
+        self.obj.poll()
+        saturated = self.obj.saturated()
+        self.assertEqual(len(saturated), 2)
+        self.assertIn('2000 connected clients (max 1000)', saturated)
+        notes = self.obj.status_notes()
+        self.assertEqual(notes[-1][0], utils.status_degraded)
+        self.assertIn('Data Gateway is saturated', notes[-1][1])
+
+    def test_thresholds(self):
+        self.assertEqual(self.obj.saturated({'dropped_per_s': 1, 'inflight': 3, 'stored': 5000}), [],
+                         'A few dropped messages, or many retained ones, are not saturation')
+        self.assertEqual(self.obj.saturated({'stored': 200000}), ['200000 stored messages (max 100000)'])
+
+    def test_unreachable(self):
+        self.broker.stop()
+        self.assertEqual(self.obj.poll(), {})
+        self.assertEqual(self.obj.status_notes(), [])
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import OpenSSL
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from system_manager.common.CertificateInventory import CertificateInventory
+
+
+def make_cert(not_after: datetime) -> bytes:
+    key = OpenSSL.crypto.PKey()
+    key.generate_key(OpenSSL.crypto.TYPE_RSA, 1024)
+    cert = OpenSSL.crypto.X509()
+    cert.get_subject().CN = 'nuvlaedge'
+    cert.set_serial_number(1)
+    cert.set_notBefore(b'20200101000000Z')
+    cert.set_notAfter(not_after.strftime('%Y%m%d%H%M%SZ').encode())
+    cert.set_issuer(cert.get_subject())
+    cert.set_pubkey(key)
+    cert.sign(key, 'sha256')
+    return OpenSSL.crypto.dump_certificate(OpenSSL.crypto.FILETYPE_PEM, cert)
+
+
+class CertificateInventoryTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.now = datetime(2030, 1, 1, 12)
+        self.obj = CertificateInventory(self.tmp.name, clock=lambda: self.now)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name: str, not_after: datetime):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(make_cert(not_after))
+        # make sure the change is noticed, even within the mtime granularity
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+    def test_refresh(self):
+        self.assertFalse(self.obj.refresh(),
+                         'Nothing should have changed without files')
+        self.assertEqual(self.obj.days_left(), {},
+                         'No certificates, no days left')
+
+        self.write('ca.pem', datetime(2031, 1, 1))
+        self.write('cert.pem', datetime(2030, 1, 11))
+        self.assertTrue(self.obj.refresh(),
+                        'Failed to notice new certificates')
+        self.assertEqual(self.obj.days_left(), {'ca.pem': 364, 'cert.pem': 9},
+                         'Failed to compute days left')
+
+        # files are only parsed when they change
+        self.assertFalse(self.obj.refresh(),
+                         'Nothing should have changed')
+        self.assertEqual(self.obj.parses, 2,
+                         'Certificates were parsed again without changes')
+
+        self.write('cert.pem', datetime(2030, 2, 1))
+        self.assertTrue(self.obj.refresh(),
+                        'Failed to notice changed certificate')
+        self.assertEqual(self.obj.parses, 3,
+                         'Only the changed certificate should have been parsed')
+
+        os.remove(os.path.join(self.tmp.name, 'ca.pem'))
+        self.assertTrue(self.obj.refresh(),
+                        'Failed to notice removed certificate')
+        self.assertEqual(list(self.obj.days_left()), ['cert.pem'],
+                         'Removed certificate should be forgotten')
+
+    def test_invalid_certificate(self):
+        with open(os.path.join(self.tmp.name, 'cert.pem'), 'w') as f:
+            f.write('not a certificate')
+        self.assertTrue(self.obj.refresh(),
+                        'Failed to notice new file')
+        self.assertEqual(self.obj.days_left(), {},
+                         'Invalid certificate should not be reported')
+
+    def test_expiring(self):
+        self.write('ca.pem', datetime(2031, 1, 1))
+        self.write('cert.pem', datetime(2030, 1, 11))
+        self.assertEqual(self.obj.expiring(), [],
+                         'No certificate is about to expire')
+        self.assertEqual(self.obj.next_deadline(), datetime(2030, 1, 6),
+                         'Failed to compute the next time a decision can change')
+
+        # before the deadline, the decision is not recomputed
+        self.now = datetime(2030, 1, 5, 23, 59)
+        self.obj._expiring = ['bogus']
+        self.assertEqual(self.obj.expiring(), ['bogus'],
+                         'Decision should come from the cache before the deadline')
+
+        # once the deadline is passed, it is
+        self.now = datetime(2030, 1, 6, 0, 1)
+        self.assertEqual(self.obj.expiring(), ['cert.pem'],
+                         'Failed to find expiring certificate')
+
+        # and a new certificate changes the decision right away
+        self.write('cert.pem', datetime(2031, 1, 1))
+        self.assertEqual(self.obj.expiring(), [],
+                         'Failed to notice renewed certificate')
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import docker
+import logging
+import mock
+import requests
+import unittest
+import tests.utils.fake as fake
+from system_manager.common import utils
+from system_manager.common.ComponentRegistry import ComponentRegistry
+
+
+class ComponentRegistryTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.container_runtime = mock.MagicMock()
+        self.container_runtime.credentials_manager_component = 'nuvlaedge-compute-api'
+        self.obj = ComponentRegistry(self.container_runtime)
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_resolve_system_manager(self):
+        myself = fake.MockContainer('nuvlaedge-system-manager', status='running', myid='my-id')
+        self.container_runtime.find_current_container.return_value = myself
+
+        # resolved only once, together with the project name
+        self.assertEqual(self.obj.get_id(ComponentRegistry.SYSTEM_MANAGER), 'my-id',
+                         'Failed to resolve the system manager container')
+        self.assertEqual(self.obj.project_name, 'nuvlaedge',
+                         'Failed to get the project name from the system manager labels')
+        self.assertEqual(self.obj.get_id(ComponentRegistry.SYSTEM_MANAGER), 'my-id',
+                         'Failed to get the system manager container ID')
+        self.container_runtime.find_current_container.assert_called_once()
+        self.assertEqual(self.obj.resolutions, 1,
+                         'System manager should have been resolved only once')
+
+        # if the label is missing, infer the project name from the container name
+        myself.labels.pop('com.docker.compose.project')
+        myself.name = 'project-good-name'
+        self.obj.invalidate()
+        self.assertEqual(self.obj.project_name, 'project',
+                         'Failed to infer the project name from the container name')
+
+    def test_resolve_agent(self):
+        self.container_runtime.find_current_container.return_value = fake.MockContainer(myid='my-id')
+        self.container_runtime.list_containers.return_value = []
+        self.assertIsNone(self.obj.get_container(ComponentRegistry.AGENT),
+                          'Found an agent that does not exist')
+
+        agent = fake.MockContainer('agent', myid='agent-id')
+        self.container_runtime.list_containers.return_value = [agent]
+        self.assertEqual(self.obj.get_container(ComponentRegistry.AGENT), agent,
+                         'Failed to find agent container')
+        self.assertIn('com.docker.compose.project=nuvlaedge',
+                      self.container_runtime.list_containers.call_args[1]['filters']['label'],
+                      'Agent should be searched within the compose project')
+
+        # once known, the agent is looked up by ID
+        self.container_runtime.list_containers.reset_mock()
+        self.container_runtime.client.containers.get.return_value = agent
+        self.assertEqual(self.obj.get_container(ComponentRegistry.AGENT), agent,
+                         'Failed to get agent container by ID')
+        self.container_runtime.client.containers.get.assert_called_once_with('agent-id')
+        self.container_runtime.list_containers.assert_not_called()
+
+    def test_get_container_not_found(self):
+        old = fake.MockContainer(utils.data_gateway_name, myid='old-id')
+        new = fake.MockContainer(utils.data_gateway_name, myid='new-id')
+        self.container_runtime.client.containers.get.return_value = old
+        self.assertEqual(self.obj.get_id(ComponentRegistry.DATA_GATEWAY), 'old-id',
+                         'Failed to resolve the data gateway by name')
+        self.container_runtime.client.containers.get.assert_called_once_with(utils.data_gateway_name)
+
+        # when the known container is gone, resolve again
+        self.container_runtime.client.containers.get.side_effect = [docker.errors.NotFound('', requests.Response()),
+                                                                    new]
+        self.assertEqual(self.obj.get_container(ComponentRegistry.DATA_GATEWAY), new,
+                         'Failed to resolve the data gateway again after NotFound')
+        self.assertEqual(self.obj.get_id(ComponentRegistry.DATA_GATEWAY), 'new-id',
+                         'Failed to keep the new data gateway ID')
+
+        # and if it does not exist at all, get None
+        self.container_runtime.client.containers.get.side_effect = docker.errors.NotFound('', requests.Response())
+        self.obj.invalidate(ComponentRegistry.DATA_GATEWAY)
+        self.assertIsNone(self.obj.get_container(ComponentRegistry.DATA_GATEWAY),
+                          'Found a data gateway that does not exist')
+
+    def test_handle_event(self):
+        self.container_runtime.client.containers.get.return_value = fake.MockContainer(myid='on-stop-id')
+        self.obj.get_id(ComponentRegistry.ON_STOP)
+        self.assertEqual(self.obj.resolutions, 1,
+                         'Failed to resolve on-stop container')
+
+        # irrelevant events change nothing
+        self.obj.handle_event({'Type': 'container', 'Action': 'die', 'Actor': {'ID': 'on-stop-id'}})
+        self.obj.handle_event({'Type': 'container', 'Action': 'destroy', 'Actor': {'ID': 'other-id'}})
+        self.obj.get_id(ComponentRegistry.ON_STOP)
+        self.assertEqual(self.obj.resolutions, 1,
+                         'Should not have resolved on-stop container again')
+
+        # but when the container is destroyed, it is resolved again
+        self.obj.handle_event({'Type': 'container', 'Action': 'destroy', 'Actor': {'ID': 'on-stop-id'}})
+        self.obj.get_id(ComponentRegistry.ON_STOP)
+        self.assertEqual(self.obj.resolutions, 2,
+                         'Failed to resolve on-stop container after it was destroyed')
+
+    def test_register(self):
+        resolver = mock.MagicMock()
+        resolver.return_value = fake.MockContainer(myid='custom-id')
+        self.obj.register('custom', resolver)
+        self.assertEqual(self.obj.get_id('custom'), 'custom-id',
+                         'Failed to resolve custom component')
+        resolver.assert_called_once()
@@ -21,3 +21,51 @@ class ContainersCase(unittest.TestCase):
     def test_init(self):
         self.assertIsInstance(self.obj.container_runtime, ContainerRuntime.Docker,
                               'Failed to initialize container_runtime variable')
+
+    def test_shared_container_runtime(self):
+        # all instances share the same container runtime, which is only created once
+        with mock.patch('system_manager.common.ContainerRuntime.Docker') as mock_docker:
+            other = ContainerRuntime.Containers(logging)
+            mock_docker.assert_not_called()
+        self.assertIs(other.container_runtime, self.obj.container_runtime,
+                      'Container runtime should be shared by all instances')
+
+    @mock.patch('system_manager.common.ContainerRuntime._container_runtime', None)
+    @mock.patch('os.path.exists')
+    def test_get_container_runtime(self, mock_exists):
+        # without the Docker socket, there is no container runtime
+        mock_exists.return_value = False
+        self.assertRaises(Exception, ContainerRuntime.get_container_runtime, logging)
+
+        mock_exists.return_value = True
+        with mock.patch('system_manager.common.ContainerRuntime.Docker') as mock_docker:
+            runtime = ContainerRuntime.get_container_runtime(logging)
+            self.assertIs(ContainerRuntime.get_container_runtime(logging), runtime,
+                          'Failed to reuse the container runtime')
+            mock_docker.assert_called_once_with(logging)
+
+
+class NodeInfoSnapshotCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.container_runtime = mock.MagicMock()
+        self.container_runtime.get_node_info.return_value = {'Swarm': {'NodeID': 'id'}}
+        self.obj = ContainerRuntime.NodeInfoSnapshot(self.container_runtime)
+
+    def test_get(self):
+        # fetched only once, no matter how many times it is read
+        for _ in range(3):
+            self.assertEqual(self.obj.get(), {'Swarm': {'NodeID': 'id'}},
+                             'Failed to get node info from snapshot')
+        self.container_runtime.get_node_info.assert_called_once()
+        self.assertEqual(self.obj.fetch_count, 1,
+                         'Node info should have been fetched only once')
+
+    def test_invalidate(self):
+        self.obj.get()
+        self.obj.invalidate()
+        self.container_runtime.get_node_info.return_value = {}
+        self.assertEqual(self.obj.get(), {},
+                         'Failed to refresh node info after invalidating snapshot')
+        self.assertEqual(self.obj.fetch_count, 2,
+                         'Node info should have been fetched again after invalidating snapshot')
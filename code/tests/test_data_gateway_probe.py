@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import unittest
+import system_manager.common.DataGatewayProbe as DataGatewayProbe
+from system_manager.common.DataGatewayProbe import LatencyWindow, PROBE_FAILED, PROBE_OK, PROBE_UNREACHABLE
+from tests.utils.fake_mqtt import FakeMqttBroker
+
+
+class LatencyWindowTestCase(unittest.TestCase):
+
+    def test_percentiles(self):
+        window = LatencyWindow(size=100)
+        self.assertIsNone(window.percentile(50))
+        self.assertEqual(window.summary(), {})
+
+        for i in range(1, 201):
+            window.add(i / 1000)
+        self.assertEqual(len(window.samples), 100,
+                         'Only the most recent samples should be kept')
+        self.assertEqual(window.percentile(50), 0.15)
+        self.assertEqual(window.percentile(100), 0.2)
+        self.assertEqual(window.summary(), {'p50': 150.0, 'p95': 195.0, 'p99': 199.0})
+
+
+class DataGatewayProbeTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.broker = FakeMqttBroker().start()
+        self.obj = DataGatewayProbe.DataGatewayProbe('127.0.0.1', self.broker.port, timeout=0.5)
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        self.broker.stop()
+        logging.disable(logging.NOTSET)
+
+    def test_round_trip(self):
+        failures = DataGatewayProbe.metrics.data_gateway_probes.value(result=PROBE_FAILED)
+        self.assertEqual(self.obj.run(), PROBE_OK)
+        self.assertEqual(self.obj.run(), PROBE_OK)
+        self.assertEqual(len(self.obj.round_trip_latency.samples), 2)
+        self.assertEqual(len(self.obj.connect_latency.samples), 2)
+        self.assertTrue(self.broker.published[0][0].startswith(DataGatewayProbe.PROBE_TOPIC),
+                        'Probe should publish on its reserved topic')
+        self.assertIn('round trip p50', self.obj.summary())
+
+        # a broker that accepts connections, but does not route messages, is wedged
+        self.broker.deliver = False
+        self.assertEqual(self.obj.run(), PROBE_FAILED)
+        self.assertIn('did not come back', self.obj.last_error)
+        self.assertEqual(len(self.obj.round_trip_latency.samples), 2,
+                         'Failed probes should not be sampled')
+        self.assertEqual(DataGatewayProbe.metrics.data_gateway_probes.value(result=PROBE_FAILED), failures + 1)
+
+        self.broker.silent = True
+        self.assertEqual(self.obj.run(), PROBE_FAILED)
+
+    def test_unreachable(self):
+        self.obj.host = 'data-gateway.invalid'
+        self.assertEqual(self.obj.run(), PROBE_UNREACHABLE,
+                         'A broker that cannot be resolved is not a failed broker')
+        self.assertEqual(self.obj.last_result, PROBE_UNREACHABLE)
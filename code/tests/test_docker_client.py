@@ -30,6 +30,22 @@ class DockerTestCase(unittest.TestCase):
         self.assertEqual(self.obj.my_component_name, "nuvlaedge-system-manager",
                          'Docker client was not properly initialized')
 
+    def test_docker_pool_size(self):
+        self.assertEqual(ContainerRuntime.docker_pool_size(1, 0), ContainerRuntime.DOCKER_MAX_POOL_SIZE,
+                         'Pool should not be smaller than the configured size')
+        self.assertEqual(ContainerRuntime.docker_pool_size(4, 4), 8 + ContainerRuntime.DOCKER_STREAMS,
+                         'Pool should fit the checks, the healer and the streams')
+
+    def test_set_max_pool_size(self):
+        self.obj.client = docker.DockerClient(base_url='unix:///var/run/docker.sock')
+        adapter = self.obj.client.api._custom_adapter
+        adapter.get_connection('http+docker://localhost')
+        self.obj.set_max_pool_size(11)
+        self.assertEqual(len(adapter.pools), 0,
+                         'Existing pools should be dropped')
+        self.assertEqual(adapter.get_connection('http+docker://localhost').pool.maxsize, 11,
+                         'Failed to resize the pool of connections')
+
     @mock.patch.object(ContainerRuntime.Docker, 'find_network')
     @mock.patch('system_manager.common.ContainerRuntime.Path')
     @mock.patch('os.path.exists')
@@ -87,10 +103,35 @@ class DockerTestCase(unittest.TestCase):
         self.assertIsNotNone(ContainerRuntime.utils.base_label,
                              'Failed to inherit utility variables from utils')
 
-        self.obj.client.containers.list.return_value = [True]
+        self.obj.client.api.containers.return_value = [{'Id': 'id', 'Names': ['/name'], 'State': 'running'}]
+        self.obj.client.containers.prepare_model.side_effect = lambda attrs: attrs
         # this is a simple lookup
-        self.assertEqual(self.obj.list_internal_components(), [True],
+        self.assertEqual(len(self.obj.list_internal_components()), 1,
                          'Failed to list internal components')
+        self.obj.client.api.containers.assert_called_once_with(all=False,
+                                                               filters={'label': ContainerRuntime.utils.base_label})
+        self.obj.client.containers.list.assert_not_called()
+
+    def test_list_containers(self):
+        self.obj.client.api.containers.return_value = [
+            {'Id': 'id1', 'Names': ['/c1'], 'State': 'running', 'Labels': {'foo': 'bar'}},
+            {'Id': 'id2', 'Names': ['/c2'], 'State': 'exited', 'Labels': None}
+        ]
+        self.obj.client.containers.prepare_model.side_effect = \
+            lambda attrs: docker.models.containers.Container(attrs=attrs)
+
+        # single API call, no inspect
+        containers = self.obj.list_containers(filters={'label': 'foo=bar'}, all=True)
+        self.obj.client.api.containers.assert_called_once_with(all=True, filters={'label': 'foo=bar'})
+        self.obj.client.api.inspect_container.assert_not_called()
+
+        # and the summaries look like regular containers
+        self.assertEqual([c.name for c in containers], ['c1', 'c2'],
+                         'Failed to get container names from summaries')
+        self.assertEqual([c.status for c in containers], ['running', 'exited'],
+                         'Failed to get container status from summaries')
+        self.assertEqual([c.labels for c in containers], [{'foo': 'bar'}, {}],
+                         'Failed to get container labels from summaries')
 
     def test_fetch_container_logs(self):
         self.obj.client.api.logs.return_value = b'logs'
@@ -162,6 +203,12 @@ class DockerTestCase(unittest.TestCase):
         self.assertTrue(self.obj.is_coe_enabled(),
                         'Failed to check that COE is enabled')
 
+        # if node info is provided, do not fetch it again
+        self.obj.client.info.reset_mock()
+        self.assertFalse(self.obj.is_coe_enabled(node_info={'Swarm': {}}),
+                         'Failed to use provided node info')
+        self.obj.client.info.assert_not_called()
+
     def test_infer_on_stop_docker_image(self):
         # if container does not exist, take the latest dev image
         self.obj.client.containers.get.side_effect = docker.errors.NotFound('', requests.Response())
@@ -228,6 +275,12 @@ class DockerTestCase(unittest.TestCase):
         self.assertEqual(self.obj.get_node_id(), 'id',
                          'Failed to get Node ID')
 
+        # provided node info takes precedence
+        mock_get_node_info.reset_mock()
+        self.assertEqual(self.obj.get_node_id({'Swarm': {'NodeID': 'other-id'}}), 'other-id',
+                         'Failed to get Node ID from provided node info')
+        mock_get_node_info.assert_not_called()
+
     def test_list_nodes(self):
         self.obj.client.nodes.list.return_value = ['node']
         self.assertEqual(self.obj.list_nodes(optional_filter={'filter': 'foo'}), ['node'],
@@ -335,27 +388,63 @@ class DockerTestCase(unittest.TestCase):
         self.obj.client.api.restart.side_effect = docker.errors.APIError('', requests.Response())
         self.assertRaises(docker.errors.APIError, self.obj.restart_credentials_manager)
 
-    @mock.patch.object(ContainerRuntime.Docker, 'get_current_container')
-    def test_find_nuvlaedge_agent_container(self, mock_current_container):
-        labels = mock.MagicMock()
-        labels.labels = {'com.docker.compose.project': 'nuvlaedge'}
-        mock_current_container.return_value = labels
-        self.obj.client.containers.list.return_value = ['foo']
-        self.assertEqual(self.obj.find_nuvlaedge_agent_container(), ('foo', None),
+    def test_find_nuvlaedge_agent_container(self):
+        self.obj.components = mock.MagicMock()
+        self.obj.components.get_id.return_value = 'my-id'
+        agent = mock.MagicMock()
+        agent.status = 'running'
+        self.obj.components.get_container.return_value = agent
+        self.assertEqual(self.obj.find_nuvlaedge_agent_container(), (agent, None),
                          'Failed to find Agent container')
+        self.obj.components.get_container.assert_called_once_with(ContainerRuntime.ComponentRegistry.AGENT)
+
+        # the registry returns the agent whatever its state
+        agent.status = 'exited'
+        self.assertEqual(self.obj.find_nuvlaedge_agent_container(), (None, 'Agent container not found'),
+                         'A stopped Agent should not be found')
 
-        self.obj.client.containers.list.return_value = []
+        self.obj.components.get_container.return_value = None
         self.assertEqual(self.obj.find_nuvlaedge_agent_container(), (None, 'Agent container not found'))
 
-        mock_current_container.return_value = None
+        self.obj.components.get_id.return_value = None
         self.assertEqual(self.obj.find_nuvlaedge_agent_container(), (None, 'Cannot find Agent container'))
 
+    def test_get_current_container(self):
+        self.obj.components = mock.MagicMock()
+        # the current container is resolved by the component registry
+        self.obj.components.get_container.return_value = 'myself'
+        self.obj.components.get_id.return_value = 'my-id'
+        self.assertEqual(self.obj.get_current_container(), 'myself',
+                         'Failed to get current container')
+        self.assertEqual(self.obj.get_current_container_id(), 'my-id',
+                         'Failed to get current container ID')
+        self.obj.components.get_container.assert_called_once_with(ContainerRuntime.ComponentRegistry.SYSTEM_MANAGER)
+
+        self.obj.components.get_container.return_value = self.obj.components.get_id.return_value = None
+        self.assertRaises(RuntimeError, self.obj.get_current_container)
+        self.assertRaises(RuntimeError, self.obj.get_current_container_id)
+
+    @mock.patch('socket.gethostname')
+    def test_find_current_container(self, mock_gethostname):
+        # first by hostname
+        mock_gethostname.return_value = 'hostname'
+        self.obj.client.containers.get.return_value = 'myself'
+        self.assertEqual(self.obj.find_current_container(), 'myself',
+                         'Failed to find current container by hostname')
+        self.obj.client.containers.get.assert_called_once_with('hostname')
+
+        # and raise if nothing works
+        self.obj.client.containers.get.side_effect = docker.errors.NotFound('', requests.Response())
+        with mock.patch('system_manager.common.ContainerRuntime.open') as mock_open:
+            mock_open.side_effect = FileNotFoundError
+            self.assertRaises(RuntimeError, self.obj.find_current_container)
+
     def test_list_all_containers_in_this_node(self):
         # simple lookup
-        self.obj.client.containers.list.return_value = []
+        self.obj.client.api.containers.return_value = []
         self.assertEqual(self.obj.list_all_containers_in_this_node(), [],
                          'Failed to list all containers')
-        self.obj.client.containers.list.assert_called_once_with(all=True)
+        self.obj.client.api.containers.assert_called_once_with(all=True, filters=None)
 
     @mock.patch.object(ContainerRuntime.Docker, 'get_node_info')
     def test_count_images_in_this_host(self, mock_get_node_info):
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import mock
+import unittest
+from system_manager.common import utils
+from system_manager.common.EventMonitor import DockerEventMonitor
+
+
+def docker_event(event_type, action, attributes):
+    return {'Type': event_type, 'Action': action, 'Actor': {'ID': 'id', 'Attributes': attributes}}
+
+
+class FakeStream(object):
+    def __init__(self, events):
+        self.events = events
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def close(self):
+        self.closed = True
+
+
+class DockerEventMonitorTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.container_runtime = mock.MagicMock()
+        self.on_change = mock.MagicMock()
+        self.on_resync = mock.MagicMock()
+        self.obj = DockerEventMonitor(self.container_runtime, 'nuvlaedge',
+                                      self.on_change, self.on_resync, reconnect_interval=0)
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_filters(self):
+        self.assertEqual(self.obj.filters['type'], ['container', 'network'],
+                         'Should only listen to container and network events')
+        self.assertEqual(sorted(self.obj.filters['event']), ['destroy', 'die', 'disconnect', 'oom'],
+                         'Listening to the wrong events')
+
+    def test_is_relevant(self):
+        # NuvlaEdge containers are relevant, either by component or by compose project label
+        self.assertTrue(self.obj.is_relevant(docker_event('container', 'die', {'nuvlaedge.component': 'True'})),
+                        'Failed to recognize event from NuvlaEdge component')
+        self.assertTrue(self.obj.is_relevant(docker_event('container', 'oom',
+                                                          {'com.docker.compose.project': 'nuvlaedge'})),
+                        'Failed to recognize event from NuvlaEdge compose project')
+        self.assertFalse(self.obj.is_relevant(docker_event('container', 'die', {'foo': 'bar'})),
+                         'Third-party containers are not relevant')
+        self.assertFalse(self.obj.is_relevant(docker_event('container', 'start', {'nuvlaedge.component': 'True'})),
+                         'Only some actions are relevant')
+
+        # networks are matched by name
+        self.assertTrue(self.obj.is_relevant(docker_event('network', 'disconnect', {'name': 'nuvlaedge_default'})),
+                        'Failed to recognize disconnection from the NuvlaEdge network')
+        self.assertTrue(self.obj.is_relevant(docker_event('network', 'destroy', {'name': utils.nuvlaedge_shared_net})),
+                        'Failed to recognize destruction of the Data Gateway network')
+        self.assertTrue(self.obj.is_relevant(docker_event('network', 'disconnect',
+                                                          {'name': utils.data_gateway_node_net})),
+                        'Failed to recognize disconnection from the network of the node\'s Data Gateway')
+        self.assertFalse(self.obj.is_relevant(docker_event('network', 'disconnect', {'name': 'bridge'})),
+                         'Third-party networks are not relevant')
+
+    def test_consume(self):
+        stream = FakeStream([docker_event('container', 'die', {'nuvlaedge.component': 'True'}),
+                             docker_event('container', 'die', {'foo': 'bar'})])
+        self.container_runtime.client.events.return_value = stream
+
+        self.obj.consume()
+        self.container_runtime.client.events.assert_called_once_with(decode=True, filters=self.obj.filters)
+        self.on_change.assert_called_once()
+        self.on_resync.assert_not_called()
+        self.assertEqual(self.obj.events_received, 1,
+                         'Should only count relevant events')
+        self.assertTrue(stream.closed,
+                        'Stream should be closed once consumed')
+
+        # after a reconnection, a full resync is requested
+        self.container_runtime.client.events.return_value = FakeStream([])
+        self.obj.consume(resync=True)
+        self.on_resync.assert_called_once()
+        self.assertEqual(self.obj.reconnections, 1,
+                         'Failed to count reconnection')
+
+    def test_run(self):
+        # the daemon goes away and comes back: reconnect and resync
+        streams = [ConnectionError('daemon is gone'), FakeStream([])]
+
+        def events(**kwargs):
+            s = streams.pop(0)
+            if isinstance(s, Exception):
+                raise s
+            self.obj.stop()
+            return s
+
+        self.container_runtime.client.events.side_effect = events
+        self.obj.run()
+        self.assertEqual(self.container_runtime.client.events.call_count, 2,
+                         'Failed to reconnect to the events stream')
+        self.on_resync.assert_called_once()
@@ -38,13 +38,24 @@ class KubernetesTestCase(unittest.TestCase):
                          'Kubernetes client was not properly initialized')
 
     def test_list_internal_components(self):
-        pods = mock.MagicMock()
-        pods.items = 'foo'
-        self.obj.client.list_namespaced_pod.return_value = pods
+        self.obj.client.list_namespaced_pod.return_value = fake.mock_kubernetes_list(['foo'])
         # this is a simple lookup
-        self.assertEqual(self.obj.list_internal_components('label'), 'foo',
+        self.assertEqual(self.obj.list_internal_components('label'), ['foo'],
                          'Failed to list internal pods')
-        self.obj.client.list_namespaced_pod.assert_called_once_with(namespace='nuvlaedge', label_selector='label')
+        self.obj.client.list_namespaced_pod.assert_called_once_with(namespace='nuvlaedge', label_selector='label',
+                                                                    limit=self.obj.list_limit)
+
+    def test_list_all(self):
+        list_function = mock.MagicMock(side_effect=[fake.mock_kubernetes_list([1, 2], 'page-2'),
+                                                    fake.mock_kubernetes_list([3], 'page-3'),
+                                                    fake.mock_kubernetes_list([])])
+        self.obj.list_limit = 2
+        self.assertEqual(self.obj.list_all(list_function, namespace='ns'), [1, 2, 3],
+                         'Failed to list all the pages')
+        self.assertEqual(list_function.call_args_list, [mock.call(namespace='ns', limit=2),
+                                                        mock.call(namespace='ns', limit=2, _continue='page-2'),
+                                                        mock.call(namespace='ns', limit=2, _continue='page-3')],
+                         'Failed to follow the continue tokens')
 
     def test_fetch_container_logs(self):
         self.obj.client.read_namespaced_pod_log.return_value = 'foo\nbar'
@@ -128,14 +139,13 @@ class KubernetesTestCase(unittest.TestCase):
                         'Failed to get Kubernetes Node ID')
 
     def test_list_nodes(self):
-        list_nodes = mock.MagicMock()
-        list_nodes.items = [fake.mock_kubernetes_node('1'), fake.mock_kubernetes_node('2')]
+        list_nodes = fake.mock_kubernetes_list([fake.mock_kubernetes_node('1'), fake.mock_kubernetes_node('2')])
         self.obj.client.list_node.return_value = list_nodes
 
         out = self.obj.list_nodes()
         self.assertEqual(len(out), 2,
                          'Failed to list all k8s nodes')
-        self.obj.client.list_node.assert_called_once_with()
+        self.obj.client.list_node.assert_called_once_with(limit=self.obj.list_limit)
         self.assertEqual(list(map(lambda x: x.metadata.name[0], out)), ['1', '2'],
                          'Returned k8s nodes do not match the expected')
 
@@ -203,15 +213,13 @@ class KubernetesTestCase(unittest.TestCase):
 
     def test_list_all_containers_in_this_node(self):
         # no containers = get []
-        pods = mock.MagicMock()
-        pods.items = []
+        pods = fake.mock_kubernetes_list([])
         self.obj.client.list_pod_for_all_namespaces.return_value = pods
         self.assertEqual(self.obj.list_all_containers_in_this_node(), [],
                          'Got k8s containers when there are none')
 
         # otherwise, get all their info
-        pods = mock.MagicMock()
-        pods.items = [fake.mock_kubernetes_pod('one'), fake.mock_kubernetes_pod('two')]
+        pods = fake.mock_kubernetes_list([fake.mock_kubernetes_pod('one'), fake.mock_kubernetes_pod('two')])
         self.obj.client.list_pod_for_all_namespaces.return_value = pods
         self.assertEqual(len(self.obj.list_all_containers_in_this_node()),
                          len(pods.items) * len(fake.mock_kubernetes_pod().status.container_statuses),
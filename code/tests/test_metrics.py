@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import unittest
+import urllib.request
+import system_manager.common.Metrics as metrics
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = self.registry.register(metrics.Counter('restarts_total', 'Restarts', ['container']))
+        counter.inc(container='agent')
+        counter.inc(2, container='agent')
+        self.assertEqual(counter.value(container='agent'), 3,
+                         'Failed to increase counter')
+        self.assertRaises(ValueError, counter.inc, -1, container='agent')
+        self.assertRaises(ValueError, counter.inc, container='agent', other='label')
+        self.assertRaises(ValueError, self.registry.register, metrics.Counter('restarts_total', 'Again'))
+
+        self.assertEqual(self.registry.render(),
+                         '# HELP restarts_total Restarts\n'
+                         '# TYPE restarts_total counter\n'
+                         'restarts_total{container="agent"} 3.0\n',
+                         'Failed to render counter')
+
+    def test_gauge(self):
+        gauge = self.registry.register(metrics.Gauge('days_left', 'Days left', ['file']))
+        gauge.set(10, file='a "quoted"\nfile')
+        self.assertIn('days_left{file="a \\"quoted\\"\\nfile"} 10.0', self.registry.render(),
+                      'Failed to escape label values')
+
+        gauge.clear()
+        self.assertNotIn('days_left{', self.registry.render(),
+                         'Failed to clear gauge')
+
+    def test_histogram(self):
+        histogram = self.registry.register(metrics.Histogram('duration_seconds', 'Duration', ['check'],
+                                                             buckets=[0.1, 1]))
+        histogram.observe(0.05, check='healer')
+        histogram.observe(0.5, check='healer')
+        histogram.observe(5, check='healer')
+        self.assertEqual(histogram.count(check='healer'), 3,
+                         'Failed to count observations')
+
+        rendered = self.registry.render()
+        for line in ['duration_seconds_bucket{check="healer",le="0.1"} 1.0',
+                     'duration_seconds_bucket{check="healer",le="1.0"} 2.0',
+                     'duration_seconds_bucket{check="healer",le="+Inf"} 3.0',
+                     'duration_seconds_sum{check="healer"} 5.55',
+                     'duration_seconds_count{check="healer"} 3.0']:
+            self.assertIn(line, rendered,
+                          'Failed to render histogram')
+
+    def test_server(self):
+        logging.disable(logging.CRITICAL)
+        self.registry.register(metrics.Counter('up_total', 'Up')).inc()
+        server = metrics.start_metrics_server('0', self.registry)
+        try:
+            self.assertEqual(server.server_address[0], '127.0.0.1',
+                             'Metrics should only be served locally by default')
+            url = f'http://127.0.0.1:{server.server_port}'
+            with urllib.request.urlopen(f'{url}/metrics') as response:
+                self.assertEqual(response.headers['Content-Type'], metrics.CONTENT_TYPE,
+                                 'Wrong content type for Prometheus')
+                self.assertIn('up_total 1.0', response.read().decode(),
+                              'Failed to serve metrics')
+        finally:
+            server.shutdown()
+            server.server_close()
+            logging.disable(logging.NOTSET)
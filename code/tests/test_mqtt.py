@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import socket
+import unittest
+import system_manager.common.Mqtt as Mqtt
+from system_manager.common.Mqtt import MqttClient, MqttError
+from tests.utils.fake_mqtt import FakeMqttBroker
+
+
+class MqttTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.broker = FakeMqttBroker(retained={'$SYS/broker/version': b'mosquitto version 2.0.15'}).start()
+
+    def tearDown(self):
+        self.broker.stop()
+
+    def test_encoding(self):
+        self.assertEqual(Mqtt.encode_length(0), b'\x00')
+        self.assertEqual(Mqtt.encode_length(127), b'\x7f')
+        self.assertEqual(Mqtt.encode_length(321), b'\xc1\x02')
+        self.assertEqual(Mqtt.encode_string('ab'), b'\x00\x02ab')
+
+    def test_topic_matches(self):
+        self.assertTrue(Mqtt.topic_matches('a/+/c', 'a/b/c'))
+        self.assertTrue(Mqtt.topic_matches('a/#', 'a/b/c'))
+        self.assertFalse(Mqtt.topic_matches('a/+', 'a/b/c'))
+        self.assertFalse(Mqtt.topic_matches('#', '$SYS/broker/uptime'),
+                         'System topics should only match explicit subscriptions')
+        self.assertTrue(Mqtt.topic_matches('$SYS/#', '$SYS/broker/uptime'))
+
+    def test_publish_subscribe(self):
+        with MqttClient('127.0.0.1', self.broker.port, timeout=2) as client:
+            client.subscribe('probe/+', '$SYS/broker/version')
+            self.assertEqual(client.receive(), ('$SYS/broker/version', b'mosquitto version 2.0.15'),
+                             'Failed to receive the retained messages')
+
+            client.publish('probe/1', b'x' * 300)
+            self.assertEqual(client.receive(), ('probe/1', b'x' * 300))
+            client.publish('other', 'ignored')
+            self.assertIsNone(client.receive(timeout=0.1),
+                              'Received a message it did not subscribe to')
+            self.assertLess(client.ping(), 1)
+
+        self.assertEqual(self.broker.connections, 1)
+
+    def test_broker_ready(self):
+        self.assertTrue(Mqtt.is_broker_ready('127.0.0.1', self.broker.port))
+
+        self.broker.connack_code = 5
+        self.assertRaises(MqttError, MqttClient('127.0.0.1', self.broker.port).connect)
+        self.assertFalse(Mqtt.is_broker_ready('127.0.0.1', self.broker.port))
+
+        self.broker.connack_code = 0
+        self.broker.silent = True
+        self.assertFalse(Mqtt.is_broker_ready('127.0.0.1', self.broker.port, timeout=0.1),
+                         'A broker that does not answer is not ready')
+
+        # nothing listening
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        self.assertFalse(Mqtt.is_broker_ready('127.0.0.1', port))
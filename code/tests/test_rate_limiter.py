@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import mock
+import threading
+import time
+import unittest
+import system_manager.common.RateLimiter as RateLimiter
+from system_manager.common.RateLimiter import MutationLimiter, PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL
+
+
+class MutationLimiterTestCase(unittest.TestCase):
+
+    def test_is_mutating(self):
+        self.assertTrue(RateLimiter.is_mutating('post', 'http+docker://localhost/v1.41/containers/abc/restart?t=10'))
+        self.assertTrue(RateLimiter.is_mutating('DELETE', '/networks/abc'))
+        self.assertFalse(RateLimiter.is_mutating('GET', '/containers/json'))
+        self.assertFalse(RateLimiter.is_mutating('POST', '/containers/abc/wait'),
+                         'Waiting for a container does not change anything')
+
+    def test_burst(self):
+        obj = MutationLimiter(rate=1, burst=3)
+        self.assertLess(max(obj.acquire() for _ in range(3)), 0.01,
+                        'Calls within the burst should not wait')
+        start = time.monotonic()
+        obj.rate = 20
+        obj.acquire()
+        self.assertGreater(time.monotonic() - start, 0.03,
+                           'Calls beyond the burst should wait for a token')
+
+        # disabled
+        obj = MutationLimiter(rate=0, burst=1)
+        self.assertEqual([obj.acquire() for _ in range(10)], [0] * 10)
+
+    def test_priority(self):
+        obj = MutationLimiter(rate=20, burst=1)
+        obj.acquire()
+        order = []
+
+        def call(name, level=None):
+            obj.acquire(level)
+            order.append(name)
+
+        threads = [threading.Thread(target=call, args=args) for args in [('low', PRIORITY_LOW),
+                                                                          ('normal', PRIORITY_NORMAL),
+                                                                          ('default', None)]]
+        for t in threads:
+            t.start()
+            time.sleep(0.005)
+        with obj.priority(PRIORITY_HIGH):
+            call('high')
+        for t in threads:
+            t.join()
+
+        self.assertEqual(order, ['high', 'normal', 'default', 'low'],
+                         'Queued calls should go by priority, and then by arrival')
+        self.assertEqual(obj.queue_depth(), 0)
+        self.assertEqual(RateLimiter.metrics.mutations_queued.value(priority='low'), 0)
+
+    def test_max_wait(self):
+        obj = MutationLimiter(rate=0.01, burst=1, max_wait=0.05)
+        obj.acquire()
+        self.assertGreaterEqual(obj.acquire(), 0.05,
+                                'Calls should go through after waiting for too long')
+        self.assertEqual(obj.queue_depth(), 0)
+
+    def test_acquire_async(self):
+        obj = MutationLimiter(rate=50, burst=1)
+
+        async def run():
+            waits = await asyncio.gather(*[obj.acquire_async(PRIORITY_NORMAL) for _ in range(3)])
+            return sorted(waits)
+
+        waits = asyncio.run(run())
+        self.assertLess(waits[0], 0.01)
+        self.assertGreater(waits[-1], 0.02,
+                           'Calls beyond the burst should wait for a token')
+
+    def test_instrument_docker(self):
+        obj = MutationLimiter(rate=1, burst=1)
+        client = mock.MagicMock()
+        request = client.api.request
+        obj.instrument_docker(client)
+        obj.instrument_docker(client)
+
+        with mock.patch.object(obj, 'acquire') as acquire:
+            client.api.request('GET', '/containers/json')
+            acquire.assert_not_called()
+            client.api.request('POST', '/containers/abc/restart')
+            acquire.assert_called_once_with()
+        self.assertEqual(request.call_count, 2)
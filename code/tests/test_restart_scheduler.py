@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import mock
+import threading
+import time
+import unittest
+import system_manager.common.RestartScheduler as RestartScheduler
+from system_manager.common.RestartScheduler import CrashLoopBreaker, DelayedRestartScheduler
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class DelayedRestartSchedulerTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        self.restart = mock.MagicMock(return_value=[])
+        self.on_change = mock.MagicMock()
+        self.obj = DelayedRestartScheduler(self.restart, clock=self.clock, on_change=self.on_change)
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        self.obj.stop()
+        logging.disable(logging.NOTSET)
+
+    def test_schedule(self):
+        self.assertIsNone(self.obj.time_until_next(),
+                          'Nothing should be waiting')
+        self.assertTrue(self.obj.schedule('b', 'id-b', 20))
+        self.assertTrue(self.obj.schedule('a', 'id-a', 10))
+        self.assertFalse(self.obj.schedule('a', 'id-a', 5),
+                         'Restart should not be scheduled twice')
+        self.assertEqual(self.obj.time_until_next(), 10)
+        self.on_change.assert_called_with(2)
+
+        self.assertEqual(self.obj.run_due(), 0,
+                         'Ran restarts ahead of time')
+        self.clock.now += 15
+        self.assertEqual(self.obj.run_due(), 1)
+        self.restart.assert_called_once_with('a', 'id-a')
+        self.clock.now += 15
+        self.assertEqual(self.obj.run_due(), 1)
+        self.restart.assert_called_with('b', 'id-b')
+        self.assertEqual(self.obj.pending(), [])
+        self.on_change.assert_called_with(0)
+
+    def test_cancel(self):
+        self.obj.schedule('a', 'id-a', 10)
+        self.obj.schedule('b', 'id-b', 10)
+        self.assertTrue(self.obj.cancel('a'))
+        self.assertFalse(self.obj.cancel('a'),
+                         'Cancelled a restart that was not pending')
+        self.assertEqual(self.obj.retain(['a', 'c']), ['b'],
+                         'Failed to cancel the restarts of the containers that are gone')
+
+        self.clock.now += 10
+        self.assertEqual(self.obj.run_due(), 0,
+                         'Ran cancelled restarts')
+        self.assertIsNone(self.obj.time_until_next())
+
+        # cancelled restarts do not pile up
+        for i in range(100):
+            self.obj.schedule('a', 'id-a', 10)
+            self.obj.cancel('a')
+        self.assertLess(len(self.obj._queue), 20,
+                        'Cancelled restarts should be removed from the queue')
+
+    def test_outcomes(self):
+        self.restart.return_value = [('DEGRADED', 'Container a is down')]
+        self.obj.schedule('a', 'id-a', 0)
+        self.obj.run_due()
+        self.assertEqual(self.obj.outcomes(), [('DEGRADED', 'Container a is down')],
+                         'Failed to keep the outcome of a failed restart')
+
+        # a successful restart clears it
+        self.restart.return_value = []
+        self.obj.schedule('a', 'id-a', 0)
+        self.obj.run_due()
+        self.assertEqual(self.obj.outcomes(), [])
+
+        # and so does a cancellation, even while the restart is running
+        def restart(name, container_id):
+            self.obj.cancel(name)
+            return [('DEGRADED', 'Container a is down')]
+
+        self.restart.side_effect = restart
+        self.obj.schedule('a', 'id-a', 0)
+        self.obj.run_due()
+        self.assertEqual(self.obj.outcomes(), [],
+                         'Kept the outcome of a cancelled restart')
+
+        # errors are not fatal
+        self.restart.side_effect = Exception('boom')
+        self.obj.schedule('a', 'id-a', 0)
+        self.assertEqual(self.obj.run_due(), 1)
+        self.assertEqual(self.obj.pending(), [])
+
+    def test_single_thread(self):
+        self.obj.clock = time.monotonic
+        done = threading.Event()
+        self.restart.side_effect = lambda name, container_id: done.set() if name == 'c-49' else None
+
+        threads = threading.active_count()
+        self.obj.start()
+        for i in range(50):
+            self.obj.schedule(f'c-{i}', f'id-{i}', 0.01)
+            self.obj.start()
+        self.assertEqual(threading.active_count(), threads + 1,
+                         'There should be a single thread running the restarts')
+
+        self.assertTrue(done.wait(5),
+                        'Restarts did not run in the background')
+        self.assertEqual(self.restart.call_count, 50)
+
+
+class CrashLoopBreakerTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        self.obj = CrashLoopBreaker(max_failures=3, window=600, max_delay=100, jitter=0, healthy_after=300,
+                                    clock=self.clock)
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_backoff(self):
+        self.assertEqual(self.obj.delay('a', 30), 30,
+                         'First restart should wait for the base delay')
+        self.obj.record_crash('a', 'crash-1')
+        self.assertEqual(self.obj.delay('a', 30), 30)
+        self.obj.record_crash('a', 'crash-1')
+        self.assertEqual(self.obj.failures('a'), 1,
+                         'The same crash should only be counted once')
+
+        self.obj.record_crash('a', 'crash-2')
+        self.assertEqual(self.obj.delay('a', 30), 60,
+                         'Delay should double with every crash')
+        self.obj.max_failures = 10
+        self.obj.record_crash('a', 'crash-3')
+        self.assertEqual(self.obj.delay('a', 30), 100,
+                         'Delay should not exceed the maximum')
+
+        self.obj.jitter = 0.5
+        self.assertTrue(100 <= self.obj.delay('a', 30) <= 150,
+                        'Jitter should be added to the delay')
+
+        # old crashes are forgotten
+        self.clock.now += 601
+        self.obj.record_crash('a', 'crash-4')
+        self.assertEqual(self.obj.failures('a'), 1,
+                         'Crashes outside of the window should be forgotten')
+
+        # and so are those before a long run
+        self.obj.record_crash('a', 'crash-5')
+        self.obj.record_crash('a', 'crash-6', uptime=3600)
+        self.assertEqual(self.obj.failures('a'), 1,
+                         'Crashes before a long run should be forgotten')
+
+    def test_circuit(self):
+        self.assertFalse(self.obj.record_crash('a', 'crash-1'))
+        self.assertFalse(self.obj.record_crash('a', 'crash-2'))
+        self.assertFalse(self.obj.is_open('a'))
+        self.assertTrue(self.obj.record_crash('a', 'crash-3'),
+                        'Circuit should open after too many crashes')
+        self.assertTrue(self.obj.is_open('a'))
+        self.assertFalse(self.obj.record_crash('a', 'crash-4'),
+                         'Circuit should only open once')
+
+        # the circuit stays open, even once the crashes are old
+        self.clock.now += 3600
+        self.assertTrue(self.obj.is_open('a'))
+        self.assertFalse(self.obj.is_open('b'))
+
+        # until the container stays healthy for long enough
+        self.assertFalse(self.obj.record_running('a'))
+        self.clock.now += 100
+        self.assertFalse(self.obj.record_running('a'))
+        self.assertTrue(self.obj.is_open('a'))
+        self.clock.now += 200
+        self.assertTrue(self.obj.record_running('a'),
+                        'Container should be healthy again')
+        self.assertFalse(self.obj.is_open('a'))
+        self.assertEqual(self.obj.failures('a'), 0)
+
+        # containers that are gone are forgotten
+        for i in range(3):
+            self.obj.record_crash('b', f'crash-{i}')
+        self.obj.retain(['a'])
+        self.assertFalse(self.obj.is_open('b'))
+
+
+class RestartWavesTestCase(unittest.TestCase):
+
+    def test_compose_dependencies(self):
+        self.assertEqual(RestartScheduler.compose_dependencies({}), [])
+        self.assertEqual(RestartScheduler.compose_dependencies(
+            {'com.docker.compose.depends_on': 'system-manager:service_started:false, security:service_healthy'}),
+            ['system-manager', 'security'])
+
+    def test_dependency_waves(self):
+        dependencies = {'vpn-client': ['agent'], 'compute-api': ['agent'], 'agent': ['system-manager', 'security'],
+                        'security': [], 'job-engine-lite': ['running-fine']}
+        self.assertEqual(RestartScheduler.dependency_waves(dependencies, priority=['security']),
+                         [['security', 'job-engine-lite'], ['agent'], ['compute-api', 'vpn-client']],
+                         'Failed to order services by dependencies')
+
+        # cycles do not prevent healing
+        self.assertEqual(RestartScheduler.dependency_waves({'a': ['b'], 'b': ['a'], 'c': []}), [['c'], ['a', 'b']])
+
+    def test_restart_waves(self):
+        containers = [{'name': 'agent-1', 'labels': {'com.docker.compose.service': 'agent',
+                                                     'com.docker.compose.depends_on': 'security:service_started'}},
+                      {'name': 'security-1', 'labels': {'com.docker.compose.service': 'security'}},
+                      {'name': 'security-2', 'labels': {'com.docker.compose.service': 'security'}},
+                      {'name': 'data-gateway', 'labels': None}]
+        waves = RestartScheduler.restart_waves(containers, lambda c: c['labels'], lambda c: c['name'],
+                                               priority=['agent'])
+        self.assertEqual([[c['name'] for c in wave] for wave in waves],
+                         [['data-gateway', 'security-1', 'security-2'], ['agent-1']])
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import mock
+import signal
+import threading
+import time
+import unittest
+from system_manager.common.Scheduler import Job, Scheduler
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class JobTestCase(unittest.TestCase):
+
+    def test_reschedule(self):
+        job = Job('job', mock.MagicMock(), 10)
+        job.start(0)
+        self.assertTrue(job.is_due(0),
+                        'Job should run as soon as it starts')
+
+        # slots do not drift with the duration of the job
+        job.reschedule(3)
+        self.assertEqual(job.next_run, 10,
+                         'Next run should be aligned with the interval')
+
+        # missed slots are skipped
+        job.reschedule(35)
+        self.assertEqual(job.next_run, 40,
+                         'Missed slots should be skipped')
+
+        # jitter does not accumulate
+        job.jitter = 1
+        job.reschedule(40)
+        self.assertTrue(50 <= job.next_run <= 51,
+                        'Jitter should be added to the next slot')
+        job.reschedule(job.next_run)
+        self.assertTrue(60 <= job.next_run <= 61,
+                        'Jitter should not accumulate')
+
+    def test_forced_run(self):
+        job = Job('job', mock.MagicMock(), 10)
+        job.start(0)
+        job.reschedule(0)
+        job.forced_run = 2
+        self.assertFalse(job.is_due(1),
+                         'Forced job is not due before its forced time')
+        self.assertTrue(job.is_due(2),
+                        'Forced job should be due')
+        self.assertEqual(job.due_at(), 2,
+                         'Forced job should be due before its next slot')
+
+        # running ahead of time keeps the regular slot
+        job.reschedule(2)
+        self.assertEqual((job.next_run, job.forced_run), (10, None),
+                         'Forced run should not move the regular slot')
+
+    def test_stretch(self):
+        job = Job('job', mock.MagicMock(), 10)
+        job.start(0)
+        job.reschedule(3, stretch=4)
+        self.assertEqual(job.next_run, 40,
+                         'Interval should be stretched')
+        job.reschedule(40)
+        self.assertEqual(job.next_run, 50,
+                         'Interval should be restored')
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        self.obj = Scheduler(min_wake_interval=1, clock=self.clock)
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_run_pending(self):
+        order = []
+        self.obj.add_job('low', lambda: order.append('low'), 10, priority=1)
+        self.obj.add_job('high', lambda: order.append('high'), 5, priority=10)
+
+        # all jobs run at start, by priority
+        self.assertEqual(self.obj.run_pending(), ['high', 'low'],
+                         'Failed to run jobs by priority')
+        self.assertEqual(order, ['high', 'low'],
+                         'Jobs did not run in order')
+
+        # then, each one at its own interval
+        self.assertEqual(self.obj.time_until_next(), 5,
+                         'Failed to compute time until the next job')
+        self.clock.now += 5
+        self.assertEqual(self.obj.run_pending(), ['high'],
+                         'Only the job with the shortest interval should have run')
+        self.clock.now += 5
+        self.assertEqual(self.obj.run_pending(), ['high', 'low'],
+                         'Both jobs should have run')
+        self.assertEqual(self.obj.jobs['high'].runs, 3,
+                         'Failed to count job runs')
+
+    def test_failing_job(self):
+        self.obj.add_job('failing', mock.MagicMock(side_effect=Exception('boom')), 10)
+        self.assertEqual(self.obj.run_pending(), ['failing'],
+                         'A failing job should not stop the scheduler')
+        self.assertEqual(self.obj.jobs['failing'].next_run, self.clock.now + 10,
+                         'A failing job should be rescheduled anyway')
+
+    def test_wake(self):
+        self.obj.add_job('a', mock.MagicMock(), 60)
+        self.obj.add_job('b', mock.MagicMock(), 60)
+        self.obj.run_pending()
+        self.assertEqual(self.obj.run_pending(), [],
+                         'No job should be due')
+
+        # waking up some jobs runs them right away, at most once per min_wake_interval
+        self.obj.wake('a', 'unknown')
+        self.assertEqual(self.obj.run_pending(), [],
+                         'Woken up job should respect the minimum interval between runs')
+        self.assertEqual(self.obj.time_until_next(), 1,
+                         'Woken up job should run after the minimum interval')
+        self.clock.now += 1
+        self.assertEqual(self.obj.run_pending(), ['a'],
+                         'Failed to run woken up job')
+
+        # waking up everything
+        self.clock.now += 5
+        self.obj.wake()
+        self.assertEqual(sorted(self.obj.run_pending()), ['a', 'b'],
+                         'Failed to run all jobs when woken up')
+
+    def test_wake_from_signal_handler(self):
+        import manager_main
+
+        # the handler interrupts the main thread, which may be holding the lock of the scheduler
+        def handle_signal_while_locked():
+            with manager_main.scheduler._lock:
+                manager_main.signal_hup(signal.SIGHUP, None)
+
+        handler = threading.Thread(target=handle_signal_while_locked, daemon=True)
+        with mock.patch.object(manager_main.scheduler, '_notify') as mock_notify:
+            handler.start()
+            handler.join(5)
+        self.assertFalse(handler.is_alive(),
+                         'SIGHUP handler deadlocked on the scheduler lock')
+        mock_notify.assert_called_once()
+
+    def test_wait(self):
+        self.obj.add_job('a', mock.MagicMock(), 3600)
+        self.obj.run_pending()
+
+        # the sleep is interrupted by wake()
+        threading.Timer(0.05, self.obj.wake).start()
+        self.assertTrue(self.obj.wait(),
+                        'Sleep should have been interrupted')
+
+
+class ConcurrentSchedulerTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.obj = Scheduler(workers=4)
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        self.obj.shutdown()
+        logging.disable(logging.NOTSET)
+
+    def test_parallel(self):
+        # independent jobs run at the same time: none of them finishes unless all of them have started
+        barrier = threading.Barrier(3, timeout=5)
+        for name in ['a', 'b', 'c']:
+            self.obj.add_job(name, barrier.wait, 60)
+
+        self.assertEqual(sorted(self.obj.run_pending()), ['a', 'b', 'c'],
+                         'Failed to run all jobs')
+        self.assertFalse(barrier.broken,
+                         'Jobs did not run concurrently')
+        self.assertEqual([j.runs for j in self.obj.jobs.values()], [1, 1, 1],
+                         'Failed to run each job once')
+
+    def test_dependencies(self):
+        order = []
+        classified = threading.Event()
+
+        def classification():
+            time.sleep(0.05)
+            order.append('classification')
+            classified.set()
+
+        def data_gateway():
+            order.append('data-gateway' if classified.is_set() else 'data-gateway-too-early')
+
+        self.obj.add_job('data-gateway', data_gateway, 60, priority=10, depends_on=['classification'])
+        self.obj.add_job('classification', classification, 60, priority=1)
+        self.obj.run_pending()
+        self.assertEqual(order, ['classification', 'data-gateway'],
+                         'Dependency order was not respected')
+
+        # dependencies that are not due do not hold the job back
+        self.obj.wake('data-gateway')
+        time.sleep(self.obj.min_wake_interval)
+        self.assertEqual(self.obj.run_pending(), ['data-gateway'],
+                         'Job should not wait for a dependency that is not due')
+
+    def test_timeout(self):
+        release = threading.Event()
+        self.obj.add_job('stuck', release.wait, 60, timeout=0.05)
+        self.obj.add_job('fast', mock.MagicMock(), 60, depends_on=['stuck'])
+
+        start = time.monotonic()
+        self.assertEqual(self.obj.run_pending(), ['stuck', 'fast'],
+                         'Failed to run jobs')
+        self.assertLess(time.monotonic() - start, 1,
+                        'Should not have waited for the stuck job')
+        self.assertEqual(self.obj.jobs['stuck'].timeouts, 1,
+                         'Failed to count timeout')
+        self.assertEqual(self.obj.jobs['fast'].runs, 1,
+                         'Dependent job should run after its dependency timed out')
+
+        # while still running, the stuck job is not started again
+        self.obj.wake()
+        time.sleep(self.obj.min_wake_interval)
+        self.assertNotIn('stuck', self.obj.run_pending(),
+                         'Started a job that is still running')
+        release.set()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import http.client
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from system_manager.common.StatusServer import StatusBoard, start_status_server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__('localhost', timeout=5)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+class StatusBoardTestCase(unittest.TestCase):
+
+    def test_publish(self):
+        obj = StatusBoard()
+        self.assertTrue(obj.publish('OPERATIONAL', [], {'healer': []}),
+                        'Failed to publish status')
+        self.assertFalse(obj.publish('OPERATIONAL', [], {'healer': []}),
+                         'Unchanged status should not be published again')
+        self.assertTrue(obj.publish('DEGRADED', ['down'], {'healer': [('DEGRADED', 'down')]}),
+                        'Failed to publish changed status')
+        self.assertEqual(obj.version, 2,
+                         'Version should only change with the status')
+        self.assertEqual(obj.snapshot()['checks'], {'healer': [{'status': 'DEGRADED', 'notes': 'down'}]},
+                         'Failed to keep per-check results')
+
+    def test_wait_for(self):
+        obj = StatusBoard()
+        self.assertIsNone(obj.wait_for(0, 0.01),
+                          'Nothing changed, so should have timed out')
+
+        threading.Timer(0.05, obj.publish, ('DEGRADED', [], {})).start()
+        self.assertEqual(obj.wait_for(0, 5)['status'], 'DEGRADED',
+                         'Failed to wake up on change')
+
+
+class StatusServerTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.socket = os.path.join(self.tmp.name, 'status.sock')
+        self.board = StatusBoard()
+        self.board.publish('OPERATIONAL', [], {})
+        self.server = start_status_server(self.board, self.socket)
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+        logging.disable(logging.NOTSET)
+
+    def get(self, path, headers=None):
+        conn = UnixHTTPConnection(self.socket)
+        conn.request('GET', path, headers=headers or {})
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        is_json = response.getheader('Content-Type') == 'application/json'
+        return response, json.loads(body) if is_json else None
+
+    def test_status(self):
+        response, body = self.get('/status')
+        self.assertEqual((response.status, body['status'], body['version']), (200, 'OPERATIONAL', 1),
+                         'Failed to get status')
+        self.assertEqual(response.getheader('ETag'), '"1"',
+                         'Missing ETag')
+
+        response, body = self.get('/status', {'If-None-Match': '"1"'})
+        self.assertEqual((response.status, body), (304, None),
+                         'Unchanged status should not be sent again')
+
+        response, _ = self.get('/other')
+        self.assertEqual(response.status, 404,
+                         'Unknown path should not be found')
+
+        response, _ = self.get('/status?wait=abc')
+        self.assertEqual(response.status, 400,
+                         'Invalid version should be rejected')
+
+    def test_long_poll(self):
+        # already newer
+        response, body = self.get('/status?wait=0')
+        self.assertEqual((response.status, body['version']), (200, 1),
+                         'Should return right away when the version is already newer')
+
+        # not changing in time
+        response, body = self.get('/status?wait=1&timeout=0.05')
+        self.assertEqual((response.status, body), (304, None),
+                         'Should time out when nothing changes')
+
+        # changing while waiting
+        threading.Timer(0.05, self.board.publish, ('DEGRADED', ['down'], {})).start()
+        response, body = self.get('/status?wait=1&timeout=5')
+        self.assertEqual((response.status, body['status'], body['notes']), (200, 'DEGRADED', ['down']),
+                         'Failed to get status change')
+        self.assertEqual(response.getheader('ETag'), '"2"',
+                         'ETag should follow the version')
@@ -4,11 +4,15 @@
 import docker
 import logging
 import mock
+import os
 import requests
+import tempfile
+import threading
 import unittest
 import system_manager.Supervise as Supervise
 import tests.utils.fake as fake
 from system_manager.common.ContainerRuntime import Containers
+from system_manager.common.DataGatewayProbe import PROBE_UNREACHABLE
 
 
 class SuperviseTestCase(unittest.TestCase):
@@ -67,41 +71,41 @@ class SuperviseTestCase(unittest.TestCase):
         self.assertIn((Supervise.utils.status_degraded, 'label-error'), self.obj.operational_status,
                       'Failed to set degraded state')
 
-    @mock.patch('OpenSSL.crypto.load_certificate')
-    @mock.patch('OpenSSL.crypto')
+        # with a node info snapshot, the node info is fetched once and shared with all the runtime helpers
+        node_info = mock.MagicMock()
+        node_info.get.return_value = {'Swarm': {}}
+        self.obj.classify_this_node(node_info)
+        node_info.get.assert_called_once()
+        self.obj.container_runtime.get_node_id.assert_called_with({'Swarm': {}})
+        self.obj.container_runtime.get_cluster_managers.assert_called_with({'Swarm': {}})
+
+        # labeling is skipped when the container runtime is overloaded
+        self.obj.container_runtime.set_nuvlaedge_node_label.reset_mock()
+        with mock.patch.object(Supervise.backpressure, 'skips', return_value=True):
+            self.obj.classify_this_node()
+        self.assertTrue(self.obj.i_am_manager)
+        self.obj.container_runtime.set_nuvlaedge_node_label.assert_not_called()
+
     @mock.patch('os.path.isfile')
-    def test_is_cert_rotation_needed(self, mock_isfile, mock_crypto, mock_load_cert):
+    def test_is_cert_rotation_needed(self, mock_isfile):
+        self.obj.cert_inventory = mock.MagicMock()
+        self.obj.cert_inventory.rotation_threshold_days = 5
         # if tls sync is not a file, get False
         mock_isfile.return_value = False
         self.assertFalse(self.obj.is_cert_rotation_needed(),
                          'Failed to check that TLS sync file is not a real file')
+        # the inventory is refreshed anyway, for the certificate metrics
+        self.obj.cert_inventory.expiring.assert_called_once()
 
-        # otherwise
-        mock_isfile.reset_mock(return_value=True)
-
-        # if cert files do no exist, get False
-        mock_isfile.side_effect = [True, False, False, False]  # TLS file + 3 cert files
+        # otherwise, ask the inventory
+        mock_isfile.return_value = True
+        self.obj.cert_inventory.expiring.return_value = []
         self.assertFalse(self.obj.is_cert_rotation_needed(),
-                         'Got True even though cert files do not exist')
+                         'Failed to recognize valid certificates')
 
-        # otherwise
-        mock_crypto.FILETYPE_PEM = ''
-        cert_obj = mock.MagicMock()
-        # a valid certificate is in the future, more than 5 days
-        cert_obj.get_notAfter.return_value = b'99990309161546Z'
-        mock_load_cert.return_value = cert_obj
-        mock_isfile.side_effect = [True, True, True, True]  # TLS file + 3 cert files
-        with mock.patch('system_manager.Supervise.open'):
-            self.assertFalse(self.obj.is_cert_rotation_needed(),
-                             'Failed to recognize valid certificates')
-
-        # with less than 5 days to expire, return false
-        cert_obj.get_notAfter.return_value = b'20200309161546Z'
-        mock_load_cert.return_value = cert_obj
-        mock_isfile.side_effect = [True, True, True, True]  # TLS file + 3 cert files
-        with mock.patch('system_manager.Supervise.open'):
-            self.assertTrue(self.obj.is_cert_rotation_needed(),
-                            'Failed to recognize certificates in need of renewal')
+        self.obj.cert_inventory.expiring.return_value = ['cert.pem']
+        self.assertTrue(self.obj.is_cert_rotation_needed(),
+                        'Failed to recognize certificates in need of renewal')
 
     @mock.patch('os.remove')
     @mock.patch('os.path.isfile')
@@ -132,15 +136,17 @@ class SuperviseTestCase(unittest.TestCase):
         self.obj.container_runtime.client.containers.run.return_value = None
 
         # if in swarm, CREATE DG
-        self.assertIsNone(self.obj.launch_data_gateway('dg'),
-                          'Failed to create data-gateway service')
+        self.assertTrue(self.obj.launch_data_gateway('dg'),
+                        'Failed to create data-gateway service')
         self.obj.container_runtime.client.services.create.assert_called_once()
         self.obj.container_runtime.client.containers.run.assert_not_called()
+        self.assertIn('node.role==manager',
+                      self.obj.container_runtime.client.services.create.call_args[1]['constraints'])
 
         # otherwise, RUN DG container
         self.obj.is_cluster_enabled = False
-        self.assertIsNone(self.obj.launch_data_gateway('dg'),
-                          'Failed to create data-gateway container')
+        self.assertTrue(self.obj.launch_data_gateway('dg'),
+                        'Failed to create data-gateway container')
         self.obj.container_runtime.client.containers.run.assert_called_once()
 
         # if docker fails, parse error
@@ -349,6 +355,7 @@ class SuperviseTestCase(unittest.TestCase):
         self.assertEqual(l+2, len(self.obj.operational_status),
                          'Failure to handle agent connection error to DG net')
 
+    @mock.patch.object(Supervise.Supervise, 'check_data_gateway_readiness')
     @mock.patch.object(Supervise.Supervise, 'restart_data_gateway')
     @mock.patch.object(Supervise.Supervise, 'manage_docker_data_gateway_connect_to_network')
     @mock.patch.object(Supervise.Supervise, 'find_nuvlaedge_agent')
@@ -357,7 +364,8 @@ class SuperviseTestCase(unittest.TestCase):
     @mock.patch.object(Supervise.Supervise, 'find_docker_network')
     def test_manage_docker_data_gateway(self, mock_find_docker_network, mock_manage_docker_data_gateway_network,
                                         mock_manage_docker_data_gateway_object, mock_find_nuvlaedge_agent,
-                                        mock_manage_docker_data_gateway_connect_to_network, mock_restart_data_gateway):
+                                        mock_manage_docker_data_gateway_connect_to_network, mock_restart_data_gateway,
+                                        mock_check_data_gateway_readiness):
         mock_find_docker_network.return_value = None
         # when Break is called, the fn stops
         mock_manage_docker_data_gateway_network.side_effect = Supervise.BreakDGManagementCycle
@@ -378,7 +386,7 @@ class SuperviseTestCase(unittest.TestCase):
         # if it passes, get the containers for connecting
         mock_manage_docker_data_gateway_object.reset_mock(side_effect=True)
         mock_manage_docker_data_gateway_object.return_value = None
-        self.obj.container_runtime.client.containers.list.return_value = [fake.MockContainer('data-source')]
+        self.obj.container_runtime.list_containers.return_value = [fake.MockContainer('data-source')]
 
         # if agent container is not found, add operational status
         mock_find_nuvlaedge_agent.return_value = None
@@ -414,6 +422,312 @@ class SuperviseTestCase(unittest.TestCase):
         self.assertEqual(self.obj.agent_dg_failed_connection, 0,
                          'Failed to reset DG-Agent connection failures')
 
+        # with the "node" placement, this node runs its own DG, and its containers join the network of that DG
+        self.obj.is_cluster_enabled = True
+        self.obj.dg_placement = 'node'
+        self.obj.dg_placement_cleaned = True
+        mock_manage_docker_data_gateway_object.reset_mock()
+        mock_manage_docker_data_gateway_connect_to_network.reset_mock()
+        with mock.patch.object(self.obj, 'manage_node_data_gateway') as mock_manage_node_data_gateway:
+            self.obj.manage_docker_data_gateway()
+        mock_manage_node_data_gateway.assert_called_once()
+        mock_manage_docker_data_gateway_object.assert_not_called()
+        self.assertEqual([c.args[2:] for c in mock_manage_docker_data_gateway_connect_to_network.call_args_list],
+                         [(), (Supervise.utils.data_gateway_node_net,)])
+
+    @mock.patch.object(Supervise.time, 'sleep')
+    def test_wait_until(self, mock_sleep):
+        condition = mock.MagicMock(side_effect=[[], None, ['net']])
+        self.assertEqual(Supervise.wait_until(condition, 10), ['net'])
+        self.assertEqual([c.args[0] for c in mock_sleep.call_args_list], [0.25, 0.5],
+                         'Interval between polls should double')
+
+        condition = mock.MagicMock(return_value=False)
+        self.assertFalse(Supervise.wait_until(condition, 0))
+        condition.assert_called_once()
+
+    @mock.patch.object(Supervise.Supervise, 'set_data_gateway_ready')
+    @mock.patch.object(Supervise.Supervise, 'probe_data_gateway')
+    @mock.patch.object(Supervise.time, 'sleep')
+    @mock.patch.object(Supervise.Supervise, 'manage_docker_data_gateway_connect_to_network')
+    @mock.patch.object(Supervise.Supervise, 'find_nuvlaedge_agent')
+    @mock.patch.object(Supervise.Supervise, 'find_data_gateway')
+    @mock.patch.object(Supervise.Supervise, 'launch_data_gateway')
+    @mock.patch.object(Supervise.Supervise, 'setup_docker_network')
+    @mock.patch.object(Supervise.Supervise, 'find_docker_network')
+    def test_data_gateway_convergence(self, mock_find_docker_network, mock_setup_docker_network,
+                                      mock_launch_data_gateway, mock_find_data_gateway, mock_find_nuvlaedge_agent,
+                                      mock_connect, mock_sleep, mock_probe_data_gateway, mock_set_data_gateway_ready):
+        self.obj.is_cluster_enabled = self.obj.i_am_manager = False
+        mock_probe_data_gateway.return_value = True
+        self.obj.container_runtime.list_containers.return_value = []
+        mock_find_nuvlaedge_agent.return_value = fake.MockContainer('agent')
+        mock_setup_docker_network.return_value = mock_launch_data_gateway.return_value = True
+        net = mock.MagicMock()
+        dg = fake.MockContainer('data-gateway', status='created')
+        # the network shows up after a while, and then the DG, which takes a while to run
+        mock_find_docker_network.side_effect = [[], [], [net]]
+
+        def find_data_gateway(name):
+            self.obj.data_gateway_object = dg if mock_find_data_gateway.call_count > 1 else None
+            return True
+
+        mock_find_data_gateway.side_effect = find_data_gateway
+
+        # one resource per cycle
+        self.assertIsNone(self.obj.manage_docker_data_gateway())
+        mock_setup_docker_network.assert_called_once()
+        mock_launch_data_gateway.assert_not_called()
+
+        # or everything in one go
+        mock_find_docker_network.side_effect = [[], [], [net]]
+        mock_find_data_gateway.reset_mock()
+        self.obj.dg_reconcile = 'converge'
+        ready = Supervise.metrics.data_gateway_ready.count(mode='converge')
+
+        def run(name):
+            dg.status = 'running' if mock_find_data_gateway.call_count > 2 else 'created'
+            return find_data_gateway(name)
+
+        mock_find_data_gateway.side_effect = run
+        self.assertIsNone(self.obj.manage_docker_data_gateway())
+        mock_launch_data_gateway.assert_called_once()
+        self.assertEqual(mock_find_data_gateway.call_count, 3,
+                         'Failed to wait for the Data Gateway to run')
+        mock_connect.assert_called_once()
+        self.assertEqual(Supervise.metrics.data_gateway_ready.count(mode='converge'), ready + 1,
+                         'Failed to report the time to ready')
+        self.assertIsNone(self.obj.dg_bringup_started)
+
+        # but not for longer than the deadline
+        mock_connect.reset_mock()
+        mock_find_docker_network.side_effect = None
+        mock_find_docker_network.return_value = []
+        self.obj.dg_ready_timeout = 0
+        self.assertIsNone(self.obj.manage_docker_data_gateway())
+        mock_connect.assert_not_called()
+
+    def test_data_gateway_command(self):
+        cmd = Supervise.data_gateway_command(max_wait=5, poll_interval=0.5)
+        self.assertNotIn('sleep 10', cmd)
+        self.assertIn('seq 10', cmd,
+                      'Readiness should be polled for at most max_wait seconds')
+        self.assertTrue(cmd.endswith("exec /usr/sbin/mosquitto -c /mosquitto/config/mosquitto.conf'"))
+
+    @mock.patch.object(Supervise.Supervise, 'probe_data_gateway')
+    def test_data_gateway_readiness(self, mock_probe_data_gateway):
+        with tempfile.TemporaryDirectory() as tmp:
+            flag = os.path.join(tmp, '.data_gateway_ready')
+            with mock.patch.object(Supervise.utils, 'data_gateway_ready_flag', flag):
+                mock_probe_data_gateway.return_value = False
+                self.obj.check_data_gateway_readiness()
+                self.assertFalse(os.path.exists(flag),
+                                 'Data Gateway should not be flagged as ready before it answers')
+
+                self.obj.dg_bringup_started = Supervise.time.monotonic()
+                mock_probe_data_gateway.return_value = True
+                self.obj.check_data_gateway_readiness()
+                self.assertTrue(os.path.exists(flag),
+                                'Failed to flag the Data Gateway as ready')
+                self.assertIsNone(self.obj.dg_bringup_started)
+
+                # launching or restarting it clears the flag
+                self.obj.data_gateway_object = mock.MagicMock()
+                self.obj.restart_data_gateway()
+                self.assertFalse(os.path.exists(flag))
+
+                # in "converge" mode, it is waited for
+                self.obj.dg_reconcile = 'converge'
+                mock_probe_data_gateway.side_effect = [False, False, True]
+                with mock.patch.object(Supervise.time, 'sleep'):
+                    self.obj.check_data_gateway_readiness()
+                self.assertTrue(os.path.exists(flag))
+                self.assertEqual(mock_probe_data_gateway.call_count, 5)
+
+                # but only right after launching or restarting it, and for dg_ready_timeout seconds at most
+                self.obj.set_data_gateway_ready(False)
+                mock_probe_data_gateway.reset_mock(side_effect=True)
+                mock_probe_data_gateway.return_value = False
+                with mock.patch.object(Supervise.time, 'sleep') as mock_sleep:
+                    self.obj.check_data_gateway_readiness()
+                    self.obj.dg_bringup_started = Supervise.time.monotonic() - self.obj.dg_ready_timeout
+                    self.obj.check_data_gateway_readiness()
+                mock_sleep.assert_not_called()
+                self.assertEqual(mock_probe_data_gateway.call_count, 2)
+
+                # nor when it cannot even be resolved
+                self.obj.dg_bringup_started = Supervise.time.monotonic()
+                mock_probe_data_gateway.reset_mock()
+                self.obj.dg_probe.last_result = PROBE_UNREACHABLE
+                with mock.patch.object(Supervise.time, 'sleep') as mock_sleep:
+                    self.obj.check_data_gateway_readiness()
+                mock_sleep.assert_not_called()
+                mock_probe_data_gateway.assert_called_once()
+                self.assertFalse(os.path.exists(flag))
+
+    @mock.patch.object(Supervise.Supervise, 'check_data_gateway_readiness')
+    @mock.patch.object(Supervise.Supervise, 'restart_data_gateway')
+    @mock.patch.object(Supervise.Supervise, 'manage_docker_data_gateway_connect_to_network')
+    @mock.patch.object(Supervise.Supervise, 'find_nuvlaedge_agent')
+    @mock.patch.object(Supervise.Supervise, 'manage_docker_data_gateway_object')
+    @mock.patch.object(Supervise.Supervise, 'manage_docker_data_gateway_network')
+    def test_data_gateway_restarted_on_max_probe_failures(self, mock_manage_docker_data_gateway_network,
+                                                          mock_manage_docker_data_gateway_object,
+                                                          mock_find_nuvlaedge_agent,
+                                                          mock_manage_docker_data_gateway_connect_to_network,
+                                                          mock_restart_data_gateway,
+                                                          mock_check_data_gateway_readiness):
+        self.obj.container_runtime.list_containers.return_value = []
+        mock_find_nuvlaedge_agent.return_value = fake.MockContainer('agent')
+
+        def failed_probe():
+            self.obj.agent_dg_failed_connection += 1
+
+        mock_check_data_gateway_readiness.side_effect = failed_probe
+        for _ in range(self.obj.dg_max_probe_failures - 1):
+            self.obj.manage_docker_data_gateway()
+        mock_restart_data_gateway.assert_not_called()
+
+        self.obj.manage_docker_data_gateway()
+        mock_restart_data_gateway.assert_called_once()
+        self.assertEqual(self.obj.agent_dg_failed_connection, 0,
+                         'Failed to reset the probe failures after restarting the DG')
+
+    @mock.patch.object(Supervise.Supervise, 'set_data_gateway_ready')
+    def test_data_gateway_probe_failures(self, mock_set_data_gateway_ready):
+        self.obj.dg_probe = mock.MagicMock()
+
+        def probe(result):
+            self.obj.dg_probe.last_result = result
+            return result
+
+        # the system manager cannot resolve the DG: that says nothing about the DG
+        self.obj.dg_probe.run.side_effect = lambda: probe(PROBE_UNREACHABLE)
+        self.obj.check_data_gateway_readiness()
+        self.assertEqual(self.obj.agent_dg_failed_connection, 0)
+
+        self.obj.dg_probe.run.side_effect = lambda: probe(Supervise.PROBE_FAILED)
+        for _ in range(3):
+            self.obj.check_data_gateway_readiness()
+        self.assertEqual(self.obj.agent_dg_failed_connection, 3,
+                         'Failed probes should be counted')
+        mock_set_data_gateway_ready.assert_called_with(False)
+
+        self.obj.dg_probe.run.side_effect = lambda: probe(Supervise.PROBE_OK)
+        self.obj.check_data_gateway_readiness()
+        self.assertEqual(self.obj.agent_dg_failed_connection, 0,
+                         'A successful probe should reset the failures')
+        mock_set_data_gateway_ready.assert_called_with(True)
+
+        # the DG cannot be restarted without its object
+        self.obj.data_gateway_object = None
+        self.obj.restart_data_gateway()
+
+    @mock.patch.object(Supervise.Supervise, 'set_data_gateway_ready')
+    @mock.patch.object(Supervise.Supervise, 'find_docker_network')
+    def test_manage_node_data_gateway(self, mock_find_docker_network, mock_set_data_gateway_ready):
+        self.obj.is_cluster_enabled = True
+        self.obj.dg_placement = 'node'
+        self.assertTrue(self.obj.uses_node_data_gateway())
+        client = self.obj.container_runtime.client
+        client.containers.get.side_effect = docker.errors.NotFound('')
+
+        # first the network of this node, and then its own DG, attached to it only
+        mock_find_docker_network.return_value = []
+        self.assertRaises(Supervise.BreakDGManagementCycle, self.obj.manage_node_data_gateway)
+        self.assertEqual(client.networks.create.call_args[0][0], Supervise.utils.data_gateway_node_net)
+        self.assertEqual(client.networks.create.call_args[1]['driver'], 'bridge')
+        kwargs = client.containers.run.call_args[1]
+        self.assertEqual(kwargs['network'], Supervise.utils.data_gateway_node_net)
+        self.assertEqual(kwargs['name'], self.obj.data_gateway_name)
+        self.assertNotIn('ports', kwargs,
+                         'The DG port should not be published on the node')
+        client.services.create.assert_not_called()
+        self.assertIsNotNone(self.obj.dg_bringup_started)
+
+        # cluster workers run their own DG as well
+        self.obj.i_am_manager = False
+        client.containers.get.side_effect = None
+        mock_find_docker_network.return_value = ['net']
+        client.networks.create.reset_mock()
+        self.assertIsNone(self.obj.manage_node_data_gateway())
+        client.networks.create.assert_not_called()
+        self.assertEqual(self.obj.data_gateway_object, client.containers.get.return_value)
+
+        # a DG that cannot be launched is reported
+        client.containers.get.side_effect = docker.errors.NotFound('')
+        client.containers.run.side_effect = docker.errors.APIError('boom')
+        self.obj.operational_status = []
+        self.assertRaises(Supervise.BreakDGManagementCycle, self.obj.manage_node_data_gateway)
+        self.assertEqual(self.obj.operational_status, [(Supervise.utils.status_degraded,
+                                                        'Unable to launch Data Gateway')])
+
+        # restarting it only restarts the DG of this node
+        self.obj.i_am_manager = True
+        self.obj.data_gateway_object = mock.MagicMock()
+        self.obj.restart_data_gateway()
+        self.obj.data_gateway_object.restart.assert_called_once()
+        self.obj.data_gateway_object.force_update.assert_not_called()
+
+    def test_remove_other_data_gateway_placement(self):
+        client = self.obj.container_runtime.client
+        self.obj.remove_other_data_gateway_placement()
+        self.assertFalse(self.obj.dg_placement_cleaned,
+                         'There is no other placement outside of Swarm mode')
+
+        # with the "node" placement, managers remove the DG service
+        self.obj.is_cluster_enabled = self.obj.i_am_manager = True
+        self.obj.dg_placement = 'node'
+        service, other = mock.MagicMock(), mock.MagicMock()
+        service.name, other.name = self.obj.data_gateway_name, f'{self.obj.data_gateway_name}-other'
+        client.services.list.return_value = [service, other]
+        self.obj.remove_other_data_gateway_placement()
+        service.remove.assert_called_once()
+        other.remove.assert_not_called()
+        self.assertTrue(self.obj.dg_placement_cleaned)
+
+        # only once per run
+        self.obj.remove_other_data_gateway_placement()
+        client.services.list.assert_called_once()
+
+        # with the "manager" placement, every node removes its own DG
+        self.obj.dg_placement_cleaned = False
+        self.obj.dg_placement = 'manager'
+        container = mock.MagicMock()
+        client.containers.list.return_value = [container]
+        self.obj.remove_other_data_gateway_placement()
+        self.assertEqual(client.containers.list.call_args[1]['filters'],
+                         {'label': 'nuvlaedge.data-gateway-placement=node'})
+        container.remove.assert_called_once_with(force=True)
+
+        # and tries again on the next run when it fails
+        self.obj.dg_placement_cleaned = False
+        client.containers.list.side_effect = docker.errors.APIError('boom')
+        self.obj.remove_other_data_gateway_placement()
+        self.assertFalse(self.obj.dg_placement_cleaned)
+
+    def test_check_data_gateway_load(self):
+        self.obj.dg_load = mock.MagicMock()
+        self.obj.operational_status = []
+
+        # the load is not read before the DG is ready
+        self.obj.data_gateway_ready = False
+        self.obj.check_data_gateway_load()
+        self.obj.dg_load.poll.assert_not_called()
+
+        self.obj.data_gateway_ready = True
+        self.obj.dg_load.poll.return_value = {}
+        self.obj.check_data_gateway_load()
+        self.assertEqual(self.obj.operational_status, [],
+                         'No notes should be added when the load cannot be read')
+
+        self.obj.dg_load.poll.return_value = {'clients': 2000}
+        self.obj.dg_load.saturated.return_value = ['2000 connected clients (max 1000)']
+        self.obj.dg_load.status_notes.return_value = [(Supervise.utils.status_degraded, 'Data Gateway is saturated')]
+        self.obj.check_data_gateway_load()
+        self.assertEqual(self.obj.operational_status, [(Supervise.utils.status_degraded, 'Data Gateway is saturated')],
+                         'Failed to report a saturated DG')
+
     def test_restart_data_gateway(self):
         self.obj.data_gateway_object = mock.MagicMock()
         # restart, depending on whether it is running in cluster or standalone mode
@@ -454,6 +768,16 @@ class SuperviseTestCase(unittest.TestCase):
         self.assertEqual(self.obj.data_gateway_object, 'dgc',
                          'Failed to set DG object in container mode')
 
+        # the DG container itself is looked up in the component registry
+        self.obj.container_runtime.components.get_container.return_value = 'dg-by-id'
+        self.assertTrue(self.obj.find_data_gateway(self.obj.data_gateway_name),
+                        'Failed to find DG container in the component registry')
+        self.assertEqual(self.obj.data_gateway_object, 'dg-by-id',
+                         'Failed to set DG object from the component registry')
+        self.obj.container_runtime.components.get_container.return_value = None
+        self.assertFalse(self.obj.find_data_gateway(self.obj.data_gateway_name),
+                         'Says DG container was found even though it does not exist')
+
         # in case of errors, get false and set obj to None
         self.obj.container_runtime.client.containers.get.side_effect = docker.errors.APIError('', requests.Response())
         self.assertFalse(self.obj.find_data_gateway('foo'),
@@ -558,32 +882,21 @@ class SuperviseTestCase(unittest.TestCase):
     def test_get_project_name(self):
         l = len(self.obj.operational_status)
         # exit on error, but log
-        self.obj.container_runtime.client.containers.get.side_effect = docker.errors.NotFound('', requests.Response())
+        type(self.obj.container_runtime.components).project_name = mock.PropertyMock(side_effect=RuntimeError)
         self.assertRaises(Exception, self.obj.get_project_name)
         self.assertEqual(len(self.obj.operational_status), l+1,
                          'Failed to add operational status after failing to get project name')
 
-        self.obj.container_runtime.client.containers.get.reset_mock(side_effect=True)
-        out_container = fake.MockContainer()
-        # get the project name if all goes well
-        self.obj.container_runtime.client.containers.get.return_value = out_container
-        self.assertEqual(self.obj.get_project_name(), fake.MockContainer().labels['com.docker.compose.project'],
-                         'Failed to get project name from container labels')
-
-        # if label does not exist
-        out_container.labels.pop('com.docker.compose.project')
-        # try the name
-        # outcome depends on the naming convention
-        out_container.name = 'bad-name'
-        self.obj.container_runtime.client.containers.get.return_value = out_container
+        # get the project name, as resolved by the component registry, if all goes well
+        type(self.obj.container_runtime.components).project_name = mock.PropertyMock(return_value='project')
+        self.assertEqual(self.obj.get_project_name(), 'project',
+                         'Failed to get project name from the component registry')
+
+        # if the project name could not be inferred
+        type(self.obj.container_runtime.components).project_name = mock.PropertyMock(return_value=None)
         self.assertRaises(Exception, self.obj.get_project_name)
         self.assertEqual(len(self.obj.operational_status), l+2,
-                         'Failed to add operational status when project name cannot be inferred from container name')
-
-        out_container.name = 'project-good-name'
-        self.obj.container_runtime.client.containers.get.return_value = out_container
-        self.assertEqual(self.obj.get_project_name(), out_container.name.split('-')[0],
-                         'Failed to get project name from container name')
+                         'Failed to add operational status when project name cannot be inferred')
 
     def test_fix_network_connectivity(self):
         net = fake.MockNetwork('target-net')
@@ -644,11 +957,11 @@ class SuperviseTestCase(unittest.TestCase):
         mock_get_project_name.side_effect = Exception
         self.assertIsNone(self.obj.check_nuvlaedge_docker_connectivity(),
                           'Tried to check Docker connectivity without a project name')
-        self.obj.container_runtime.client.containers.list.assert_not_called()
+        self.obj.container_runtime.list_containers.assert_not_called()
 
         # otherwise get containers and networks
         mock_get_project_name.reset_mock(side_effect=True)
-        self.obj.container_runtime.client.containers.list.return_value = []
+        self.obj.container_runtime.list_containers.return_value = []
         self.obj.container_runtime.client.networks.list.return_value = []
         # without container or networks, return none and add operational status
         l = len(self.obj.operational_status)
@@ -659,13 +972,19 @@ class SuperviseTestCase(unittest.TestCase):
         mock_fix_network_connectivity.assert_not_called()
 
         # otherwise, fix the connectivity
-        c = fake.MockContainer()
+        c = fake.MockContainer(status='running')
+        exited = fake.MockContainer(status='exited')
         n = fake.MockNetwork('net')
-        self.obj.container_runtime.client.containers.list.return_value = [c]
+        self.obj.container_runtime.list_containers.reset_mock()
+        self.obj.container_runtime.list_containers.return_value = [c, exited]
         self.obj.container_runtime.client.networks.list.return_value = [n]
         self.assertIsNone(self.obj.check_nuvlaedge_docker_connectivity(),
                           'Failed to check NB Docker connectivity')
+        # only running containers need to be connected, but all are kept for the healer
         mock_fix_network_connectivity.assert_called_once_with([c], n)
+        self.assertEqual(self.obj.nuvlaedge_containers, [c, exited],
+                         'Failed to keep the list of all NuvlaEdge containers')
+        self.obj.container_runtime.list_containers.assert_called_once()
 
     def test_heal_created_container(self):
         # simple action calling
@@ -677,51 +996,91 @@ class SuperviseTestCase(unittest.TestCase):
         self.assertIsNone(self.obj.heal_created_container(fake.MockContainer()),
                           'Failed to handle Docker API error when healing container in created state')
 
-    @mock.patch.object(Supervise.Supervise, 'restart_container')
-    @mock.patch('system_manager.Supervise.Timer')
-    def test_heal_exited_container(self, mock_timer, mock_restart_container):
+    @mock.patch.object(Supervise.DelayedRestartScheduler, 'start')
+    def test_heal_exited_container(self, mock_start):
         container = fake.MockContainer()
+        scheduled = Supervise.metrics.restarts_scheduled.value(container=container.name)
         container.attrs['State'] = {'ExitCode': 0}  # nothing to do
         self.assertIsNone(self.obj.heal_exited_container(container),
                           'Tried to heal an exited container with status 0')
-        mock_timer.assert_not_called()
-        container.is_alive_counter.assert_not_called()
+        self.assertEqual(self.obj.restart_scheduler.pending(), [])
 
         container.attrs['State'] = {'ExitCode': 1, 'Restarting': True}  # already restarting, nothing to do
         self.assertIsNone(self.obj.heal_exited_container(container),
                           'Tried to heal an exited container that is already restarting')
-        mock_timer.assert_not_called()
-        container.is_alive_counter.assert_not_called()
+        self.assertEqual(self.obj.restart_scheduler.pending(), [])
 
         container.attrs['State']['Restarting'] = False
         container.attrs['HostConfig'] = {'RestartPolicy': {'Name': 'no'}}   # not to be restarted, nothing to do
         self.assertIsNone(self.obj.heal_exited_container(container),
                           'Tried to heal an exited container that is not supposed to be restarted')
-        mock_timer.assert_not_called()
-        container.is_alive_counter.assert_not_called()
-
+        self.assertEqual(self.obj.restart_scheduler.pending(), [])
+
+        # container summaries are only inspected if they did not exit gracefully
+        summary = fake.MockContainer(status='exited')
+        summary.attrs['State'] = 'exited'
+        summary.attrs['Status'] = 'Exited (0) 2 minutes ago'
+        summary.reload = mock.MagicMock()
+        self.assertIsNone(self.obj.heal_exited_container(summary),
+                          'Tried to heal a container summary with exit code 0')
+        summary.reload.assert_not_called()
+        summary.attrs['Status'] = 'Exited (1) 2 minutes ago'
+        summary.reload.side_effect = lambda: summary.attrs.update({'State': {'ExitCode': 1, 'Restarting': True}})
+        self.assertIsNone(self.obj.heal_exited_container(summary),
+                          'Failed to inspect a container summary with exit code > 0')
+        summary.reload.assert_called_once()
+        self.assertEqual(self.obj.restart_scheduler.pending(), [])
+        mock_start.assert_not_called()
+
+        # if container is not restarting, schedule its restart
         container.attrs['HostConfig']['RestartPolicy']['Name'] = 'always'
-        # container can be in restarting list, but if it is alive, do nothing
-        self.obj.nuvlaedge_containers_restarting[container.name] = container
         self.assertIsNone(self.obj.heal_exited_container(container),
-                          'Tried to heal an exited container that is not known')
-        mock_timer.assert_not_called()
-        container.is_alive_counter.assert_called_once()
+                          'Failed to heal an exited container that is not restarting')
+        self.assertEqual(self.obj.restart_scheduler.pending(), [container.name],
+                         'Failed to schedule the restart of an exited container')
+        mock_start.assert_called_once()
 
-        # if container not alive, restart it
-        container.am_i_alive = False
+        # but only once
         self.assertIsNone(self.obj.heal_exited_container(container),
-                          'Failed to heal an exited container that is not alive')
-        mock_timer.assert_called_once_with(30, mock_restart_container, (container.name, container.id))
-        self.assertEqual(container.is_alive_counter.call_count, 2,
-                         'Should have seen if container is alive, twice')
+                          'Failed to heal an exited container whose restart is already scheduled')
+        self.assertEqual(Supervise.metrics.restarts_scheduled.value(container=container.name), scheduled + 1,
+                         'Should have scheduled a single restart')
 
-        # if container is not restarting, restart it
-        self.obj.nuvlaedge_containers_restarting.pop(container.name)
-        self.assertIsNone(self.obj.heal_exited_container(container),
-                          'Failed to heal an exited container that is not restarting')
-        self.assertEqual(mock_timer.call_count, 2,
-                         'Should have called called a restart twice')
+    @mock.patch.object(Supervise.DelayedRestartScheduler, 'start')
+    def test_heal_crash_looping_container(self, mock_start):
+        self.obj.crash_loops = Supervise.CrashLoopBreaker(max_failures=3, jitter=0)
+        container = fake.MockContainer()
+        container.attrs['HostConfig'] = {'RestartPolicy': {'Name': 'always'}}
+
+        delays = []
+        for i in range(3):
+            container.attrs['State'] = {'ExitCode': 1, 'StartedAt': f'2023-01-01T00:0{i}:00.1Z',
+                                        'FinishedAt': f'2023-01-01T00:0{i}:10.1Z'}
+            self.obj.operational_status = []
+            self.obj.heal_exited_container(container)
+            if self.obj.restart_scheduler.is_pending(container.name):
+                delays.append(self.obj.restart_scheduler._pending[container.name].due_at)
+                self.obj.restart_scheduler.cancel(container.name)
+
+        self.assertEqual(len(delays), 2,
+                         'Should not restart a container that keeps crashing')
+        self.assertAlmostEqual(delays[1] - delays[0], self.obj.restart_delay, delta=1,
+                               msg='Should wait longer before restarting a container that crashed again')
+        self.assertEqual(len(self.obj.operational_status), 1)
+        self.assertIn('crash looping', self.obj.operational_status[0][1],
+                      'Failed to report the crash loop')
+
+    def test_container_priority(self):
+        self.assertEqual(Supervise.container_priority(f'{Supervise.utils.compose_project_name}-agent-1'),
+                         Supervise.PRIORITY_HIGH)
+        self.assertEqual(Supervise.container_priority(Supervise.utils.data_gateway_name), Supervise.PRIORITY_HIGH)
+        self.assertEqual(Supervise.container_priority(123), Supervise.PRIORITY_NORMAL)
+
+    def test_uptime_from_state(self):
+        self.assertEqual(Supervise.uptime_from_state({'StartedAt': '2023-04-26T09:28:31.546345784Z',
+                                                      'FinishedAt': '2023-04-26T09:30:01.1Z'}), 90)
+        self.assertIsNone(Supervise.uptime_from_state({'StartedAt': '2023-04-26T09:28:31Z'}))
+        self.assertIsNone(Supervise.uptime_from_state({'StartedAt': 'now', 'FinishedAt': 'later'}))
 
     @mock.patch.object(Supervise.Supervise, 'heal_exited_container')
     @mock.patch.object(Supervise.Supervise, 'heal_created_container')
@@ -731,18 +1090,18 @@ class SuperviseTestCase(unittest.TestCase):
         self.assertIsNone(self.obj.docker_container_healer(),
                           'Tried to heal containers when there are none')
 
-        # if there are obsolete containers, remove them from the obsolete list
+        # if there are obsolete containers, cancel their restarts
         obsolete_container = fake.MockContainer()
         # if ["paused", "running", "restarting"], do nothing
         self.obj.nuvlaedge_containers = [fake.MockContainer('1', status='paused'),
                                         fake.MockContainer('2', status='running'),
                                         fake.MockContainer('3', status='restarting')]
-        self.obj.nuvlaedge_containers_restarting = {**{c.name: {} for c in self.obj.nuvlaedge_containers},
-                                                    **{obsolete_container.name: {}}}
+        for c in self.obj.nuvlaedge_containers + [obsolete_container]:
+            self.obj.restart_scheduler.schedule(c.name, c.id, 3600)
         self.assertIsNone(self.obj.docker_container_healer(),
                           'Tried to heal containers that are in a good state, which are not to be healed')
-        self.assertEqual(len(self.obj.nuvlaedge_containers_restarting), 3,
-                         'Failed to pop obsolete containers from memory')
+        self.assertEqual(self.obj.restart_scheduler.pending(), [],
+                         'Failed to cancel the restarts of obsolete and recovered containers')
         mock_heal_created_container.assert_not_called()
         mock_heal_exited_container.assert_not_called()
 
@@ -761,10 +1120,76 @@ class SuperviseTestCase(unittest.TestCase):
                           'Failed to heal exited containers')
         mock_heal_exited_container.assert_called_once_with(exited_container)
 
+    @mock.patch.object(Supervise.Supervise, 'restart_container')
+    @mock.patch.object(Supervise.Supervise, 'heal_created_container')
+    def test_heal_in_waves(self, mock_heal_created_container, mock_restart_container):
+        def container(service, status, depends_on=''):
+            c = fake.MockContainer(f'nuvlaedge-{service}-1', status=status)
+            c.labels.update({'com.docker.compose.service': service, 'com.docker.compose.depends_on': depends_on})
+            c.attrs.update({'State': {'ExitCode': 255, 'FinishedAt': 'reboot'},
+                            'HostConfig': {'RestartPolicy': {'Name': 'always'}}})
+            return c
+
+        healed = []
+        mock_heal_created_container.side_effect = lambda c: healed.append(c.name)
+        mock_restart_container.side_effect = lambda name, container_id: healed.append(name)
+        self.obj.healer_mode = 'waves'
+        self.obj.nuvlaedge_containers = [
+            container('compute-api', 'exited', 'agent:service_started:false'),
+            container('agent', 'exited', 'system-manager:service_started:false,security:service_started:false'),
+            container('system-manager', 'running'),
+            container('security', 'created'),
+            container('vpn-client', 'created', 'agent:service_started:false')]
+
+        self.obj.docker_container_healer()
+        self.assertEqual(healed[0], 'nuvlaedge-security-1',
+                         'Dependencies should be healed first')
+        self.assertEqual(healed[1], 'nuvlaedge-agent-1')
+        self.assertEqual(sorted(healed[2:]), ['nuvlaedge-compute-api-1', 'nuvlaedge-vpn-client-1'])
+        self.assertEqual(self.obj.restart_scheduler.pending(), [],
+                         'Exited containers should have been restarted right away')
+
+        # restarts of containers that crashed before are still delayed
+        healed.clear()
+        with mock.patch.object(Supervise.DelayedRestartScheduler, 'start'):
+            for c in self.obj.nuvlaedge_containers:
+                c.attrs['State']['FinishedAt'] = 'crashed again'
+            self.obj.docker_container_healer()
+        self.assertEqual(sorted(healed), ['nuvlaedge-security-1', 'nuvlaedge-vpn-client-1'])
+        self.assertEqual(sorted(self.obj.restart_scheduler.pending()),
+                         ['nuvlaedge-agent-1', 'nuvlaedge-compute-api-1'])
+
+    def test_scheduled_restart_outcome(self):
+        self.obj.container_runtime.client.api.restart.side_effect = docker.errors.APIError('', requests.Response())
+        self.obj.nuvlaedge_containers = [fake.MockContainer('1', status='exited')]
+        self.obj.restart_scheduler.schedule('1', 'id', 0)
+        self.obj.operational_status = []
+
+        # the restart runs in the scheduler thread, but its outcome is reported by the healer
+        t = threading.Thread(target=self.obj.restart_scheduler.run_due)
+        t.start()
+        t.join()
+        self.assertEqual(self.obj.operational_status, [],
+                         'Restart outcome leaked into the status of another thread')
+        with mock.patch.object(Supervise.Supervise, 'heal_exited_container'):
+            self.obj.docker_container_healer()
+        self.assertEqual(self.obj.operational_status, [(Supervise.utils.status_degraded, 'Container 1 is down')],
+                         'Failed to report the failed restart')
+
+        # until the container recovers
+        self.obj.operational_status = []
+        self.obj.nuvlaedge_containers[0].status = 'running'
+        self.obj.docker_container_healer()
+        self.assertEqual(self.obj.operational_status, [],
+                         'Failed to forget the failed restart of a recovered container')
+
     def test_restart_container(self):
+        restarted = Supervise.metrics.restarts_performed.value(container='name', result='success')
         self.assertIsNone(self.obj.restart_container('name', 'id'),
                           'Failed to restart container')
         self.obj.container_runtime.client.api.restart.assert_called_once_with('id')
+        self.assertEqual(Supervise.metrics.restarts_performed.value(container='name', result='success'), restarted+1,
+                         'Failed to count restart')
 
         # when it fail, add status note
         self.obj.container_runtime.client.api.restart.side_effect = docker.errors.APIError('', requests.Response())
@@ -791,3 +1216,15 @@ class SuperviseTestCase(unittest.TestCase):
                           'Failed to handle network disconnection error')
         self.assertEqual(len(self.obj.operational_status), l+2,
                          'Failed to append operational status for container restart error and net disconnect error')
+
+    def test_operational_status_per_thread(self):
+        self.obj.operational_status = [('main', 'note')]
+
+        def check():
+            self.obj.operational_status.append(('thread', 'note'))
+
+        t = threading.Thread(target=check)
+        t.start()
+        t.join()
+        self.assertEqual(self.obj.operational_status, [('main', 'note')],
+                         'Status reported from another thread leaked into this one')
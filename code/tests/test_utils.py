@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import json
 import logging
 import mock
+import os
+import tempfile
 import unittest
+import system_manager.common.Metrics as metrics
 import system_manager.common.utils as utils
 
 
@@ -16,12 +20,67 @@ class DockerTestCase(unittest.TestCase):
         logging.disable(logging.NOTSET)
 
     def test_set_operational_status(self):
-        # writes twice
-        with mock.patch("system_manager.common.utils.open") as mock_open:
-            self.assertIsNone(utils.set_operational_status('status', []),
+        with mock.patch.object(utils.status_writer, 'write') as mock_write:
+            self.assertIsNone(utils.set_operational_status('status', ['note']),
                               'Failed to set operational status')
-            self.assertEqual(mock_open.call_count, 2,
-                             'Should write two files when setting operational status')
+            mock_write.assert_called_once_with('status', ['note'])
+
+    def test_atomic_write(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'file')
+            utils.atomic_write(path, 'one')
+            utils.atomic_write(path, 'two')
+            with open(path) as f:
+                self.assertEqual(f.read(), 'two',
+                                 'Failed to replace file content')
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o644,
+                             'Other users should be able to read the file')
+
+            # on failure, the old content is kept and no temporary file is left behind
+            with mock.patch('os.replace', side_effect=OSError('disk full')):
+                self.assertRaises(OSError, utils.atomic_write, path, 'three')
+            with open(path) as f:
+                self.assertEqual(f.read(), 'two',
+                                 'Old content should be kept when the write fails')
+            self.assertEqual(os.listdir(tmp), ['file'],
+                             'Temporary file was left behind')
+
+    def test_status_writer(self):
+        written = metrics.status_writes.value(result='written')
+        skipped = metrics.status_writes.value(result='skipped')
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = utils.StatusWriter(os.path.join(tmp, '.status'),
+                                        os.path.join(tmp, '.status_notes'),
+                                        os.path.join(tmp, '.status.json'))
+            self.assertTrue(writer.write(utils.status_degraded, ['a', 'b']),
+                            'Failed to write status')
+            with open(writer.status_file) as s, open(writer.notes_file) as n, open(writer.json_file) as j:
+                self.assertEqual((s.read(), n.read()), (utils.status_degraded, 'a\nb'),
+                                 'Wrong status content')
+                self.assertEqual(json.load(j)['notes'], ['a', 'b'],
+                                 'Wrong versioned status content')
+
+            # unchanged status is not written again
+            self.assertFalse(writer.write(utils.status_degraded, ['a', 'b']),
+                             'Should not write unchanged status')
+            self.assertEqual((writer.writes, writer.skipped, writer.version), (1, 1, 1),
+                             'Failed to count writes')
+
+            # unless the files are gone
+            os.remove(writer.status_file)
+            self.assertTrue(writer.write(utils.status_degraded, ['a', 'b']),
+                            'Should write status when the file is missing')
+
+            self.assertTrue(writer.write(utils.status_operational),
+                            'Failed to write changed status')
+            with open(writer.json_file) as j:
+                self.assertEqual(json.load(j)['version'], 3,
+                                 'Failed to version status')
+            self.assertEqual((writer.writes, writer.skipped), (3, 1),
+                             'Failed to count writes')
+            self.assertEqual((metrics.status_writes.value(result='written') - written,
+                              metrics.status_writes.value(result='skipped') - skipped), (3, 1),
+                             'Failed to export the count of writes')
 
     @mock.patch('os.path.exists')
     def test_status_file_exists(self, mock_exists):
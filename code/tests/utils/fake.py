@@ -89,6 +89,11 @@ def mock_kubernetes_node(uid: str=None, ready: bool=True):
     return json.loads(json.dumps(node), object_hook=lambda d: SimpleNamespace(**d))
 
 
+def mock_kubernetes_list(items: list, _continue: str = None):
+    """ One page of a Kubernetes list response """
+    return SimpleNamespace(items=items, metadata=SimpleNamespace(_continue=_continue))
+
+
 class Fake(object):
     """Create Mock()ed methods that match another class's methods."""
 
@@ -0,0 +1,694 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Fake Docker Engine API server, on a UNIX socket
+
+Simulates a NuvlaEdge installation (system manager, agent, compute API, data gateway, ...) amongst any number of other
+containers, networks, Swarm nodes and services, so that whole rounds of supervision checks can run without a Docker
+daemon. Every request can be delayed, to simulate a slow or loaded daemon, e.g.
+
+    with FakeDockerDaemon('/tmp/docker.sock', containers=1000, networks=50, latency=0.005) as daemon:
+        client = docker.DockerClient(base_url='unix:///tmp/docker.sock')
+        ...
+        print(daemon.requests)
+
+Only implements the parts of the API the system manager uses
+"""
+
+import hashlib
+import json
+import os
+import re
+import socket
+import socketserver
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler
+from typing import Dict, Union
+from urllib.parse import parse_qs, unquote, urlparse
+
+from system_manager.common import utils
+from system_manager.common.ApiAccounting import normalize_docker_endpoint
+
+API_VERSION = '1.41'
+ENGINE_VERSION = '24.0.7'
+
+# NuvlaEdge components, as (compose service, extra labels)
+NUVLAEDGE_SERVICES = [
+    ('system-manager', {}),
+    ('agent', {}),
+    ('compute-api', {}),
+    ('job-engine-lite', {}),
+    ('on-stop', {}),
+    ('security', {}),
+    ('vpn-client', {}),
+]
+
+
+def make_id(name: str) -> str:
+    """ Deterministic 64 hex digits ID, so that runs are comparable """
+    return hashlib.sha256(name.encode()).hexdigest()
+
+
+class FakeDockerState:
+    """ Containers, networks, nodes and services of the fake daemon """
+
+    def __init__(self, containers: int = 10, networks: int = 10, nodes: int = 1, services: int = 0,
+                 swarm: bool = True, project_name: str = utils.compose_project_name, hostname: str = None):
+        """ Builds the NuvlaEdge installation, and fills up the node with other containers, networks and services
+
+        :param containers: total number of containers (at least the NuvlaEdge ones)
+        :param networks: total number of networks (at least the NuvlaEdge ones)
+        :param nodes: number of Swarm nodes. The first one is this node, a manager
+        :param services: number of Swarm services, besides the data gateway
+        :param swarm: whether Swarm mode is active. Otherwise, the data gateway is a container
+        :param project_name: Docker Compose project name of the NuvlaEdge
+        :param hostname: hostname of the system manager container, by which it looks itself up.
+        Defaults to this host's name
+        """
+        self.project_name = project_name
+        self.swarm = swarm
+        self.containers: Dict[str, dict] = {}
+        self.networks: Dict[str, dict] = {}
+        self.nodes: Dict[str, dict] = {}
+        self.services: Dict[str, dict] = {}
+        self.lock = threading.RLock()
+
+        default_net = self.add_network(f'{project_name}_default',
+                                       labels={'com.docker.compose.project': project_name,
+                                               'com.docker.compose.network': 'default'})
+        shared_net = self.add_network(utils.nuvlaedge_shared_net, driver='overlay' if swarm else 'bridge',
+                                      labels={'nuvlaedge.network': 'True', 'nuvlaedge.data-gateway': 'True'})
+        self.add_network('bridge')
+        for i in range(len(self.networks), networks):
+            self.add_network(f'app-{i}_default', labels={'com.docker.compose.project': f'app-{i}'})
+
+        for service, labels in NUVLAEDGE_SERVICES:
+            self.add_container(f'{project_name}-{service}-1', networks=[default_net['Name']],
+                               state='paused' if service == 'on-stop' else 'running',
+                               hostname=(hostname or socket.gethostname()) if service == 'system-manager' else None,
+                               labels={'nuvlaedge.component': 'True',
+                                       'com.docker.compose.project': project_name,
+                                       'com.docker.compose.service': service,
+                                       **labels})
+
+        if not swarm:
+            self.add_container(utils.data_gateway_name, networks=[shared_net['Name']],
+                               labels={'nuvlaedge.component': 'True', 'nuvlaedge.data-gateway': 'True'})
+
+        for i in range(len(self.containers), containers):
+            app = i % max(1, networks - 3)
+            labels = {'com.docker.compose.project': f'app-{app}', 'com.docker.compose.service': f'service-{i}'}
+            if i % 10 == 0:
+                labels['nuvlaedge.data-source-container'] = 'True'
+            # a few of them are done with their job
+            self.add_container(f'app-{app}-service-{i}-1', labels=labels,
+                               networks=[f'app-{app}_default' if f'app-{app}_default' in self.networks else 'bridge'],
+                               state='exited' if i % 7 == 0 else 'running')
+
+        for i in range(nodes):
+            self.add_node(f'node-{i}', manager=i == 0)
+
+        if swarm:
+            self.add_service(utils.data_gateway_name, networks=[shared_net['Id']],
+                             labels={'nuvlaedge.component': 'True', 'nuvlaedge.data-gateway': 'True'})
+        for i in range(services):
+            self.add_service(f'service-{i}')
+
+    @property
+    def node_id(self) -> Union[str, None]:
+        return next(iter(self.nodes), None) if self.swarm else None
+
+    def add_network(self, name: str, driver: str = 'bridge', labels: dict = None) -> dict:
+        network = {
+            'Name': name,
+            'Id': make_id(f'network/{name}'),
+            'Created': '2023-01-01T00:00:00.000000000Z',
+            'Scope': 'swarm' if driver == 'overlay' else 'local',
+            'Driver': driver,
+            'EnableIPv6': False,
+            'IPAM': {'Driver': 'default', 'Options': None, 'Config': []},
+            'Internal': False,
+            'Attachable': driver == 'overlay',
+            'Ingress': False,
+            'Containers': {},
+            'Options': {},
+            'Labels': labels or {},
+        }
+        self.networks[network['Id']] = network
+        return network
+
+    def add_container(self, name: str, labels: dict = None, networks: list = (), state: str = 'running',
+                      exit_code: int = 0, hostname: str = None, image: str = 'alpine:3.18') -> dict:
+        """ Adds a container
+
+        :param name: container name
+        :param labels: container labels
+        :param networks: names of the networks it is connected to
+        :param state: running, exited, created, paused, restarting
+        :param exit_code: exit code, if exited
+        :param hostname: hostname, by which it can also be looked up. Defaults to the short ID, as in Docker
+        :param image: image name
+        :return: the container, as inspected
+        """
+        container_id = make_id(f'container/{name}')
+        container = {
+            'Id': container_id,
+            'Created': '2023-01-01T00:00:00.000000000Z',
+            'Path': 'sh',
+            'Args': [],
+            'State': {},
+            'Image': make_id(f'image/{image}'),
+            'Name': f'/{name}',
+            'RestartCount': 0,
+            'Config': {'Hostname': hostname or container_id[:12], 'Image': image, 'Labels': labels or {},
+                       'Env': [], 'Cmd': ['sh']},
+            'HostConfig': {'NetworkMode': networks[0] if networks else 'default',
+                           'RestartPolicy': {'Name': 'always' if state != 'exited' else 'no', 'MaximumRetryCount': 0}},
+            'NetworkSettings': {'Networks': {}},
+            'Mounts': [],
+        }
+        self.containers[container_id] = container
+        self.set_state(container, state, exit_code)
+        for network in networks:
+            self.connect(self.find(self.networks, network), container)
+        return container
+
+    def add_node(self, hostname: str, manager: bool = False) -> dict:
+        node = {
+            'ID': make_id(f'node/{hostname}')[:25],
+            'Version': {'Index': 1},
+            'CreatedAt': '2023-01-01T00:00:00.000000000Z',
+            'Spec': {'Labels': {}, 'Role': 'manager' if manager else 'worker', 'Availability': 'active'},
+            'Description': {'Hostname': hostname, 'Platform': {'Architecture': 'x86_64', 'OS': 'linux'},
+                            'Engine': {'EngineVersion': ENGINE_VERSION}},
+            'Status': {'State': 'ready', 'Addr': f'10.0.0.{len(self.nodes) + 1}'},
+        }
+        if manager:
+            node['ManagerStatus'] = {'Leader': True, 'Reachability': 'reachable', 'Addr': '10.0.0.1:2377'}
+        self.nodes[node['ID']] = node
+        return node
+
+    def add_service(self, name: str, networks: list = (), labels: dict = None) -> dict:
+        service = {
+            'ID': make_id(f'service/{name}')[:25],
+            'Version': {'Index': 1},
+            'CreatedAt': '2023-01-01T00:00:00.000000000Z',
+            'Spec': {'Name': name, 'Labels': labels or {},
+                     'TaskTemplate': {'ContainerSpec': {'Image': 'alpine:3.18'},
+                                      'Networks': [{'Target': n} for n in networks]},
+                     'Mode': {'Replicated': {'Replicas': 1}}},
+            'Endpoint': {'Spec': {}, 'VirtualIPs': [{'NetworkID': n, 'Addr': '10.0.1.2/24'} for n in networks]},
+        }
+        self.services[service['ID']] = service
+        return service
+
+    @staticmethod
+    def set_state(container: dict, state: str, exit_code: int = 0) -> None:
+        container['State'] = {
+            'Status': state,
+            'Running': state in ('running', 'paused', 'restarting'),
+            'Paused': state == 'paused',
+            'Restarting': state == 'restarting',
+            'OOMKilled': False,
+            'Dead': False,
+            'Pid': 1234 if state == 'running' else 0,
+            'ExitCode': exit_code if state == 'exited' else 0,
+            'Error': '',
+            'StartedAt': '2023-01-01T00:00:01.000000000Z',
+            'FinishedAt': '2023-01-01T01:00:00.000000000Z' if state == 'exited' else '0001-01-01T00:00:00Z',
+        }
+
+    @staticmethod
+    def connect(network: dict, container: dict, aliases: list = None) -> None:
+        container['NetworkSettings']['Networks'][network['Name']] = {
+            'NetworkID': network['Id'],
+            'EndpointID': make_id(f'endpoint/{network["Id"]}/{container["Id"]}'),
+            'Aliases': aliases,
+            'IPAddress': '172.18.0.2',
+        }
+        network['Containers'][container['Id']] = {'Name': container['Name'].lstrip('/')}
+
+    @staticmethod
+    def disconnect(network: dict, container: dict) -> None:
+        container['NetworkSettings']['Networks'].pop(network['Name'], None)
+        network['Containers'].pop(container['Id'], None)
+
+    @staticmethod
+    def find(objects: Dict[str, dict], ref: str) -> Union[dict, None]:
+        """ Finds an object by ID, unique ID prefix, name or (for containers) hostname, like Docker does """
+        if ref in objects:
+            return objects[ref]
+
+        ref = ref.lstrip('/')
+        by_prefix = [o for object_id, o in objects.items() if object_id.startswith(ref)]
+        for o in objects.values():
+            name = o.get('Name') or o.get('Spec', {}).get('Name') or o.get('Description', {}).get('Hostname')
+            if name.lstrip('/') == ref or o.get('Config', {}).get('Hostname') == ref:
+                return o
+
+        return by_prefix[0] if len(by_prefix) == 1 else None
+
+    @staticmethod
+    def summary(container: dict) -> dict:
+        """ Container, as listed by /containers/json """
+        state = container['State']
+        status = f'Exited ({state["ExitCode"]}) 2 hours ago' if state['Status'] == 'exited' else 'Up 2 hours'
+        return {
+            'Id': container['Id'],
+            'Names': [container['Name']],
+            'Image': container['Config']['Image'],
+            'ImageID': container['Image'],
+            'Command': 'sh',
+            'Created': 1672531200,
+            'Ports': [],
+            'Labels': container['Config']['Labels'],
+            'State': state['Status'],
+            'Status': status,
+            'HostConfig': {'NetworkMode': container['HostConfig']['NetworkMode']},
+            'NetworkSettings': container['NetworkSettings'],
+            'Mounts': [],
+        }
+
+    @staticmethod
+    def matches_labels(labels: dict, wanted: list) -> bool:
+        for label in wanted:
+            key, sep, value = label.partition('=')
+            if key not in labels or (sep and labels[key] != value):
+                return False
+        return True
+
+    def list_containers(self, filters: dict, all: bool) -> list:
+        containers = []
+        for container in self.containers.values():
+            status = container['State']['Status']
+            if not all and status not in ('running', 'paused', 'restarting'):
+                continue
+            if not self.matches_labels(container['Config']['Labels'], filters.get('label', [])):
+                continue
+            if filters.get('status') and status not in filters['status']:
+                continue
+            if filters.get('name') and not any(re.search(n, container['Name']) for n in filters['name']):
+                continue
+            if filters.get('id') and not any(container['Id'].startswith(i) for i in filters['id']):
+                continue
+            containers.append(self.summary(container))
+        return containers
+
+    def list_networks(self, filters: dict) -> list:
+        networks = []
+        for network in self.networks.values():
+            if not self.matches_labels(network['Labels'], filters.get('label', [])):
+                continue
+            if filters.get('driver') and network['Driver'] not in filters['driver']:
+                continue
+            if filters.get('name') and not any(n in network['Name'] for n in filters['name']):
+                continue
+            if filters.get('id') and not any(network['Id'].startswith(i) for i in filters['id']):
+                continue
+            # networks are listed without their containers
+            networks.append({**network, 'Containers': {}})
+        return networks
+
+    def info(self) -> dict:
+        node_id = self.node_id
+        managers = [{'NodeID': n['ID'], 'Addr': n['ManagerStatus']['Addr']}
+                    for n in self.nodes.values() if 'ManagerStatus' in n]
+        return {
+            'ID': 'FAKE:DOCKER:DAEMON',
+            'Containers': len(self.containers),
+            'ContainersRunning': len([c for c in self.containers.values() if c['State']['Running']]),
+            'Images': 42,
+            'Driver': 'overlay2',
+            'KernelVersion': '6.1.0',
+            'OperatingSystem': 'Fake Docker Engine',
+            'OSType': 'linux',
+            'Architecture': 'x86_64',
+            'NCPU': 4,
+            'MemTotal': 8 * 1024 ** 3,
+            'Name': 'fake-docker',
+            'ServerVersion': ENGINE_VERSION,
+            'Warnings': [],
+            'Swarm': {
+                'NodeID': node_id or '',
+                'NodeAddr': '10.0.0.1' if node_id else '',
+                'LocalNodeState': 'active' if node_id else 'inactive',
+                'ControlAvailable': bool(node_id),
+                'Error': '',
+                'RemoteManagers': managers if node_id else None,
+                'Nodes': len(self.nodes) if node_id else 0,
+                'Managers': len(managers) if node_id else 0,
+            },
+        }
+
+
+class FakeDockerRequestHandler(BaseHTTPRequestHandler):
+    """ Routes the requests to the FakeDockerState of the server """
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeDocker'
+
+    routes = [
+        ('GET', r'/_ping', 'ping'),
+        ('HEAD', r'/_ping', 'ping'),
+        ('GET', r'/version', 'version'),
+        ('GET', r'/info', 'info'),
+        ('GET', r'/events', 'events'),
+        ('GET', r'/containers/json', 'list_containers'),
+        ('POST', r'/containers/create', 'create_container'),
+        ('GET', r'/containers/(?P<ref>[^/]+)/json', 'inspect_container'),
+        ('POST', r'/containers/(?P<ref>[^/]+)/(?P<action>start|stop|restart|kill|pause|unpause)', 'container_action'),
+        ('DELETE', r'/containers/(?P<ref>[^/]+)', 'remove_container'),
+        ('GET', r'/networks', 'list_networks'),
+        ('POST', r'/networks/create', 'create_network'),
+        ('GET', r'/networks/(?P<ref>[^/]+)', 'inspect_network'),
+        ('POST', r'/networks/(?P<ref>[^/]+)/(?P<action>connect|disconnect)', 'network_action'),
+        ('DELETE', r'/networks/(?P<ref>[^/]+)', 'remove_network'),
+        ('GET', r'/nodes', 'list_nodes'),
+        ('GET', r'/nodes/(?P<ref>[^/]+)', 'inspect_node'),
+        ('POST', r'/nodes/(?P<ref>[^/]+)/update', 'update_node'),
+        ('GET', r'/services', 'list_services'),
+        ('POST', r'/services/create', 'create_service'),
+        ('GET', r'/services/(?P<ref>[^/]+)', 'inspect_service'),
+        ('POST', r'/services/(?P<ref>[^/]+)/update', 'update_service'),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self) -> FakeDockerState:
+        return self.server.daemon.state
+
+    def send_json(self, code: int, data: Union[dict, list, None]) -> None:
+        body = json.dumps(data).encode() if data is not None else b''
+        self.send_response(code)
+        self.send_header('Api-Version', API_VERSION)
+        if body:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, code: int, message: str) -> None:
+        self.send_json(code, {'message': message})
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        return (json.loads(self.rfile.read(length)) or {}) if length else {}
+
+    def handle_request(self):
+        url = urlparse(self.path)
+        path = re.sub(r'^/v\d+\.\d+', '', url.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.body = self.read_json()
+
+        daemon = self.server.daemon
+        endpoint = normalize_docker_endpoint(self.command, path)
+        daemon.count(endpoint)
+        latency = daemon.latency_of(endpoint)
+        if latency:
+            time.sleep(latency)
+
+        for method, pattern, name in self.routes:
+            match = re.fullmatch(pattern, path)
+            if method == self.command and match:
+                if name == 'events':
+                    # streamed, so without holding the lock
+                    return self.events()
+                with self.state.lock:
+                    return getattr(self, name)(**{k: unquote(v) for k, v in match.groupdict().items()})
+
+        self.send_error_json(404, f'page not found: {self.command} {path}')
+
+    do_GET = do_POST = do_DELETE = do_HEAD = handle_request
+
+    @property
+    def filters(self) -> Dict[str, list]:
+        filters = json.loads(self.query.get('filters') or '{}')
+        # filters can be either {"label": ["a=b"]} or {"label": {"a=b": true}}
+        return {k: list(v) if isinstance(v, (list, dict)) else [v] for k, v in filters.items()}
+
+    def ping(self):
+        body = b'OK' if self.command == 'GET' else b''
+        self.send_response(200)
+        self.send_header('Api-Version', API_VERSION)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def version(self):
+        self.send_json(200, {'Version': ENGINE_VERSION, 'ApiVersion': API_VERSION, 'MinAPIVersion': '1.12',
+                             'Os': 'linux', 'Arch': 'amd64',
+                             'Components': [{'Name': 'Engine', 'Version': ENGINE_VERSION}]})
+
+    def info(self):
+        self.send_json(200, self.state.info())
+
+    def events(self):
+        """ Streams the events emitted by the daemon, until it is stopped (or until "until", if given) """
+        self.send_response(200)
+        self.send_header('Api-Version', API_VERSION)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.wfile.flush()
+
+        daemon = self.server.daemon
+        sent = len(daemon.events)
+        while 'until' not in self.query:
+            with daemon.events_changed:
+                daemon.events_changed.wait_for(lambda: daemon.stopped or len(daemon.events) > sent)
+                if daemon.stopped:
+                    break
+                new, sent = daemon.events[sent:], len(daemon.events)
+            try:
+                for event in new:
+                    data = json.dumps(event).encode() + b'\n'
+                    self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+                self.wfile.flush()
+            except OSError:
+                # the client went away
+                return
+
+        self.close_connection = True
+        try:
+            self.wfile.write(b'0\r\n\r\n')
+        except OSError:
+            pass
+
+    def list_containers(self):
+        self.send_json(200, self.state.list_containers(self.filters, self.query.get('all') in ('1', 'true', 'True')))
+
+    def create_container(self):
+        name = self.query.get('name') or make_id(str(time.time()))[:12]
+        if self.state.find(self.state.containers, name):
+            return self.send_error_json(409, f'Conflict. The container name "/{name}" is already in use')
+        network = self.body.get('HostConfig', {}).get('NetworkMode')
+        container = self.state.add_container(name, labels=self.body.get('Labels'), state='created',
+                                             networks=[network] if network in [n['Name'] for n in
+                                                                               self.state.networks.values()] else [],
+                                             image=self.body.get('Image', 'alpine:3.18'))
+        self.send_json(201, {'Id': container['Id'], 'Warnings': []})
+
+    def inspect_container(self, ref: str):
+        container = self.state.find(self.state.containers, ref)
+        if not container:
+            return self.send_error_json(404, f'No such container: {ref}')
+        self.send_json(200, container)
+
+    def container_action(self, ref: str, action: str):
+        container = self.state.find(self.state.containers, ref)
+        if not container:
+            return self.send_error_json(404, f'No such container: {ref}')
+        if action in ('stop', 'kill'):
+            self.state.set_state(container, 'exited', 0 if action == 'stop' else 137)
+        elif action == 'pause':
+            self.state.set_state(container, 'paused')
+        else:
+            if action == 'restart':
+                container['RestartCount'] += 1
+            self.state.set_state(container, 'running')
+        self.send_json(204, None)
+
+    def remove_container(self, ref: str):
+        container = self.state.find(self.state.containers, ref)
+        if not container:
+            return self.send_error_json(404, f'No such container: {ref}')
+        for network in self.state.networks.values():
+            network['Containers'].pop(container['Id'], None)
+        del self.state.containers[container['Id']]
+        self.send_json(204, None)
+
+    def list_networks(self):
+        self.send_json(200, self.state.list_networks(self.filters))
+
+    def create_network(self):
+        name = self.body.get('Name')
+        if self.state.find(self.state.networks, name):
+            return self.send_error_json(409, f'network with name {name} already exists')
+        network = self.state.add_network(name, self.body.get('Driver') or 'bridge', self.body.get('Labels'))
+        self.send_json(201, {'Id': network['Id'], 'Warning': ''})
+
+    def inspect_network(self, ref: str):
+        network = self.state.find(self.state.networks, ref)
+        if not network:
+            return self.send_error_json(404, f'network {ref} not found')
+        self.send_json(200, network)
+
+    def network_action(self, ref: str, action: str):
+        network = self.state.find(self.state.networks, ref)
+        container = self.state.find(self.state.containers, self.body.get('Container', ''))
+        if not network or not container:
+            return self.send_error_json(404, f'{"network" if not network else "container"} not found')
+        if action == 'connect':
+            if network['Name'] in container['NetworkSettings']['Networks']:
+                return self.send_error_json(403, f'endpoint with name {container["Name"].lstrip("/")} '
+                                                 f'already exists in network {network["Name"]}')
+            self.state.connect(network, container, self.body.get('EndpointConfig', {}).get('Aliases'))
+        else:
+            self.state.disconnect(network, container)
+        self.send_json(200, None)
+
+    def remove_network(self, ref: str):
+        network = self.state.find(self.state.networks, ref)
+        if not network:
+            return self.send_error_json(404, f'network {ref} not found')
+        del self.state.networks[network['Id']]
+        self.send_json(204, None)
+
+    def swarm_only(self) -> bool:
+        if not self.state.swarm:
+            self.send_error_json(503, 'This node is not a swarm manager. Use "docker swarm init" or '
+                                      '"docker swarm join" to connect this node to swarm and try again.')
+        return self.state.swarm
+
+    def list_nodes(self):
+        if self.swarm_only():
+            self.send_json(200, list(self.state.nodes.values()))
+
+    def inspect_node(self, ref: str):
+        if not self.swarm_only():
+            return
+        node = self.state.find(self.state.nodes, ref)
+        if not node:
+            return self.send_error_json(404, f'node {ref} not found')
+        self.send_json(200, node)
+
+    def update_node(self, ref: str):
+        if not self.swarm_only():
+            return
+        node = self.state.find(self.state.nodes, ref)
+        if not node:
+            return self.send_error_json(404, f'node {ref} not found')
+        node['Spec'] = self.body
+        node['Version']['Index'] += 1
+        self.send_json(200, None)
+
+    def list_services(self):
+        if self.swarm_only():
+            self.send_json(200, list(self.state.services.values()))
+
+    def create_service(self):
+        if not self.swarm_only():
+            return
+        name = self.body.get('Name')
+        if self.state.find(self.state.services, name):
+            return self.send_error_json(409, f'rpc error: code = AlreadyExists desc = name conflicts with an '
+                                             f'existing object: service {name} already exists')
+        networks = [n.get('Target') for n in self.body.get('TaskTemplate', {}).get('Networks', [])]
+        service = self.state.add_service(name, networks, self.body.get('Labels'))
+        self.send_json(201, {'ID': service['ID']})
+
+    def inspect_service(self, ref: str):
+        if not self.swarm_only():
+            return
+        service = self.state.find(self.state.services, ref)
+        if not service:
+            return self.send_error_json(404, f'service {ref} not found')
+        self.send_json(200, service)
+
+    def update_service(self, ref: str):
+        if not self.swarm_only():
+            return
+        service = self.state.find(self.state.services, ref)
+        if not service:
+            return self.send_error_json(404, f'service {ref} not found')
+        service['Spec'] = self.body
+        service['Version']['Index'] += 1
+        self.send_json(200, {'Warnings': []})
+
+
+class FakeDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeDockerDaemon:
+    """ Serves a FakeDockerState on a UNIX socket, in a background thread """
+
+    def __init__(self, socket_path: str, latency: Union[float, Dict[str, float]] = 0, **state_options):
+        """ Constructs the daemon. Call start(), or use it as a context manager
+
+        :param socket_path: path to the UNIX socket to listen on
+        :param latency: seconds to wait before answering each request. Can also be a dict of endpoint (e.g.
+        "GET /containers/json", as in ApiAccounting) to seconds, with "*" for all the other endpoints
+        :param state_options: see FakeDockerState
+        """
+        self.socket_path = socket_path
+        self.latency = latency
+        self.state = FakeDockerState(**state_options)
+        self.requests = Counter()
+        self.events = []
+        self.events_changed = threading.Condition()
+        self.stopped = False
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        return f'unix://{self.socket_path}'
+
+    def latency_of(self, endpoint: str) -> float:
+        if isinstance(self.latency, dict):
+            return self.latency.get(endpoint, self.latency.get('*', 0))
+        return self.latency
+
+    def count(self, endpoint: str) -> None:
+        with self.events_changed:
+            self.requests[endpoint] += 1
+
+    def emit(self, event: dict) -> None:
+        """ Sends an event to all the clients consuming the events stream
+
+        :param event: e.g. {"Type": "container", "Action": "die", "Actor": {"ID": ..., "Attributes": {...}}}
+        """
+        with self.events_changed:
+            self.events.append({'time': int(time.time()), 'timeNano': time.time_ns(), 'scope': 'local', **event})
+            self.events_changed.notify_all()
+
+    def start(self) -> 'FakeDockerDaemon':
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = FakeDockerServer(self.socket_path, FakeDockerRequestHandler)
+        self._server.daemon = self
+        threading.Thread(target=self._server.serve_forever, name='fake-docker', daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        with self.events_changed:
+            self.stopped = True
+            self.events_changed.notify_all()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def __enter__(self) -> 'FakeDockerDaemon':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Fake Kubernetes API server, on a local port
+
+Simulates a cluster running the NuvlaEdge engine core pod, amongst any number of nodes, pods and containers, so that
+the Kubernetes container runtime can be exercised without a cluster. Lists honour limit/continue (pagination), and
+every request can be delayed, e.g.
+
+    with FakeKubernetesApiServer(nodes=3, pods_per_node=300, latency=0.005) as server:
+        configuration = kubernetes.client.Configuration(host=server.url)
+        ...
+        print(server.requests)
+
+Only implements the parts of the API the system manager uses
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Union
+from urllib.parse import parse_qs, urlparse
+
+from system_manager.common import utils
+
+KUBELET_VERSION = 'v1.27.4+k3s1'
+ENGINE_CORE = 'nuvlaedge-engine-core'
+
+
+def make_uid(name: str) -> str:
+    """ Deterministic UID, so that runs are comparable """
+    h = hashlib.sha256(name.encode()).hexdigest()
+    return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}'
+
+
+def matches_selector(values: Dict[str, str], selector: str) -> bool:
+    """ Whether labels (or fields) match a selector, e.g. "a=b,c!=d,e" """
+    for requirement in filter(None, (selector or '').split(',')):
+        if '!=' in requirement:
+            key, value = requirement.split('!=', 1)
+            if values.get(key.strip()) == value.strip():
+                return False
+        elif '=' in requirement:
+            key, value = re.split('==?', requirement, 1)
+            if values.get(key.strip()) != value.strip():
+                return False
+        elif requirement.startswith('!'):
+            if requirement[1:].strip() in values:
+                return False
+        elif requirement.strip() not in values:
+            return False
+    return True
+
+
+class FakeKubernetesState:
+    """ Nodes and pods of the fake cluster """
+
+    def __init__(self, nodes: int = 1, pods_per_node: int = 10, containers_per_pod: int = 2,
+                 namespace: str = 'nuvlaedge', images_per_node: int = 50, log_lines: int = 100):
+        """ Builds the cluster. The first node is a master, and runs the NuvlaEdge engine core pod
+
+        :param nodes: number of nodes
+        :param pods_per_node: number of pods in each node, besides the NuvlaEdge ones
+        :param containers_per_pod: number of containers in each of these pods
+        :param namespace: namespace of the NuvlaEdge
+        :param images_per_node: number of images reported by each node
+        :param log_lines: number of lines in the logs of every container
+        """
+        self.namespace = namespace
+        self.log_lines = log_lines
+        self.nodes: List[dict] = []
+        self.pods: List[dict] = []
+        self.lock = threading.RLock()
+
+        for n in range(nodes):
+            node = self.add_node(f'node-{n}', master=n == 0, images=images_per_node)
+            if n == 0:
+                self.add_pod(ENGINE_CORE, namespace, node['metadata']['name'],
+                             [f'{utils.compose_project_name}-{c}' for c in
+                              ['agent', 'system-manager', 'compute-api', 'vpn-client', 'job-engine-lite']],
+                             labels={'component': ENGINE_CORE, 'nuvlaedge.component': 'True'})
+                self.add_pod('data-gateway', namespace, node['metadata']['name'], ['data-gateway'],
+                             labels={'component': 'data-gateway', 'nuvlaedge.component': 'True'})
+            for p in range(pods_per_node):
+                self.add_pod(f'app-{n}-{p}', f'apps-{p % 10}', node['metadata']['name'],
+                             [f'container-{c}' for c in range(containers_per_pod)],
+                             labels={'app': f'app-{p}'},
+                             phase='Pending' if p % 25 == 24 else 'Running')
+
+    @property
+    def node_names(self) -> List[str]:
+        return [n['metadata']['name'] for n in self.nodes]
+
+    def add_node(self, name: str, master: bool = False, images: int = 50) -> dict:
+        labels = {'kubernetes.io/hostname': name, 'kubernetes.io/os': 'linux', 'kubernetes.io/arch': 'amd64'}
+        if master:
+            labels.update({'node-role.kubernetes.io/master': 'true', 'node-role.kubernetes.io/control-plane': 'true'})
+        node = {
+            'apiVersion': 'v1',
+            'kind': 'Node',
+            'metadata': {'name': name, 'uid': make_uid(f'node/{name}'), 'labels': labels,
+                         'resourceVersion': '1000', 'creationTimestamp': '2023-01-01T00:00:00Z'},
+            'spec': {'podCIDR': '10.42.0.0/24'},
+            'status': {
+                'capacity': {'cpu': '4', 'memory': '8049136Ki', 'pods': '110'},
+                'allocatable': {'cpu': '4', 'memory': '8049136Ki', 'pods': '110'},
+                'conditions': [{'type': 'Ready', 'status': 'True', 'reason': 'KubeletReady',
+                                'message': 'kubelet is posting ready status',
+                                'lastHeartbeatTime': '2023-01-01T00:00:00Z',
+                                'lastTransitionTime': '2023-01-01T00:00:00Z'}],
+                'nodeInfo': {'architecture': 'amd64', 'bootID': make_uid(f'boot/{name}'),
+                             'containerRuntimeVersion': 'containerd://1.7.1-k3s1',
+                             'kernelVersion': '6.1.0', 'kubeProxyVersion': KUBELET_VERSION,
+                             'kubeletVersion': KUBELET_VERSION, 'machineID': make_uid(f'machine/{name}'),
+                             'operatingSystem': 'linux', 'osImage': 'Fake Linux',
+                             'systemUUID': make_uid(f'system/{name}')},
+                'images': [{'names': [f'docker.io/library/image-{i}:latest'], 'sizeBytes': 10000000 + i}
+                           for i in range(images)],
+            },
+        }
+        self.nodes.append(node)
+        return node
+
+    def add_pod(self, name: str, namespace: str, node_name: str, containers: List[str], labels: dict = None,
+                phase: str = 'Running') -> dict:
+        running = phase == 'Running'
+        pod = {
+            'apiVersion': 'v1',
+            'kind': 'Pod',
+            'metadata': {'name': name, 'namespace': namespace, 'uid': make_uid(f'pod/{namespace}/{name}'),
+                         'labels': labels or {}, 'resourceVersion': '1000',
+                         'creationTimestamp': '2023-01-01T00:00:00Z'},
+            'spec': {'nodeName': node_name,
+                     'containers': [{'name': c, 'image': f'docker.io/library/{c}:latest'} for c in containers]},
+            'status': {'phase': phase, 'hostIP': '10.0.0.1', 'podIP': '10.42.0.10'},
+        }
+        if running:
+            pod['status']['containerStatuses'] = [
+                {'name': c, 'ready': True, 'restartCount': 0, 'started': True,
+                 'image': f'docker.io/library/{c}:latest', 'imageID': f'sha256:{make_uid(c)}',
+                 'containerID': f'containerd://{make_uid(f"{name}/{c}")}',
+                 'state': {'running': {'startedAt': '2023-01-01T00:00:00Z'}}}
+                for c in containers]
+        self.pods.append(pod)
+        return pod
+
+    def find_pod(self, namespace: str, name: str) -> Union[dict, None]:
+        return next((p for p in self.pods
+                     if p['metadata']['namespace'] == namespace and p['metadata']['name'] == name), None)
+
+    @staticmethod
+    def fields_of(pod: dict) -> Dict[str, str]:
+        return {'metadata.name': pod['metadata']['name'],
+                'metadata.namespace': pod['metadata']['namespace'],
+                'spec.nodeName': pod['spec']['nodeName'],
+                'status.phase': pod['status']['phase']}
+
+
+class FakeKubernetesRequestHandler(BaseHTTPRequestHandler):
+    """ Routes the requests to the FakeKubernetesState of the server """
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately: do not let them wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    routes = [
+        (r'/version', 'version'),
+        (r'/api/v1/nodes', 'list_nodes'),
+        (r'/api/v1/nodes/(?P<name>[^/]+)', 'read_node'),
+        (r'/api/v1/pods', 'list_pods'),
+        (r'/api/v1/namespaces/(?P<namespace>[^/]+)/pods', 'list_pods'),
+        (r'/api/v1/namespaces/(?P<namespace>[^/]+)/pods/(?P<name>[^/]+)', 'read_pod'),
+        (r'/api/v1/namespaces/(?P<namespace>[^/]+)/pods/(?P<name>[^/]+)/log', 'read_pod_log'),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self) -> FakeKubernetesState:
+        return self.server.api_server.state
+
+    def send_body(self, code: int, body: bytes, content_type: str = 'application/json') -> None:
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, code: int, data: dict) -> None:
+        self.send_body(code, json.dumps(data).encode())
+
+    def send_status(self, code: int, reason: str, message: str) -> None:
+        self.send_json(code, {'kind': 'Status', 'apiVersion': 'v1', 'metadata': {}, 'status': 'Failure',
+                              'message': message, 'reason': reason, 'code': code})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        api_server = self.server.api_server
+        endpoint = api_server.endpoint_of(url.path)
+        api_server.count(endpoint)
+        latency = api_server.latency_of(endpoint)
+        if latency:
+            time.sleep(latency)
+
+        for pattern, name in self.routes:
+            match = re.fullmatch(pattern, url.path)
+            if match:
+                with self.state.lock:
+                    return getattr(self, name)(**match.groupdict())
+
+        self.send_status(404, 'NotFound', f'the server could not find the requested resource ({url.path})')
+
+    def send_list(self, kind: str, items: List[dict]) -> None:
+        """ Sends a list, or a page of it if a limit is given """
+        try:
+            offset = int(self.query.get('continue') or 0)
+            limit = int(self.query.get('limit') or 0)
+        except ValueError:
+            return self.send_status(410, 'Expired', 'The provided continue parameter is too old')
+
+        if limit:
+            page = items[offset:offset + limit]
+            remaining = len(items) - offset - len(page)
+        else:
+            page, remaining = items[offset:], 0
+
+        metadata = {'resourceVersion': '1000'}
+        if remaining > 0:
+            metadata.update({'continue': str(offset + len(page)), 'remainingItemCount': remaining})
+        self.send_json(200, {'kind': kind, 'apiVersion': 'v1', 'metadata': metadata, 'items': page})
+
+    def version(self):
+        self.send_json(200, {'major': '1', 'minor': '27', 'gitVersion': KUBELET_VERSION, 'platform': 'linux/amd64'})
+
+    def list_nodes(self):
+        self.send_list('NodeList', [n for n in self.state.nodes
+                                    if matches_selector(n['metadata']['labels'], self.query.get('labelSelector'))])
+
+    def read_node(self, name: str):
+        node = next((n for n in self.state.nodes if n['metadata']['name'] == name), None)
+        if not node:
+            return self.send_status(404, 'NotFound', f'nodes "{name}" not found')
+        self.send_json(200, node)
+
+    def list_pods(self, namespace: str = None):
+        pods = [p for p in self.state.pods
+                if (namespace is None or p['metadata']['namespace'] == namespace)
+                and matches_selector(p['metadata']['labels'], self.query.get('labelSelector'))
+                and matches_selector(self.state.fields_of(p), self.query.get('fieldSelector'))]
+        self.send_list('PodList', pods)
+
+    def read_pod(self, namespace: str, name: str):
+        pod = self.state.find_pod(namespace, name)
+        if not pod:
+            return self.send_status(404, 'NotFound', f'pods "{name}" not found')
+        self.send_json(200, pod)
+
+    def read_pod_log(self, namespace: str, name: str):
+        pod = self.state.find_pod(namespace, name)
+        container = self.query.get('container')
+        if not pod or not container:
+            return self.send_status(404 if not pod else 400, 'NotFound' if not pod else 'BadRequest',
+                                    f'pods "{name}" not found' if not pod else 'a container name must be specified')
+
+        lines = int(self.query.get('tailLines') or self.state.log_lines)
+        timestamps = self.query.get('timestamps') == 'true'
+        log = ''.join(('2023-01-01T00:00:00.000000000Z ' if timestamps else '') +
+                      f'{container}: log line {i}\n'
+                      for i in range(max(0, self.state.log_lines - lines), self.state.log_lines))
+        self.send_body(200, log.encode(), 'text/plain')
+
+
+class FakeKubernetesApiServer:
+    """ Serves a FakeKubernetesState on a local port, in a background thread """
+
+    def __init__(self, latency: Union[float, Dict[str, float]] = 0, port: int = 0, **state_options):
+        """ Constructs the server. Call start(), or use it as a context manager
+
+        :param latency: seconds to wait before answering each request. Can also be a dict of endpoint (e.g.
+        "GET /api/v1/pods") to seconds, with "*" for all the other endpoints
+        :param port: local port. 0 picks a free one
+        :param state_options: see FakeKubernetesState
+        """
+        self.latency = latency
+        self.port = port
+        self.state = FakeKubernetesState(**state_options)
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    def endpoint_of(self, path: str) -> str:
+        """ Endpoint, without object names, e.g. GET /api/v1/namespaces/{namespace}/pods """
+        path = re.sub(r'^/api/v1/namespaces/[^/]+', '/api/v1/namespaces/{namespace}', path)
+        path = re.sub(r'^(/api/v1/(nodes|namespaces/\{namespace}/pods))/[^/]+', r'\1/{name}', path)
+        return f'GET {path}'
+
+    def latency_of(self, endpoint: str) -> float:
+        if isinstance(self.latency, dict):
+            return self.latency.get(endpoint, self.latency.get('*', 0))
+        return self.latency
+
+    def count(self, endpoint: str) -> None:
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def start(self) -> 'FakeKubernetesApiServer':
+        self._server = ThreadingHTTPServer(('127.0.0.1', self.port), FakeKubernetesRequestHandler)
+        self._server.daemon_threads = True
+        self._server.api_server = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name='fake-kubernetes', daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> 'FakeKubernetesApiServer':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
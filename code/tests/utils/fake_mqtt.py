@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Fake MQTT broker, on a local port
+
+Speaks enough MQTT 3.1.1 (QoS 0 only) for the Data Gateway probes to be exercised without mosquitto: connections,
+subscriptions with wildcards, retained messages and pings. Brokers can be slowed down, made to refuse connections or
+to silently drop messages, e.g.
+
+    with FakeMqttBroker(latency=0.01) as broker:
+        with MqttClient('127.0.0.1', broker.port) as client:
+            ...
+        print(broker.connections)
+"""
+
+import socketserver
+import struct
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from system_manager.common import Mqtt
+
+
+class FakeMqttHandler(socketserver.BaseRequestHandler):
+
+    def setup(self):
+        self.broker = self.server.broker
+        self.subscriptions: List[str] = []
+        self.send_lock = threading.Lock()
+
+    def send(self, data: bytes) -> None:
+        with self.send_lock:
+            self.request.sendall(data)
+
+    def read_exactly(self, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('Client went away')
+            data += chunk
+        return data
+
+    def read_packet(self) -> Tuple[int, bytes]:
+        packet_type = self.read_exactly(1)[0]
+        length, multiplier = 0, 1
+        while True:
+            byte = self.read_exactly(1)[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return packet_type, self.read_exactly(length)
+
+    def handle(self):
+        try:
+            packet_type, _ = self.read_packet()
+            if packet_type != Mqtt.CONNECT:
+                return
+            with self.broker.lock:
+                self.broker.connections += 1
+            if self.broker.silent:
+                # accepts the connection, and then never answers
+                while self.read_exactly(1):
+                    pass
+            self.send(Mqtt.packet(Mqtt.CONNACK, bytes([0, self.broker.connack_code])))
+            if self.broker.connack_code:
+                return
+
+            self.broker.add_session(self)
+            while True:
+                packet_type, body = self.read_packet()
+                kind = packet_type & 0xF0
+                if kind == Mqtt.PUBLISH:
+                    topic_length = struct.unpack('!H', body[:2])[0]
+                    topic = body[2:2 + topic_length].decode()
+                    self.broker.route(topic, body[2 + topic_length:], retain=bool(packet_type & 0x01))
+                elif kind == Mqtt.SUBSCRIBE & 0xF0:
+                    self.subscribe(body)
+                elif kind == Mqtt.PINGREQ:
+                    self.send(Mqtt.packet(Mqtt.PINGRESP))
+                elif kind == Mqtt.DISCONNECT:
+                    return
+        except (ConnectionError, OSError):
+            return
+        finally:
+            self.broker.remove_session(self)
+
+    def subscribe(self, body: bytes) -> None:
+        packet_id, offset, filters = body[:2], 2, []
+        while offset < len(body):
+            length = struct.unpack('!H', body[offset:offset + 2])[0]
+            filters.append(body[offset + 2:offset + 2 + length].decode())
+            offset += 2 + length + 1
+
+        self.subscriptions += filters
+        self.send(Mqtt.packet(Mqtt.SUBACK, packet_id + b'\x00' * len(filters)))
+        for topic, payload in self.broker.retained_for(filters):
+            self.deliver(topic, payload)
+
+    def deliver(self, topic: str, payload: bytes) -> None:
+        if any(Mqtt.topic_matches(f, topic) for f in self.subscriptions):
+            self.send(Mqtt.packet(Mqtt.PUBLISH, Mqtt.encode_string(topic) + payload))
+
+
+class FakeMqttBroker:
+    """ MQTT broker on a local port, served from background threads """
+
+    def __init__(self, latency: float = 0, port: int = 0, retained: Dict[str, bytes] = None):
+        """ Constructs the broker. Call start(), or use it as a context manager
+
+        :param latency: seconds to wait before delivering each message
+        :param port: local port. 0 picks a free one
+        :param retained: retained messages, by topic, e.g. $SYS topics
+        """
+        self.latency = latency
+        self.port = port
+        self.retained: Dict[str, bytes] = dict(retained or {})
+        # return code of the CONNACK. Anything but 0 refuses the connections
+        self.connack_code = 0
+        # whether to never answer the clients
+        self.silent = False
+        # whether to route the published messages to the subscribers
+        self.deliver = True
+        self.connections = 0
+        self.published: List[Tuple[str, bytes]] = []
+        self.lock = threading.Lock()
+        self._sessions: List[FakeMqttHandler] = []
+        self._server = None
+
+    def add_session(self, session: FakeMqttHandler) -> None:
+        with self.lock:
+            self._sessions.append(session)
+
+    def remove_session(self, session: FakeMqttHandler) -> None:
+        with self.lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+
+    def retained_for(self, filters: List[str]) -> List[Tuple[str, bytes]]:
+        with self.lock:
+            return [(t, p) for t, p in self.retained.items() if any(Mqtt.topic_matches(f, t) for f in filters)]
+
+    def route(self, topic: str, payload: bytes, retain: bool = False) -> None:
+        """ Delivers a message to all the matching subscriptions """
+        with self.lock:
+            self.published.append((topic, payload))
+            if retain:
+                self.retained[topic] = payload
+            sessions = list(self._sessions) if self.deliver else []
+
+        if self.latency:
+            time.sleep(self.latency)
+        for session in sessions:
+            try:
+                session.deliver(topic, payload)
+            except OSError:
+                pass
+
+    def start(self) -> 'FakeMqttBroker':
+        self._server = socketserver.ThreadingTCPServer(('127.0.0.1', self.port), FakeMqttHandler)
+        self._server.daemon_threads = True
+        self._server.broker = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name='fake-mqtt', daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> 'FakeMqttBroker':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()